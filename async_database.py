@@ -0,0 +1,263 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from storage import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, create_storage
+
+# Сколько последних замеров хранится для перцентилей задержки
+LATENCY_SAMPLES = 1000
+
+class _Lane:
+    """Очередь вызовов хранилища: ограниченное число ожидающих, метрики глубины и задержки.
+
+    executor=None - вызов сам возвращает Future (групповой коммит), поток не занимается.
+    """
+
+    def __init__(self, name, workers, max_pending):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"storage-{name}") if workers else None
+        self._slots = None  # asyncio.Semaphore создается в цикле событий при первом вызове
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._waits = deque(maxlen=LATENCY_SAMPLES)
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def _enter(self):
+        """Учет поставленного в очередь вызова"""
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+    def _start(self, enqueued):
+        """Учет начала выполнения вызова"""
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._waits.append(time.perf_counter() - enqueued)
+
+    def _finish(self, enqueued, failed):
+        """Учет завершения вызова"""
+        with self._lock:
+            self._running -= 1
+            self._completed += 1
+            self._failed += failed
+            self._latencies.append(time.perf_counter() - enqueued)
+
+    async def run(self, func, *args):
+        """Выполнение блокирующего вызова в потоке исполнителя без блокировки цикла событий"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        # Переполненная очередь задерживает вызывающего, а не растет без границ
+        async with self._slots:
+            enqueued = time.perf_counter()
+            self._enter()
+
+            def call():
+                self._start(enqueued)
+                failed = True
+                try:
+                    result = func(*args)
+                    failed = False
+                    return result
+                finally:
+                    self._finish(enqueued, failed)
+
+            return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def wait(self, submit, *args):
+        """Ожидание Future, который возвращает submit(*args), например записи группового коммита"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        # До коммита запись считается стоящей в очереди
+        async with self._slots:
+            enqueued = time.perf_counter()
+            self._enter()
+            failed = True
+            try:
+                result = await asyncio.wrap_future(submit(*args))
+                failed = False
+                return result
+            finally:
+                self._start(enqueued)
+                self._finish(enqueued, failed)
+
+    def stats(self):
+        """Метрики очереди: глубина, выполнение, задержки в миллисекундах"""
+        with self._lock:
+            waits = sorted(self._waits)
+            latencies = sorted(self._latencies)
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'queue_depth': self._queued,
+                'max_queue_depth': self._max_queued,
+                'running': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'avg_wait_ms': round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+                'avg_latency_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+                'p95_latency_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 3) if latencies else 0.0
+            }
+
+    def close(self):
+        """Остановка потоков исполнителя после завершения поставленных вызовов"""
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+class AsyncDatabaseManager:
+    """Асинхронный фасад хранилища для сервера на asyncio.
+
+    Чтения идут в ограниченный пул потоков, все изменения - в единственный поток писателя,
+    сообщения - в групповой коммит хранилища без занятия потока. Цикл событий не блокируется.
+    """
+
+    def __init__(self, storage=None, read_workers=4, max_pending=256, **storage_options):
+        # Переданное хранилище закрывает его владелец, созданное здесь - close() фасада
+        self._owns_storage = storage is None
+        self.storage = storage or create_storage(**storage_options)
+        self.read_lane = _Lane('read', read_workers, max_pending)
+        self.write_lane = _Lane('write', 1, max_pending)
+        self.commit_lane = _Lane('commit', 0, max_pending)
+
+    def stats(self):
+        """Метрики очередей чтения, записи и группового коммита"""
+        return {
+            'read': self.read_lane.stats(),
+            'write': self.write_lane.stats(),
+            'commit': self.commit_lane.stats()
+        }
+
+    def close(self):
+        """Завершение поставленных вызовов и закрытие созданного фасадом хранилища"""
+        self.read_lane.close()
+        self.write_lane.close()
+        if self._owns_storage:
+            self.storage.close()
+
+    # Пользователи
+
+    async def register_user(self, username, display_name, password):
+        """Регистрация нового пользователя"""
+        return await self.write_lane.run(self.storage.register_user, username, display_name, password)
+
+    async def authenticate_user(self, username, password):
+        """Аутентификация пользователя"""
+        return await self.read_lane.run(self.storage.authenticate_user, username, password)
+
+    async def find_user_by_display_name(self, display_name):
+        """Поиск пользователя по имени аккаунта"""
+        return await self.read_lane.run(self.storage.find_user_by_display_name, display_name)
+
+    async def search_users(self, prefix, limit=10):
+        """Поиск пользователей по справочнику в памяти - без потока исполнителя"""
+        return self.storage.search_users(prefix, limit)
+
+    async def get_user_display_name(self, user_id):
+        """Получение имени пользователя по ID"""
+        return await self.read_lane.run(self.storage.get_user_display_name, user_id)
+
+    async def change_display_name(self, user_id, new_display_name):
+        """Изменение имени пользователя"""
+        return await self.write_lane.run(self.storage.change_display_name, user_id, new_display_name)
+
+    # Чаты
+
+    async def create_chat(self, chat_type, participants):
+        """Создание нового чата"""
+        return await self.write_lane.run(self.storage.create_chat, chat_type, participants)
+
+    async def get_or_create_private_chat(self, user1_id, user2_id):
+        """Получение или создание приватного чата между двумя пользователями"""
+        return await self.write_lane.run(self.storage.get_or_create_private_chat, user1_id, user2_id)
+
+    async def get_user_chat_ids(self, user_id):
+        """ID чатов пользователя"""
+        return await self.read_lane.run(self.storage.get_user_chat_ids, user_id)
+
+    async def get_user_chats(self, user_id):
+        """Получение чатов пользователя"""
+        return await self.read_lane.run(self.storage.get_user_chats, user_id)
+
+    async def get_chat_info(self, user_id, chat_id):
+        """Получение информации о чате"""
+        return await self.read_lane.run(self.storage.get_chat_info, user_id, chat_id)
+
+    async def get_all_chats(self):
+        """Получение всех чатов для веб-API"""
+        return await self.read_lane.run(self.storage.get_all_chats)
+
+    async def clear_user_chat_history(self, user_id):
+        """Очистка истории чатов пользователя"""
+        return await self.write_lane.run(self.storage.clear_user_chat_history, user_id)
+
+    async def mark_read(self, user_id, chat_id, message_id=None):
+        """Отметка чата прочитанным"""
+        return await self.write_lane.run(self.storage.mark_read, user_id, chat_id, message_id)
+
+    # Сообщения
+
+    async def save_message(self, chat_id, sender_id, content, encrypted_content=None, message_type="normal"):
+        """Сохранение сообщения через групповой коммит"""
+        try:
+            await self.commit_lane.wait(self.storage.save_message_async, chat_id, sender_id, content,
+                                        encrypted_content, message_type)
+            return True
+        except Exception as e:
+            return False
+
+    async def get_chat_messages(self, chat_id, limit=DEFAULT_PAGE_SIZE, before_id=None, after_id=None, direction=None):
+        """Получение сообщений чата"""
+        return await self.read_lane.run(self.storage.get_chat_messages, chat_id, limit, before_id, after_id, direction)
+
+    async def get_chat_messages_page(self, chat_id, limit=DEFAULT_PAGE_SIZE, before_id=None, after_id=None,
+                                     direction=None):
+        """Страница истории чата по курсору"""
+        return await self.read_lane.run(self.storage.get_chat_messages_page, chat_id, limit, before_id, after_id,
+                                        direction)
+
+    async def get_messages_since(self, chat_id, after_id=0, limit=MAX_PAGE_SIZE):
+        """Сообщения чата новее водяной отметки after_id"""
+        return await self.read_lane.run(self.storage.get_messages_since, chat_id, after_id, limit)
+
+    async def search_messages(self, user_id, query, limit=20, cursor=None):
+        """Поиск по обычным сообщениям в чатах пользователя"""
+        return await self.read_lane.run(self.storage.search_messages, user_id, query, limit, cursor)
+
+    # Защищенные чаты
+
+    async def create_secure_chat_session(self, chat_key, encryption_key=None):
+        """Создание защищенной сессии чата"""
+        return await self.write_lane.run(self.storage.create_secure_chat_session, chat_key, encryption_key)
+
+    async def get_secure_chat_session(self, chat_key):
+        """Получение защищенной сессии чата по ключу"""
+        return await self.read_lane.run(self.storage.get_secure_chat_session, chat_key)
+
+    async def save_secure_message(self, chat_key, sender_id, content):
+        """Сохранение защищенного сообщения: поиск сессии и шифрование в потоке чтения, запись - групповым коммитом"""
+        try:
+            future = await self.read_lane.run(self.storage.save_secure_message_async, chat_key, sender_id, content)
+            return await self.commit_lane.wait(lambda: future) is not None
+        except Exception as e:
+            return False
+
+    async def get_secure_messages(self, chat_key):
+        """Получение защищенных сообщений"""
+        return await self.read_lane.run(self.storage.get_secure_messages, chat_key)
+
+    async def clear_secure_chat(self, chat_id):
+        """Очистка защищенного чата"""
+        return await self.write_lane.run(self.storage.clear_secure_chat, chat_id)
+
+    async def close_secure_chat(self, chat_key):
+        """Закрытие защищенного чата"""
+        return await self.write_lane.run(self.storage.close_secure_chat, chat_key)
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import sys
+from async_database import AsyncDatabaseManager
+from framing import HEADER_SIZE, FrameTooLarge, check_frame_size
+from outbound import OutboundQueue
+from server import SecureMessengerServer
+
+# Потоки для обработчиков: блокирующая работа с хранилищем не останавливает цикл событий
+DEFAULT_WORKERS = 16
+# Очередь принятых ядром, но еще не обработанных подключений
+DEFAULT_BACKLOG = 1024
+# Обработчики, ожидающие своей очереди; дальше чтение подключений приостанавливается
+DEFAULT_MAX_PENDING = 256
+
+# Сообщения, которые меняют данные: выполняются по одному в потоке писателя хранилища
+WRITE_MESSAGE_TYPES = frozenset({
+    'register', 'create_chat', 'clear_chat_history', 'create_secure_chat', 'close_secure_chat',
+    'auto_close_secure_chat', 'change_display_name', 'mark_read'
+})
+
+class _StreamConnection(OutboundQueue):
+    """Подключение asyncio для обработчиков SecureMessengerServer: сокет (close) и исходящая очередь (put).
+
+    Кадры из любого потока попадают в ограниченную очередь цикла событий; задача-писатель
+    отправляет их с ожиданием drain(), так что медленный клиент задерживает только свою очередь.
+    """
+
+    def __init__(self, loop, writer, address, max_frames, policy):
+        super().__init__(max_frames, policy)
+        self.loop = loop
+        self.writer = writer
+        self.address = address
+        self._ready = asyncio.Event()
+        self._task = loop.create_task(self._drain_loop())
+
+    def put(self, frame):
+        """Постановка кадра из любого потока; политика переполнения применяется в цикле событий"""
+        if self.closed:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._enqueue, frame)
+        except RuntimeError:
+            return False  # цикл событий уже остановлен
+        return True
+
+    def _enqueue(self, frame):
+        if self.closed:
+            return
+        if not self._offer(frame):
+            self._close()  # медленный клиент отключается, чтение завершится с EOF
+            return
+        self._ready.set()
+
+    async def _drain_loop(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._frames and not self.closed:
+                    self.writer.write(self._frames.popleft())
+                    self.sent += 1
+                    await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def close(self):
+        """Закрытие подключения из любого потока"""
+        try:
+            self.loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            pass  # цикл событий уже остановлен, транспорт закрыт вместе с ним
+
+    def _close(self):
+        self.closed = True
+        self._frames.clear()
+        self._ready.set()
+        if not self.writer.is_closing():
+            self.writer.close()
+
+class AsyncSecureMessengerServer(SecureMessengerServer):
+    """Сервер на цикле событий asyncio с тем же протоколом и обработчиками, что SecureMessengerServer.
+
+    Простаивающее подключение - это корутина чтения без отдельного потока; сообщения клиента
+    обрабатываются по очереди через AsyncDatabaseManager, поэтому их порядок сохраняется:
+    чтения - в пуле потоков, изменения - в потоке писателя, отправка сообщений - групповым коммитом.
+    """
+
+    def __init__(self, host='localhost', port=5000, workers=DEFAULT_WORKERS, backlog=DEFAULT_BACKLOG,
+                 reuse_port=False, outbound_queue_size=None, overflow_policy=None, storage=None,
+                 max_pending=DEFAULT_MAX_PENDING):
+        super().__init__(host, port, outbound_queue_size, overflow_policy, storage)
+        self.workers = workers
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.max_pending = max_pending
+        self.storage = None
+        self.loop = None
+        self.connections = set()
+        self._server = None
+
+    def start(self):
+        """Запуск сервера: цикл событий работает в текущем потоке до остановки"""
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            self.logger.error(f"Ошибка запуска сервера: {e}")
+            print(f"Ошибка запуска сервера: {e}")
+        finally:
+            self.stop()
+
+    async def serve(self):
+        """Прием подключений до остановки сервера"""
+        self.loop = asyncio.get_running_loop()
+        self.storage = AsyncDatabaseManager(self.db, read_workers=self.workers, max_pending=self.max_pending)
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=self.backlog, reuse_address=True,
+            reuse_port=self.reuse_port or None
+        )
+        self.running = True
+
+        self.logger.info(f"Сервер asyncio запущен на {self.host}:{self.port}")
+        print(f"Сервер asyncio запущен на {self.host}:{self.port} (потоков обработчиков: {self.workers})")
+        print("Ожидание подключений...")
+
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass  # serve_forever отменяется закрытием сервера в stop()
+
+    async def handle_connection(self, reader, writer):
+        """Чтение сообщений клиента: кадры из 4 байт длины + JSON"""
+        address = writer.get_extra_info('peername')
+        connection = _StreamConnection(self.loop, writer, address, self.outbound_queue_size, self.overflow_policy)
+        self.connections.add(connection)
+        self.outbound[connection] = connection
+        self.logger.info(f"Новое подключение от {address}")
+
+        try:
+            while self.running:
+                try:
+                    length_data = await reader.readexactly(HEADER_SIZE)
+                    message = await reader.readexactly(check_frame_size(int.from_bytes(length_data, 'big')))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except FrameTooLarge as e:
+                    self.logger.warning(f"Подключение {address} закрыто: {e}")
+                    break
+
+                try:
+                    message_data = json.loads(message.decode('utf-8'))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    self.logger.warning(f"Неверный формат JSON от {address}")
+                    continue
+
+                try:
+                    if not await self.dispatch_async(connection, message_data):
+                        break
+                except Exception as e:
+                    self.logger.error(f"Ошибка обработки сообщения от {address}: {e}")
+                    break
+        except asyncio.CancelledError:
+            pass  # остановка сервера: цикл событий отменяет задачи подключений
+        finally:
+            self.connections.discard(connection)
+            self.remove_client(connection)
+            self.close_outbound(connection)
+
+    async def dispatch_async(self, connection, message_data):
+        """Выбор очереди хранилища по типу сообщения; False - клиент попросил отключиться"""
+        message_type = message_data.get('type')
+        if message_type == 'send_message':
+            await self.handle_send_message_async(connection, message_data)
+            return True
+        lane = self.storage.write_lane if message_type in WRITE_MESSAGE_TYPES else self.storage.read_lane
+        return await lane.run(self.dispatch_message, connection, message_data)
+
+    async def handle_send_message_async(self, connection, message_data):
+        """Отправка сообщения: запись ждет группового коммита, не занимая поток обработчика"""
+        if connection not in self.clients:
+            return
+
+        event = self.new_message_event(connection, message_data)
+        if await self.storage.save_message(event['chat_id'], event['sender_id'], event['content'],
+                                           event['encrypted_content'], event['message_type']):
+            self.broadcast_to_chat(event['chat_id'], event, exclude=connection)
+
+    def get_storage_stats(self):
+        """Метрики очередей хранилища: глубина, ожидание и задержка чтений, записей и коммитов"""
+        return self.storage.stats() if self.storage else {}
+
+    def stop(self):
+        """Остановка сервера"""
+        if self.loop and self._server:
+            try:
+                self.loop.call_soon_threadsafe(self._server.close)
+            except RuntimeError:
+                pass
+            for connection in list(self.connections):
+                connection.close()
+
+        super().stop()
+
+        if self.storage:
+            self.storage.close()  # хранилище сервера остается открытым, закрываются только очереди
+
+def main():
+    """Точка входа командной строки"""
+    if len(sys.argv) > 3 or (len(sys.argv) == 3 and not sys.argv[2].isdigit()):
+        print("Использование: python async_server.py [хост] [порт]")
+        sys.exit(1)
+
+    host = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    server = AsyncSecureMessengerServer(host, port)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        print("\nПолучен сигнал остановки...")
+        server.stop()
+
+if __name__ == "__main__":
+    main()
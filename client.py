@@ -13,6 +13,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer, QSize
 from PyQt6.QtGui import QIcon, QFont, QPixmap, QPalette, QColor
 from crypto_utils import CryptoManager
+from framing import FrameReader, encode_frame
 
 class NetworkThread(QThread):
     """Поток для сетевого взаимодействия"""
@@ -24,6 +25,7 @@ class NetworkThread(QThread):
         self.host = host
         self.port = port
         self.socket = None
+        self.frames = None
         self.running = False
         
     def run(self):
@@ -31,6 +33,7 @@ class NetworkThread(QThread):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self.frames = FrameReader(self.socket)
             self.running = True
             
             self.connection_status.emit(True, "Подключено")
@@ -55,32 +58,14 @@ class NetworkThread(QThread):
     def send_message(self, message):
         """Отправка сообщения"""
         try:
-            message_bytes = message.encode('utf-8')
-            message_length = len(message_bytes).to_bytes(4, 'big')
-            self.socket.send(message_length + message_bytes)
+            self.socket.sendall(encode_frame(message))
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
     
     def receive_message(self):
         """Получение сообщения"""
         try:
-            # Получаем длину сообщения
-            length_data = self.socket.recv(4)
-            if not length_data:
-                return None
-                
-            message_length = int.from_bytes(length_data, 'big')
-            
-            # Получаем само сообщение
-            message_data = b''
-            while len(message_data) < message_length:
-                chunk = self.socket.recv(min(message_length - len(message_data), 1024))
-                if not chunk:
-                    return None
-                message_data += chunk
-                
-            return message_data.decode('utf-8')
-            
+            return self.frames.read_message()
         except Exception as e:
             print(f"Ошибка получения сообщения: {e}")
             return None
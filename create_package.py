@@ -23,7 +23,14 @@ def create_distribution_package():
     files_to_copy = [
         "server.py",
         "client.py", 
+        "framing.py",
+        "outbound.py",
         "database.py",
+        "storage.py",
+        "memory_storage.py",
+        "user_directory.py",
+        "message_archive.py",
+        "secure_sessions.py",
         "crypto_utils.py",
         "simple_web_server.py",
         "index.html",
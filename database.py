@@ -1,19 +1,1551 @@
 import sqlite3
-import hashlib
+import json
 import os
+import queue
+import shutil
+import threading
+import time
 import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from crypto_utils import CryptoManager
+from message_archive import MessageArchive
+from secure_sessions import SecureSessionRegistry
+from storage import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, StorageBackend
+from user_directory import UserDirectory
 
-class DatabaseManager:
-    def __init__(self, db_path="messenger.db"):
+# Профили хранения: PRAGMA-настройки SQLite для разных требований к надежности
+STORAGE_PROFILES = {
+    # Каждый коммит сбрасывается на диск
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8000,          # ~8 МБ
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,   # страниц
+        'journal_size_limit': 64 * 1024 * 1024
+    },
+    # WAL + NORMAL: при сбое питания теряются лишь последние коммиты, база не повреждается
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -32000,         # ~32 МБ
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+        'journal_size_limit': 64 * 1024 * 1024
+    },
+    # Максимальная скорость записи, fsync отдается операционной системе
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -128000,        # ~128 МБ
+        'mmap_size': 512 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+        'wal_autocheckpoint': 4000,
+        'journal_size_limit': 256 * 1024 * 1024
+    }
+}
+
+DEFAULT_STORAGE_PROFILE = 'balanced'
+
+def _migration_secure_chat_key(cursor):
+    """Добавление поля chat_key в secure_chats"""
+    cursor.execute("PRAGMA table_info(secure_chats)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'chat_key' not in columns:
+        # SQLite не умеет добавлять UNIQUE-колонку, поэтому уникальность задаем индексом
+        cursor.execute('ALTER TABLE secure_chats ADD COLUMN chat_key TEXT')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_secure_chats_chat_key ON secure_chats (chat_key)')
+
+def _migration_secondary_indexes(cursor):
+    """Вторичные индексы для списков чатов, истории сообщений и поиска пользователей"""
+    # История чата: get_chat_messages, clear_user_chat_history
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages (chat_id, created_at)')
+    # Чаты пользователя: get_user_chats, clear_user_chat_history
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_participants_user ON chat_participants (user_id, chat_id)')
+    # Участники чата: get_user_chats, get_chat_info
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_participants_chat ON chat_participants (chat_id, user_id)')
+    # Поиск по имени аккаунта: find_user_by_display_name, change_display_name
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_display_name ON users (display_name)')
+
+# Длина превью последнего сообщения в списке чатов
+SUMMARY_PREVIEW_LENGTH = 200
+
+def _refresh_chat_summaries(cursor, chat_ids=None, messages=True, participants=True, message_cursor=None):
+    """Пересчет денормализованной сводки chat_summary для указанных чатов (None - для всех).
+    
+    message_cursor - курсор базы шарда, если сообщения лежат не в основной базе.
+    """
+    if chat_ids is None:
+        chat_ids = [row[0] for row in cursor.execute("SELECT id FROM chats").fetchall()]
+    chat_ids = list(set(chat_ids))
+    
+    cursor.executemany("INSERT OR IGNORE INTO chat_summary (chat_id) VALUES (?)", [(chat_id,) for chat_id in chat_ids])
+    
+    if messages and message_cursor is not None:
+        stats = []
+        for chat_id in chat_ids:
+            count, last_id = message_cursor.execute(
+                "SELECT COUNT(*), MAX(id) FROM messages WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            last = message_cursor.execute(
+                "SELECT substr(content, 1, ?), created_at FROM messages WHERE id = ?", (SUMMARY_PREVIEW_LENGTH, last_id)
+            ).fetchone() or (None, None)
+            stats.append((count, last_id, last[0], last[1], chat_id))
+        cursor.executemany('''
+            UPDATE chat_summary SET
+                message_count = ?, last_message_id = ?, last_message_preview = ?, last_activity_at = ?
+            WHERE chat_id = ?
+        ''', stats)
+    elif messages:
+        cursor.executemany('''
+            UPDATE chat_summary SET
+                message_count = (SELECT COUNT(*) FROM messages WHERE chat_id = :chat_id),
+                last_message_id = (SELECT MAX(id) FROM messages WHERE chat_id = :chat_id),
+                last_message_preview = (
+                    SELECT substr(content, 1, :preview) FROM messages
+                    WHERE id = (SELECT MAX(id) FROM messages WHERE chat_id = :chat_id)
+                ),
+                last_activity_at = (
+                    SELECT created_at FROM messages
+                    WHERE id = (SELECT MAX(id) FROM messages WHERE chat_id = :chat_id)
+                )
+            WHERE chat_id = :chat_id
+        ''', [{'chat_id': chat_id, 'preview': SUMMARY_PREVIEW_LENGTH} for chat_id in chat_ids])
+    
+    if participants:
+        for chat_id in chat_ids:
+            cursor.execute('''
+                SELECT u.id, u.display_name FROM chat_participants cp
+                JOIN users u ON cp.user_id = u.id
+                WHERE cp.chat_id = ?
+                ORDER BY cp.id
+            ''', (chat_id,))
+            members = [list(row) for row in cursor.fetchall()]
+            cursor.execute(
+                "UPDATE chat_summary SET participants = ? WHERE chat_id = ?",
+                (json.dumps(members, ensure_ascii=False), chat_id)
+            )
+
+def _recount_unread(cursor, chat_ids, message_cursor=None, archive=None):
+    """Пересчет chat_reads.unread_count после удаления сообщений из чатов.
+    
+    Считаются чужие сообщения после отметки прочтения - в messages и в архиве шарда.
+    """
+    message_cursor = message_cursor or cursor
+    updates = []
+    for chat_id in set(chat_ids):
+        reads = cursor.execute(
+            "SELECT user_id, last_read_message_id FROM chat_reads WHERE chat_id = ? AND unread_count > 0", (chat_id,)
+        ).fetchall()
+        for user_id, last_read in reads:
+            unread = message_cursor.execute(
+                "SELECT COUNT(*) FROM messages WHERE chat_id = ? AND id > ? AND sender_id != ?",
+                (chat_id, last_read, user_id)
+            ).fetchone()[0]
+            if archive is not None:
+                unread += archive.count_after(chat_id, last_read, exclude_sender_id=user_id)
+            updates.append((unread, chat_id, user_id))
+    cursor.executemany("UPDATE chat_reads SET unread_count = ? WHERE chat_id = ? AND user_id = ?", updates)
+
+def _apply_message_to_summary(cursor, chat_id, message_id, sender_id, content, created_at):
+    """Учет нового сообщения в сводке чата и счетчиках непрочитанных за O(участников)"""
+    update = '''
+        UPDATE chat_summary SET
+            message_count = message_count + 1,
+            last_message_id = :message_id,
+            last_message_preview = substr(:content, 1, :preview),
+            last_activity_at = :created_at
+        WHERE chat_id = :chat_id
+    '''
+    params = {'chat_id': chat_id, 'message_id': message_id, 'content': content,
+              'created_at': created_at, 'preview': SUMMARY_PREVIEW_LENGTH}
+    cursor.execute(update, params)
+    
+    if cursor.rowcount == 0:
+        # Чат без сводки (создан в обход create_chat) - заводим ее и учитываем сообщение
+        _refresh_chat_summaries(cursor, [chat_id], messages=False)
+        cursor.execute(update, params)
+    
+    # Остальным участникам сообщение добавляется в непрочитанные, для отправителя чат прочитан
+    cursor.execute(
+        "UPDATE chat_reads SET unread_count = unread_count + 1 WHERE chat_id = ? AND user_id != ?",
+        (chat_id, sender_id)
+    )
+    cursor.execute('''
+        UPDATE chat_reads SET last_read_message_id = MAX(last_read_message_id, ?), unread_count = 0
+        WHERE chat_id = ? AND user_id = ?
+    ''', (message_id, chat_id, sender_id))
+
+@contextmanager
+def _summary_cursor(summary_pool, cursor):
+    """Курсор для обновления chat_summary из транзакции над сообщениями.
+    
+    Возвращает (курсор сводки, курсор сообщений для пересчета или None, если база одна).
+    Порядок блокировок всегда: писатель шарда, затем писатель основной базы.
+    """
+    with summary_pool.writer() as conn:
+        yield conn.cursor(), (None if conn is cursor.connection else cursor)
+
+def _migration_chat_summary(cursor):
+    """Денормализованная сводка чатов для get_user_chats"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_summary (
+            chat_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_message_id INTEGER,
+            last_message_preview TEXT,
+            last_activity_at TIMESTAMP,
+            participants TEXT NOT NULL DEFAULT '[]',
+            FOREIGN KEY (chat_id) REFERENCES chats (id)
+        )
+    ''')
+    _refresh_chat_summaries(cursor)
+
+def _migration_message_keyset_index(cursor):
+    """Индекс (chat_id, id) для постраничной загрузки истории по курсору"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages (chat_id, id)')
+
+def _migration_message_search(cursor):
+    """Полнотекстовый индекс FTS5 по обычным сообщениям (защищенные не индексируются)"""
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                content='messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite собран без FTS5 - поиск будет работать через LIKE
+        print(f"⚠️ FTS5 недоступен, полнотекстовый индекс не создан: {e}")
+        return
+    
+    # Триггеры держат индекс в синхронизации с messages
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        WHEN new.message_type IS NOT 'secure'
+        BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        WHEN old.message_type IS NOT 'secure'
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, message_type ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content)
+                SELECT 'delete', old.id, old.content WHERE old.message_type IS NOT 'secure';
+            INSERT INTO messages_fts (rowid, content)
+                SELECT new.id, new.content WHERE new.message_type IS NOT 'secure';
+        END
+    ''')
+    
+    cursor.execute("INSERT INTO messages_fts (rowid, content) SELECT id, content FROM messages WHERE message_type IS NOT 'secure'")
+
+def _fts_query(text):
+    """Безопасный запрос FTS5: каждое слово в кавычках, последнее - как префикс"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def _migration_private_chat_pairs(cursor):
+    """Каноническая пара (min_user_id, max_user_id) -> приватный чат"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS private_chat_pairs (
+            min_user_id INTEGER NOT NULL,
+            max_user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL UNIQUE,
+            PRIMARY KEY (min_user_id, max_user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Заполняем по существующим приватным чатам; при дубликатах остается самый ранний чат
+    cursor.execute('''
+        INSERT OR IGNORE INTO private_chat_pairs (min_user_id, max_user_id, chat_id)
+        SELECT MIN(cp.user_id), MAX(cp.user_id), cp.chat_id
+        FROM chat_participants cp
+        JOIN chats c ON c.id = cp.chat_id
+        WHERE c.chat_type = 'private'
+        GROUP BY cp.chat_id
+        HAVING COUNT(*) <= 2
+        ORDER BY cp.chat_id
+    ''')
+
+def _migration_archive_counts(cursor):
+    """Счетчик сообщений, перенесенных в архив, в сводке чата"""
+    cursor.execute("ALTER TABLE chat_summary ADD COLUMN archived_count INTEGER NOT NULL DEFAULT 0")
+
+def _migration_shard_meta(cursor):
+    """Служебная таблица раскладки шардов сообщений"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_chat_reads(cursor):
+    """Отметки прочтения и счетчики непрочитанных сообщений участников чатов"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_reads (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            last_read_message_id INTEGER NOT NULL DEFAULT 0,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Существующая история считается прочитанной, чтобы у всех не появились огромные счетчики
+    cursor.execute('''
+        INSERT OR IGNORE INTO chat_reads (chat_id, user_id, last_read_message_id, unread_count)
+        SELECT cp.chat_id, cp.user_id, COALESCE(s.last_message_id, 0), 0
+        FROM chat_participants cp
+        LEFT JOIN chat_summary s ON s.chat_id = cp.chat_id
+    ''')
+
+# Версионированные миграции схемы: (версия, описание, функция)
+MIGRATIONS = [
+    (1, "добавление поля chat_key в secure_chats", _migration_secure_chat_key),
+    (2, "вторичные индексы для чатов, участников, сообщений и пользователей", _migration_secondary_indexes),
+    (3, "таблица chat_summary для списка чатов", _migration_chat_summary),
+    (4, "индекс messages(chat_id, id) для курсорной пагинации", _migration_message_keyset_index),
+    (5, "полнотекстовый поиск по сообщениям (FTS5)", _migration_message_search),
+    (6, "таблица private_chat_pairs для поиска приватных чатов", _migration_private_chat_pairs),
+    (7, "счетчик архивных сообщений в chat_summary", _migration_archive_counts),
+    (8, "таблица shard_meta для шардированного хранения сообщений", _migration_shard_meta),
+    (9, "таблица chat_reads для счетчиков непрочитанных", _migration_chat_reads),
+]
+
+def shard_file_path(db_path, index):
+    """Путь к файлу шарда сообщений рядом с основной базой"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_shard{index}{ext or '.db'}"
+
+def snapshot_dir_path(db_path):
+    """Каталог снимков рядом с основной базой"""
+    root, _ = os.path.splitext(db_path)
+    return f"{root}_snapshots"
+
+def archive_file_path(db_path):
+    """Путь к файлу архива рядом с базой (основной или шардом)"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+# Политики хранения: тип чата -> время жизни сообщений в секундах (None - хранить всегда).
+# По умолчанию ничего не удаляется: политики передаются в retention_policies или задаются
+# переменной окружения MESSENGER_RETENTION, например "secure=86400,private=7776000,group=7776000"
+DEFAULT_RETENTION_POLICIES = {}
+
+def parse_retention_policies(text):
+    """Политики хранения из строки вида "тип=секунды,тип=секунды" (пустая строка - без политик)"""
+    policies = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        chat_type, separator, ttl = item.partition('=')
+        if not separator or not ttl.strip().isdigit():
+            raise ValueError(f"Неверная политика хранения: {item.strip()} (ожидается тип=секунды)")
+        policies[chat_type.strip()] = int(ttl)
+    return policies
+
+# Сообщения старше этого срока переносятся из messages в архив (секунды)
+DEFAULT_ARCHIVE_AFTER = 30 * 24 * 3600
+
+# Сколько последних снимков базы хранится
+DEFAULT_SNAPSHOT_KEEP = 5
+
+# Запросы горячих путей, план которых показывается в отчете миграций: имя -> (SQL, параметры)
+QUERY_PLAN_PROBES = {
+    'get_chat_messages': ('''
+        SELECT m.id FROM messages m
+        WHERE m.chat_id = ? AND m.id < ? ORDER BY m.id DESC LIMIT 50
+    ''', (1, 1000)),
+    'get_user_chats': ('''
+        SELECT DISTINCT c.id, s.message_count, s.last_message_preview, s.participants, r.unread_count
+        FROM chat_participants cp
+        JOIN chats c ON c.id = cp.chat_id
+        JOIN chat_summary s ON s.chat_id = cp.chat_id
+        LEFT JOIN chat_reads r ON r.chat_id = cp.chat_id AND r.user_id = cp.user_id
+        WHERE cp.user_id = ?
+        ORDER BY c.created_at DESC
+    ''', (1,)),
+    'mark_read': (
+        "SELECT last_read_message_id, unread_count FROM chat_reads WHERE chat_id = ? AND user_id = ?", (1, 1)
+    ),
+    'get_or_create_private_chat': (
+        "SELECT chat_id FROM private_chat_pairs WHERE min_user_id = ? AND max_user_id = ?", (1, 2)
+    ),
+    'find_user_by_display_name': ("SELECT id, username, display_name FROM users WHERE display_name = ?", ('',)),
+    'clear_user_chat_history': ("DELETE FROM messages WHERE chat_id = ?", (1,)),
+}
+
+class ConnectionPool:
+    """Пул соединений SQLite: соединения читателей на поток и один сериализованный писатель"""
+    
+    def __init__(self, db_path, size=5, timeout=30.0, health_check_interval=60.0,
+                 storage_profile=DEFAULT_STORAGE_PROFILE):
+        if storage_profile not in STORAGE_PROFILES:
+            raise ValueError(f"Неизвестный профиль хранения: {storage_profile}")
+        
+        self.db_path = db_path
+        self.storage_profile = storage_profile
+        self.pragmas = STORAGE_PROFILES[storage_profile]
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        
+        # Для базы в памяти у каждого соединения своя база, поэтому все идет через писателя
+        self.shared = db_path == ':memory:'
+        
+        self._idle = queue.LifoQueue()  # [(conn, last_used)]
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = None
+        self._writer_last_used = 0.0
+        self._writer_lock = threading.RLock()
+        self._closed = False
+        self.trace_callback = None
+        
+        self._stats = {
+            'reader_checkouts': 0,
+            'reader_waits': 0,
+            'reader_wait_time': 0.0,
+            'reader_max_wait': 0.0,
+            'writer_acquisitions': 0,
+            'writer_waits': 0,
+            'writer_wait_time': 0.0,
+            'writer_max_wait': 0.0,
+            'health_checks': 0,
+            'reconnects': 0
+        }
+    
+    def _connect(self, writer=False):
+        """Открытие нового соединения"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        self._configure(conn, writer)
+        return conn
+    
+    def _configure(self, conn, writer):
+        """Применение PRAGMA профиля хранения к только что открытому соединению"""
+        if self.trace_callback:
+            conn.set_trace_callback(self.trace_callback)
+        
+        pragmas = self.pragmas
+        conn.execute(f"PRAGMA busy_timeout = {int(pragmas['busy_timeout'])}")
+        conn.execute(f"PRAGMA synchronous = {pragmas['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {int(pragmas['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(pragmas['mmap_size'])}")
+        conn.execute(f"PRAGMA temp_store = {pragmas['temp_store']}")
+        
+        if writer:
+            # Пошаговая очистка свободных страниц; действует только для новой базы (существующую
+            # переводит enable_incremental_vacuum), поэтому до WAL
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            # Режим журнала хранится в файле базы, достаточно выставить его писателем
+            conn.execute(f"PRAGMA journal_mode = {pragmas['journal_mode']}")
+            # Автоматический checkpoint WAL после заданного числа страниц
+            conn.execute(f"PRAGMA wal_autocheckpoint = {int(pragmas['wal_autocheckpoint'])}")
+            conn.execute(f"PRAGMA journal_size_limit = {int(pragmas['journal_size_limit'])}")
+    
+    def _ensure_healthy(self, conn, last_used, writer=False):
+        """Проверка соединения, простаивавшего дольше health_check_interval"""
+        if time.monotonic() - last_used < self.health_check_interval:
+            return conn
+        
+        with self._lock:
+            self._stats['health_checks'] += 1
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except sqlite3.Error:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._stats['reconnects'] += 1
+            return self._connect(writer)
+    
+    def _record_wait(self, kind, waited):
+        """Учет времени ожидания соединения"""
+        with self._lock:
+            self._stats[f'{kind}_waits'] += 1
+            self._stats[f'{kind}_wait_time'] += waited
+            self._stats[f'{kind}_max_wait'] = max(self._stats[f'{kind}_max_wait'], waited)
+    
+    def _acquire_reader(self):
+        """Получение свободного соединения читателя из пула"""
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            
+            # Пул исчерпан - ждем освобождения соединения
+            started = time.monotonic()
+            try:
+                conn, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise sqlite3.OperationalError("Пул соединений исчерпан")
+            finally:
+                self._record_wait('reader', time.monotonic() - started)
+        
+        return self._ensure_healthy(conn, last_used)
+    
+    @contextmanager
+    def reader(self):
+        """Соединение для чтения; вложенные вызовы в одном потоке используют одно соединение"""
+        if self.shared or getattr(self._local, 'writer_depth', 0):
+            # Поток уже держит писателя - читаем через него, чтобы видеть свои изменения
+            with self.writer() as conn:
+                yield conn
+            return
+        
+        conn = getattr(self._local, 'reader', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        conn = self._acquire_reader()
+        with self._lock:
+            self._stats['reader_checkouts'] += 1
+        self._local.reader = conn
+        try:
+            yield conn
+        finally:
+            self._local.reader = None
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put((conn, time.monotonic()))
+    
+    @contextmanager
+    def writer(self):
+        """Единственное соединение для записи; коммит выполняется при выходе из внешнего блока"""
+        if not self._writer_lock.acquire(blocking=False):
+            started = time.monotonic()
+            if not self._writer_lock.acquire(timeout=self.timeout):
+                raise sqlite3.OperationalError("Истекло время ожидания соединения для записи")
+            self._record_wait('writer', time.monotonic() - started)
+        
+        depth = getattr(self._local, 'writer_depth', 0)
+        self._local.writer_depth = depth + 1
+        try:
+            if depth == 0:
+                with self._lock:
+                    self._stats['writer_acquisitions'] += 1
+                if self._writer is None:
+                    self._writer = self._connect(writer=True)
+                else:
+                    self._writer = self._ensure_healthy(self._writer, self._writer_last_used, writer=True)
+            
+            try:
+                yield self._writer
+            except BaseException:
+                if depth == 0 and self._writer.in_transaction:
+                    self._writer.rollback()
+                raise
+            else:
+                if depth == 0 and self._writer.in_transaction:
+                    self._writer.commit()
+        finally:
+            self._local.writer_depth = depth
+            if depth == 0:
+                self._writer_last_used = time.monotonic()
+            self._writer_lock.release()
+    
+    def set_trace_callback(self, callback):
+        """Трассировка SQL-выражений на всех соединениях пула (None - отключить)"""
+        self.trace_callback = callback
+        
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for conn, last_used in idle:
+            conn.set_trace_callback(callback)
+            self._idle.put((conn, last_used))
+        
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.set_trace_callback(callback)
+    
+    def holds_writer(self):
+        """Держит ли текущий поток соединение писателя"""
+        return getattr(self._local, 'writer_depth', 0) > 0
+    
+    def checkpoint(self, mode='PASSIVE'):
+        """Перенос содержимого WAL в основной файл базы"""
+        with self.writer() as conn:
+            busy, log_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {'busy': busy, 'log_pages': log_pages, 'checkpointed': checkpointed}
+    
+    def enable_incremental_vacuum(self):
+        """Перевод существующей базы на auto_vacuum = INCREMENTAL.
+        
+        Для уже созданного файла PRAGMA вступает в силу только после полного VACUUM: он переписывает
+        файл целиком и держит писателя до конца, поэтому запускается вручную в тихое время.
+        Возвращает True, если база переведена сейчас, и False, если режим уже включен.
+        """
+        with self.writer() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        return True
+    
+    def stats(self):
+        """Метрики пула соединений"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['storage_profile'] = self.storage_profile
+            stats['open_readers'] = self._created
+        stats['idle_readers'] = self._idle.qsize()
+        return stats
+    
+    def close(self):
+        """Закрытие всех соединений пула"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        
+        with self._writer_lock:
+            if self._writer is not None:
+                # Сбрасываем WAL целиком, чтобы файл базы был самодостаточным
+                try:
+                    self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                except sqlite3.Error:
+                    pass
+                self._writer.close()
+                self._writer = None
+
+class WriteBatcher:
+    """Групповой коммит: записи из всех потоков фиксируются одной транзакцией"""
+    
+    def __init__(self, pool, batch_size=64, flush_interval_ms=2):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'writes': 0,
+            'failed_writes': 0,
+            'max_batch': 0,
+            'commit_time': 0.0
+        }
+    
+    def submit(self, job, callback=None):
+        """Постановка записи в очередь; job(cursor) выполняется внутри транзакции пакета.
+        
+        Возвращает Future, который завершается после коммита пакета.
+        """
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+        
+        # Поток уже держит писателя - выполняем сразу, иначе он будет ждать сам себя
+        if self.pool.holds_writer():
+            future.set_running_or_notify_cancel()
+            try:
+                with self.pool.writer() as conn:
+                    future.set_result(job(conn.cursor()))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        
+        self._ensure_started()
+        self._queue.put((job, future))
+        return future
+    
+    def _ensure_started(self):
+        """Ленивый запуск фонового потока записи"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-write-batcher', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        """Цикл фонового потока: набор пакета по размеру или по времени"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            self._commit(batch)
+    
+    def _commit(self, batch):
+        """Выполнение пакета в одной транзакции; каждая запись изолирована точкой сохранения"""
+        started = time.monotonic()
+        outcomes = []
+        failed = 0
+        try:
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                conn.execute("BEGIN")
+                for job, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    cursor.execute("SAVEPOINT batch_write")
+                    try:
+                        outcomes.append((future, job(cursor), None))
+                        cursor.execute("RELEASE batch_write")
+                    except Exception as e:
+                        # Ошибка одной записи не отменяет остальные записи пакета
+                        cursor.execute("ROLLBACK TO batch_write")
+                        cursor.execute("RELEASE batch_write")
+                        outcomes.append((future, None, e))
+                        failed += 1
+        except Exception as e:
+            for job, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            with self._lock:
+                self._stats['failed_writes'] += len(batch)
+            return
+        
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['writes'] += len(outcomes) - failed
+            self._stats['failed_writes'] += failed
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+            self._stats['commit_time'] += time.monotonic() - started
+        
+        # Результаты отдаются только после коммита
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+    
+    def stats(self):
+        """Метрики группового коммита"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['avg_batch'] = stats['writes'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+    
+    def stop(self):
+        """Остановка фонового потока с записью оставшейся очереди"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+def _background_pause(stop_event, write_batcher, min_pause, busy_time):
+    """Пауза фоновой задачи между пакетами: писатель занят ею не больше половины времени,
+    а при очереди живых записей задача уступает им"""
+    pause = max(min_pause, busy_time)
+    while write_batcher is not None and write_batcher.stats()['queued'] and pause < 1.0:
+        pause *= 2
+    stop_event.wait(pause)
+
+class RetentionPruner:
+    """Фоновое удаление устаревших сообщений по политикам хранения"""
+    
+    def __init__(self, pool, policies, write_batcher=None, interval=300.0, batch_size=500,
+                 batch_pause=0.05, vacuum_pages=256, archive=None, summary_pool=None):
+        self.pool = pool
+        self.summary_pool = summary_pool or pool
+        self.policies = dict(policies)
+        self.write_batcher = write_batcher
+        self.archive = archive
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.vacuum_pages = max(1, vacuum_pages)
+        
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'deleted': 0,
+            'batches': 0,
+            'vacuumed_pages': 0,
+            'incremental_vacuum': None,
+            'last_run_at': None,
+            'last_run_time': 0.0
+        }
+    
+    def start(self):
+        """Запуск фонового потока очистки (без политик с ограниченным сроком поток не нужен)"""
+        if self._thread is not None or not self.interval or not any(self.policies.values()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-retention-pruner', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        """Цикл фонового потока: очистка раз в interval секунд"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Ошибка очистки устаревших сообщений: {e}")
+    
+    def run_once(self):
+        """Один проход очистки по всем политикам; возвращает число удаленных сообщений по типам чатов"""
+        with self._run_lock:
+            started = time.monotonic()
+            deleted = {}
+            for chat_type, ttl in self.policies.items():
+                if ttl is None or self._stop.is_set():
+                    continue
+                deleted[chat_type] = self._prune(chat_type, ttl)
+                if self.archive is not None:
+                    deleted[chat_type] += self._prune_archive(chat_type, ttl)
+            
+            if any(deleted.values()):
+                self._vacuum()
+            
+            with self._lock:
+                self._stats['runs'] += 1
+                self._stats['deleted'] += sum(deleted.values())
+                self._stats['last_run_at'] = datetime.now().isoformat()
+                self._stats['last_run_time'] = time.monotonic() - started
+            return deleted
+    
+    def _prune(self, chat_type, ttl):
+        """Удаление сообщений старше ttl секунд в чатах типа chat_type небольшими пакетами"""
+        total = 0
+        while not self._stop.is_set():
+            batch_started = time.monotonic()
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                # Блокировка записи до выборки, чтобы процессы на одном файле не удаляли одни и те же строки
+                if not conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                # Для каждого чата идет диапазонный поиск по индексу (chat_id, created_at)
+                cursor.execute('''
+                    SELECT m.id, m.chat_id FROM chats c
+                    JOIN messages m ON m.chat_id = c.id
+                    WHERE c.chat_type = ? AND m.created_at < datetime('now', ?)
+                    LIMIT ?
+                ''', (chat_type, f'-{int(ttl)} seconds', self.batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                cursor.executemany("DELETE FROM messages WHERE id = ?", [(message_id,) for message_id, _ in rows])
+                total += cursor.rowcount
+                chat_ids = sorted({chat_id for _, chat_id in rows})
+                with _summary_cursor(self.summary_pool, cursor) as (summary, messages):
+                    _refresh_chat_summaries(summary, chat_ids, participants=False, message_cursor=messages)
+                    # Непрочитанные удаленные сообщения не должны оставаться в счетчиках
+                    _recount_unread(summary, chat_ids, messages, self.archive)
+
+            with self._lock:
+                self._stats['batches'] += 1
+            
+            if len(rows) < self.batch_size:
+                break
+            self._throttle(time.monotonic() - batch_started)
+        return total
+    
+    def _prune_archive(self, chat_type, ttl):
+        """Удаление полностью устаревших сегментов архива с учетом в сводке чатов"""
+        total = 0
+        while not self._stop.is_set():
+            with self.pool.writer() as conn:
+                cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{int(ttl)} seconds',)).fetchone()[0]
+                removed = self.archive.prune(chat_type, cutoff)
+                if not removed:
+                    break
+                with _summary_cursor(self.summary_pool, conn.cursor()) as (summary, messages):
+                    summary.executemany(
+                        "UPDATE chat_summary SET archived_count = MAX(archived_count - ?, 0) WHERE chat_id = ?",
+                        [(count, chat_id) for chat_id, count in removed.items()]
+                    )
+                    _recount_unread(summary, removed, messages, self.archive)
+            total += sum(removed.values())
+        return total
+    
+    def _throttle(self, busy_time):
+        """Пауза между пакетами"""
+        _background_pause(self._stop, self.write_batcher, self.batch_pause, busy_time)
+    
+    def _vacuum(self):
+        """Возврат освободившихся страниц файловой системе (только для auto_vacuum = INCREMENTAL)"""
+        with self.pool.writer() as conn:
+            incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        with self._lock:
+            first_check = self._stats['incremental_vacuum'] is None
+            self._stats['incremental_vacuum'] = incremental
+        if not incremental:
+            # База создана до включения auto_vacuum: освободившиеся страницы переиспользуются, но файл не уменьшается
+            if first_check:
+                print(f"⚠️ {self.pool.db_path}: файл базы не уменьшается после очистки, "
+                      f"переведите ее вызовом DatabaseManager.enable_incremental_vacuum()")
+            return
+        
+        while not self._stop.is_set():
+            batch_started = time.monotonic()
+            with self.pool.writer() as conn:
+                free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free_pages:
+                    break
+                pages = min(free_pages, self.vacuum_pages)
+                # execute() делает только один шаг PRAGMA (одна страница), executescript - до конца
+                conn.executescript(f"PRAGMA incremental_vacuum({pages})")
+            
+            with self._lock:
+                self._stats['vacuumed_pages'] += pages
+            self._throttle(time.monotonic() - batch_started)
+        
+        # Усечение файла базы происходит при переносе WAL
+        self.pool.checkpoint('PASSIVE')
+    
+    def stats(self):
+        """Метрики очистки"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['policies'] = dict(self.policies)
+        return stats
+    
+    def stop(self):
+        """Остановка фонового потока очистки"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+class MessageArchiver:
+    """Фоновый перенос старых сообщений из messages в холодный архив"""
+    
+    def __init__(self, pool, archive, archive_after=DEFAULT_ARCHIVE_AFTER, write_batcher=None,
+                 interval=600.0, batch_size=500, batch_pause=0.05, summary_pool=None):
+        self.pool = pool
+        self.summary_pool = summary_pool or pool
+        self.archive = archive
+        self.archive_after = archive_after
+        self.write_batcher = write_batcher
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'archived': 0,
+            'batches': 0,
+            'last_run_at': None,
+            'last_run_time': 0.0
+        }
+    
+    def start(self):
+        """Запуск фонового потока архивации"""
+        if self._thread is not None or not self.interval:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-message-archiver', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        """Цикл фонового потока: архивация раз в interval секунд"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Ошибка архивации сообщений: {e}")
+    
+    def run_once(self):
+        """Один проход архивации; возвращает число перенесенных сообщений"""
+        with self._run_lock:
+            started = time.monotonic()
+            total = 0
+            while not self._stop.is_set():
+                batch_started = time.monotonic()
+                moved = self._archive_batch()
+                total += moved
+                if moved < self.batch_size:
+                    break
+                _background_pause(self._stop, self.write_batcher, self.batch_pause,
+                                  time.monotonic() - batch_started)
+            
+            with self._lock:
+                self._stats['runs'] += 1
+                self._stats['archived'] += total
+                self._stats['last_run_at'] = datetime.now().isoformat()
+                self._stats['last_run_time'] = time.monotonic() - started
+            return total
+    
+    def _archive_batch(self):
+        """Перенос одного пакета: сначала запись сегментов в архив, затем удаление из messages.
+        
+        Последнее сообщение чата всегда остается в messages - по нему строится сводка.
+        """
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            # Блокировка записи берется до выборки: иначе другой процесс на том же файле
+            # выберет те же строки и тоже перенесет их в архив
+            if not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+                SELECT m.id, m.sender_id, m.content, m.encrypted_content, m.message_type, m.created_at,
+                       m.chat_id, c.chat_type
+                FROM chats c
+                JOIN messages m ON m.chat_id = c.id
+                WHERE c.chat_type != 'secure' AND m.message_type IS NOT 'secure'
+                AND m.created_at < datetime('now', ?)
+                AND m.id < (SELECT MAX(id) FROM messages WHERE chat_id = m.chat_id)
+                LIMIT ?
+            ''', (f'-{int(self.archive_after)} seconds', self.batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            
+            chats = {}
+            for row in rows:
+                chats.setdefault((row[6], row[7]), []).append(row[:6])
+            
+            moved = {}
+            for (chat_id, chat_type), messages in chats.items():
+                messages.sort(key=lambda message: message[0])
+                # После сбоя между записью в архив и удалением часть строк уже может быть в архиве
+                done = self.archive.archived_ids(chat_id, [message[0] for message in messages])
+                self.archive.append(chat_id, chat_type, [message for message in messages if message[0] not in done])
+                # Счетчики сводки меняются на число действительно удаленных строк
+                cursor.executemany("DELETE FROM messages WHERE id = ?", [(message[0],) for message in messages])
+                moved[chat_id] = cursor.rowcount
+            
+            with _summary_cursor(self.summary_pool, cursor) as (summary, _):
+                summary.executemany(
+                    "UPDATE chat_summary SET message_count = message_count - ?, archived_count = archived_count + ? "
+                    "WHERE chat_id = ?",
+                    [(count, count, chat_id) for chat_id, count in moved.items() if count]
+                )
+        
+        with self._lock:
+            self._stats['batches'] += 1
+        return sum(moved.values())
+    
+    def stats(self):
+        """Метрики архивации"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['archive_after'] = self.archive_after
+        stats.update(self.archive.stats())
+        return stats
+    
+    def stop(self):
+        """Остановка фонового потока архивации"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+class SnapshotService:
+    """Онлайн-снимки базы через backup API SQLite: копирование по страницам в фоне,
+    ротация и проверка целостности.
+    
+    Снимок - каталог snapshot_<время> с копиями основной базы, шардов и архивов.
+    """
+    
+    def __init__(self, sources, snapshot_dir, interval=None, keep=DEFAULT_SNAPSHOT_KEEP, pages=256,
+                 step_pause=0.01):
+        self.sources = list(sources)  # [(путь к файлу базы, групповой коммит его живых записей или None)]
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.keep = max(1, keep)
+        self.pages = max(1, pages)
+        self.step_pause = step_pause
+        
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'failed': 0,
+            'pages_copied': 0,
+            'max_step_time': 0.0,
+            'last_snapshot': None,
+            'last_error': None,
+            'last_run_at': None,
+            'last_run_time': 0.0
+        }
+    
+    def start(self):
+        """Запуск фонового потока снимков"""
+        if self._thread is not None or not self.interval:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-snapshot-service', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        """Цикл фонового потока: снимок раз в interval секунд"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Ошибка снимка базы: {e}")
+    
+    def run_once(self):
+        """Снимок всех файлов базы; возвращает путь к каталогу снимка"""
+        with self._run_lock:
+            started = time.monotonic()
+            target = os.path.join(self.snapshot_dir, f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+            # Снимок собирается во временном каталоге и становится виден только целиком проверенным
+            temp = target + '.tmp'
+            os.makedirs(temp)
+            try:
+                for path, write_batcher in self.sources:
+                    if os.path.exists(path):
+                        dest = os.path.join(temp, os.path.basename(path))
+                        self._copy(path, dest, write_batcher)
+                        self._verify(dest)
+                os.replace(temp, target)
+            except Exception as e:
+                shutil.rmtree(temp, ignore_errors=True)
+                with self._lock:
+                    self._stats['failed'] += 1
+                    self._stats['last_error'] = str(e)
+                raise
+            
+            self._rotate()
+            with self._lock:
+                self._stats['runs'] += 1
+                self._stats['last_snapshot'] = target
+                self._stats['last_run_at'] = datetime.now().isoformat()
+                self._stats['last_run_time'] = time.monotonic() - started
+            return target
+    
+    def _copy(self, path, dest, write_batcher):
+        """Копирование файла базы шагами по pages страниц с паузами между ними"""
+        source = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        target = sqlite3.connect(dest)
+        try:
+            # Открытая транзакция чтения фиксирует согласованное состояние: записи других соединений
+            # не перезапускают копирование, а писателей в режиме WAL она не блокирует
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            step_started = time.monotonic()
+            copied = 0
+            
+            def progress(status, remaining, total):
+                nonlocal step_started, copied
+                step_time = time.monotonic() - step_started
+                with self._lock:
+                    self._stats['pages_copied'] += max(total - remaining - copied, 0)
+                    self._stats['max_step_time'] = max(self._stats['max_step_time'], step_time)
+                if remaining:
+                    _background_pause(self._stop, write_batcher, self.step_pause, step_time)
+                if self._stop.is_set():
+                    raise InterruptedError("снимок прерван остановкой сервиса")
+                copied = total - remaining
+                step_started = time.monotonic()
+            
+            source.backup(target, pages=self.pages, progress=progress)
+            source.execute("COMMIT")
+        finally:
+            target.close()
+            source.close()
+    
+    def _verify(self, path):
+        """Проверка целостности копии"""
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            conn.close()
+        if result != [('ok',)]:
+            raise sqlite3.DatabaseError(f"копия {os.path.basename(path)} повреждена: {result[:3]}")
+    
+    def _rotate(self):
+        """Удаление старых снимков сверх keep и недособранных каталогов прерванных запусков"""
+        names = sorted(os.listdir(self.snapshot_dir))
+        for name in names:
+            if name.startswith('snapshot_') and name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(self.snapshot_dir, name), ignore_errors=True)
+        
+        snapshots = [name for name in names if name.startswith('snapshot_') and not name.endswith('.tmp')]
+        for name in snapshots[:-self.keep]:
+            shutil.rmtree(os.path.join(self.snapshot_dir, name), ignore_errors=True)
+    
+    def list_snapshots(self):
+        """Готовые снимки, от старых к новым"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        return [os.path.join(self.snapshot_dir, name) for name in sorted(os.listdir(self.snapshot_dir))
+                if name.startswith('snapshot_') and not name.endswith('.tmp')]
+    
+    def stats(self):
+        """Метрики снимков"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['snapshots'] = len(self.list_snapshots())
+        stats['keep'] = self.keep
+        return stats
+    
+    def stop(self):
+        """Остановка фонового потока снимков"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+class MessageShard:
+    """Хранилище сообщений группы чатов: основная база (count=1) или отдельный файл шарда"""
+    
+    def __init__(self, index, count, pool, write_batcher):
+        self.index = index
+        self.count = count
+        self.pool = pool
+        self.write_batcher = write_batcher
+        self.archive = None
+        self.archiver = None
+        self.retention = None
+    
+    @property
+    def external(self):
+        """Сообщения лежат в отдельном файле, а не в основной базе"""
+        return self.count > 1
+    
+    def insert_message(self, cursor, chat_id, sender_id, content, encrypted_content, message_type):
+        """Вставка сообщения; возвращает (id, created_at).
+        
+        В шарде id выдаются с шагом count и остатком index, поэтому они уникальны среди всех шардов.
+        """
+        params = {'chat_id': chat_id, 'sender_id': sender_id, 'content': content,
+                  'encrypted_content': encrypted_content, 'message_type': message_type,
+                  'count': self.count, 'index': self.index}
+        if self.external:
+            cursor.execute('''
+                INSERT INTO messages (id, chat_id, sender_id, content, encrypted_content, message_type)
+                VALUES (
+                    (MAX((SELECT COALESCE(MAX(id), 0) FROM messages),
+                         (SELECT COALESCE(MAX(value), 0) FROM shard_meta WHERE key = 'id_floor'))
+                     / :count + 1) * :count + :index,
+                    :chat_id, :sender_id, :content, :encrypted_content, :message_type
+                )
+            ''', params)
+        else:
+            cursor.execute('''
+                INSERT INTO messages (chat_id, sender_id, content, encrypted_content, message_type)
+                VALUES (:chat_id, :sender_id, :content, :encrypted_content, :message_type)
+            ''', params)
+        message_id = cursor.lastrowid
+        created_at = cursor.execute("SELECT created_at FROM messages WHERE id = ?", (message_id,)).fetchone()[0]
+        return message_id, created_at
+    
+    def start_maintenance(self, summary_pool, policies, retention_interval, archive_path, archive_after,
+                          archive_interval):
+        """Запуск архивации и очистки устаревших сообщений шарда"""
+        if archive_path:
+            self.archive = MessageArchive(archive_path)
+            self.archiver = MessageArchiver(self.pool, self.archive, archive_after=archive_after,
+                                            write_batcher=self.write_batcher, interval=archive_interval,
+                                            summary_pool=summary_pool)
+            self.archiver.start()
+        
+        self.retention = RetentionPruner(self.pool, policies, write_batcher=self.write_batcher,
+                                         interval=retention_interval, archive=self.archive,
+                                         summary_pool=summary_pool)
+        self.retention.start()
+    
+    def close(self):
+        """Остановка фоновых задач и закрытие файлов шарда"""
+        if self.retention:
+            self.retention.stop()
+        if self.archiver:
+            self.archiver.stop()
+        if self.external:
+            self.write_batcher.stop()
+            self.pool.close()
+        if self.archive:
+            self.archive.close()
+
+def _combine_stats(stats, totals):
+    """Метрики по шардам: для одного шарда - как есть, иначе список и суммы по ключам totals"""
+    if len(stats) == 1:
+        return stats[0]
+    combined = {key: sum(item.get(key, 0) for item in stats) for key in totals}
+    combined['shards'] = stats
+    return combined
+
+class DatabaseManager(StorageBackend):
+    def __init__(self, db_path="messenger.db", pool_size=5, pool_timeout=30.0, storage_profile=None,
+                 write_batch_size=64, write_batch_interval_ms=2, retention_policies=None,
+                 retention_interval=300.0, archive_path=None, archive_after=DEFAULT_ARCHIVE_AFTER,
+                 archive_interval=600.0, shards=None, snapshot_dir=None, snapshot_interval=None,
+                 snapshot_keep=DEFAULT_SNAPSHOT_KEEP, secure_session_ttl=600.0, maintenance=None):
         self.db_path = db_path
         self.crypto_manager = CryptoManager()
+        
+        # Профиль хранения и число шардов сообщений можно задать через переменные окружения
+        if storage_profile is None:
+            storage_profile = os.getenv('MESSENGER_STORAGE_PROFILE', DEFAULT_STORAGE_PROFILE)
+        if shards is None:
+            shards = int(os.getenv('MESSENGER_SHARDS', '1'))
+        shard_count = 1 if db_path == ':memory:' else max(1, int(shards))
+        
+        self.pool = ConnectionPool(db_path, size=pool_size, timeout=pool_timeout,
+                                   storage_profile=storage_profile)
+        self.write_batcher = WriteBatcher(self.pool, batch_size=write_batch_size,
+                                          flush_interval_ms=write_batch_interval_ms)
+        self.user_directory = UserDirectory()
+        # Ключи и шифраторы активных защищенных чатов, чтобы не читать secure_chats на каждое сообщение
+        self.secure_sessions = SecureSessionRegistry(ttl=secure_session_ttl)
         self.init_database()
+        self._check_shard_layout(shard_count)
+        
+        # Сообщения: в основной базе или в shard_count файлах, чат попадает в шард chat_id % shard_count.
+        # У каждого шарда свой писатель, поэтому записи в разные шарды идут параллельно
+        if shard_count == 1:
+            self.shards = [MessageShard(0, 1, self.pool, self.write_batcher)]
+        else:
+            self.shards = []
+            for index in range(shard_count):
+                pool = ConnectionPool(shard_file_path(db_path, index), size=pool_size, timeout=pool_timeout,
+                                      storage_profile=storage_profile)
+                shard = MessageShard(index, shard_count, pool,
+                                     WriteBatcher(pool, batch_size=write_batch_size,
+                                                  flush_interval_ms=write_batch_interval_ms))
+                self._init_shard(shard)
+                self.shards.append(shard)
+        
+        # Фоновые задачи нужны одному процессу на базу: остальные процессы, которые делят с ним файлы
+        # (рабочие процессы multiprocess_server, веб-приложение рядом с server.py), запускаются
+        # с maintenance=False или MESSENGER_MAINTENANCE=0 и выполняют задачи только по вызову
+        if maintenance is None:
+            maintenance = os.getenv('MESSENGER_MAINTENANCE', '1') != '0'
+        if not maintenance:
+            retention_interval = archive_interval = None
+            snapshot_interval = 0
+        
+        # Архивация и очистка устаревших сообщений (interval=None - только вручную)
+        if retention_policies is None:
+            retention_policies = parse_retention_policies(os.getenv('MESSENGER_RETENTION', ''))
+        policies = dict(DEFAULT_RETENTION_POLICIES)
+        policies.update(retention_policies)
+        for shard in self.shards:
+            # Холодный архив лежит рядом с базой сообщений (для базы в памяти не используется)
+            shard_archive_path = archive_path
+            if db_path == ':memory:':
+                shard_archive_path = None
+            elif archive_path is None or (shard.external and archive_path):
+                shard_archive_path = archive_file_path(shard.pool.db_path)
+            shard.start_maintenance(self.pool, policies, retention_interval, shard_archive_path,
+                                    archive_after, archive_interval)
+        
+        # Онлайн-снимки всех файлов базы (интервал можно задать через MESSENGER_SNAPSHOT_INTERVAL, 0 - без снимков)
+        self.snapshots = None
+        if db_path != ':memory:':
+            if snapshot_interval is None and os.getenv('MESSENGER_SNAPSHOT_INTERVAL'):
+                snapshot_interval = float(os.getenv('MESSENGER_SNAPSHOT_INTERVAL'))
+            sources = [(db_path, self.write_batcher)]
+            for shard in self.shards:
+                if shard.external:
+                    sources.append((shard.pool.db_path, shard.write_batcher))
+                if shard.archive:
+                    sources.append((shard.archive.path, shard.write_batcher))
+            self.snapshots = SnapshotService(sources, snapshot_dir or snapshot_dir_path(db_path),
+                                             interval=snapshot_interval, keep=snapshot_keep)
+            self.snapshots.start()
+    
+    def _check_shard_layout(self, shard_count):
+        """Проверка, что раскладка сообщений на диске совпадает с настроенным числом шардов"""
+        with self.pool.writer() as conn:
+            row = conn.execute("SELECT value FROM shard_meta WHERE key = 'shard_count'").fetchone()
+            current = row[0] if row else 1
+            if current == shard_count:
+                return
+            if row is None and not conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone():
+                # В базе еще нет сообщений - фиксируем раскладку
+                conn.execute("INSERT INTO shard_meta (key, value) VALUES ('shard_count', ?)", (shard_count,))
+                return
+        raise ValueError(f"Сообщения разложены на {current} шард(ов), а настроено {shard_count}: "
+                         f"выполните python shard_tool.py {self.db_path} {shard_count}")
+    
+    def _init_shard(self, shard):
+        """Схема шарда и копия строк chats его чатов (по ним работают архивация и очистка)"""
+        with shard.pool.writer() as conn:
+            self._create_tables(conn)
+        self.run_migrations(shard.pool)
+        
+        with self.pool.reader() as conn:
+            chats = conn.execute(
+                "SELECT id, chat_type, created_at FROM chats WHERE id % ? = ?", (shard.count, shard.index)
+            ).fetchall()
+        
+        with shard.pool.writer() as conn:
+            row = conn.execute("SELECT value FROM shard_meta WHERE key = 'shard_index'").fetchone()
+            if row is not None and row[0] != shard.index:
+                raise ValueError(f"Файл {shard.pool.db_path} принадлежит шарду {row[0]}, а не {shard.index}")
+            conn.execute("INSERT OR IGNORE INTO shard_meta (key, value) VALUES ('shard_index', ?)", (shard.index,))
+            conn.executemany("INSERT OR IGNORE INTO chats (id, chat_type, created_at) VALUES (?, ?, ?)", chats)
+    
+    def _shard(self, chat_id):
+        """Шард, в котором лежат сообщения чата"""
+        return self.shards[int(chat_id) % len(self.shards)]
+    
+    def _mirror_chat(self, chat_id, chat_type):
+        """Копия строки чата в его шард; вызывается после коммита основной базы"""
+        shard = self._shard(chat_id)
+        if shard.external:
+            with shard.pool.writer() as conn:
+                conn.execute("INSERT OR IGNORE INTO chats (id, chat_type) VALUES (?, ?)", (chat_id, chat_type))
+    
+    def _display_names(self, user_ids):
+        """Имена отправителей из справочника пользователей; недостающие дочитываются из базы"""
+        names = {user_id: self.user_directory.display_name(user_id) for user_id in set(user_ids)}
+        missing = [user_id for user_id, name in names.items() if name is None]
+        if missing:
+            with self.pool.reader() as conn:
+                names.update(conn.execute(
+                    f"SELECT id, display_name FROM users WHERE id IN ({','.join('?' * len(missing))})", missing
+                ).fetchall())
+        return names
+    
+    def get_pool_stats(self):
+        """Получение метрик пула соединений"""
+        return self.pool.stats()
+    
+    def checkpoint(self, mode='PASSIVE'):
+        """Ручной checkpoint WAL (PASSIVE, FULL, RESTART или TRUNCATE)"""
+        return self.pool.checkpoint(mode)
+    
+    def get_write_stats(self):
+        """Получение метрик группового коммита"""
+        return self.write_batcher.stats()
+    
+    def get_shard_stats(self):
+        """Получение метрик пулов и групповых коммитов шардов сообщений"""
+        return [{'index': shard.index, 'path': shard.pool.db_path, 'pool': shard.pool.stats(),
+                 'writes': shard.write_batcher.stats()} for shard in self.shards]
+    
+    def prune_expired_messages(self):
+        """Немедленная очистка сообщений с истекшим сроком хранения"""
+        deleted = {}
+        for shard in self.shards:
+            for chat_type, count in shard.retention.run_once().items():
+                deleted[chat_type] = deleted.get(chat_type, 0) + count
+        return deleted
+    
+    def enable_incremental_vacuum(self):
+        """Перевод файлов базы и шардов, созданных до включения auto_vacuum, на пошаговую очистку;
+        возвращает {путь: переведен ли сейчас}"""
+        pools = [self.pool] + [shard.pool for shard in self.shards if shard.external]
+        return {pool.db_path: pool.enable_incremental_vacuum() for pool in pools}
+    
+    def get_retention_stats(self):
+        """Получение метрик очистки устаревших сообщений"""
+        return _combine_stats([shard.retention.stats() for shard in self.shards],
+                              ('runs', 'deleted', 'batches', 'vacuumed_pages'))
+    
+    def archive_old_messages(self):
+        """Немедленный перенос старых сообщений в архив"""
+        return sum(shard.archiver.run_once() for shard in self.shards if shard.archiver)
+    
+    def get_archive_stats(self):
+        """Получение метрик архива"""
+        stats = [shard.archiver.stats() for shard in self.shards if shard.archiver]
+        return _combine_stats(stats, ('archived', 'segments', 'messages', 'compressed_bytes')) if stats else {}
+    
+    def create_snapshot(self):
+        """Немедленный снимок базы; возвращает путь к каталогу снимка или None"""
+        if self.snapshots is None:
+            return None
+        try:
+            return self.snapshots.run_once()
+        except Exception as e:
+            print(f"❌ Ошибка снимка базы: {e}")
+            return None
+    
+    def get_snapshot_stats(self):
+        """Получение метрик снимков базы"""
+        return self.snapshots.stats() if self.snapshots else {}
+    
+    def close(self):
+        """Закрытие соединений с базой данных"""
+        if self.snapshots:
+            self.snapshots.stop()
+        for shard in self.shards:
+            shard.close()
+        self.write_batcher.stop()
+        self.pool.close()
     
     def init_database(self):
         """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
+        with self.pool.writer() as conn:
+            self._create_tables(conn)
+        
+        # Выполняем миграции
+        self.run_migrations()
+        
+        # Строим справочник пользователей в памяти
+        self.load_user_directory()
+    
+    def _create_tables(self, conn):
+        """Создание таблиц схемы"""
         cursor = conn.cursor()
         
         # Таблица пользователей
@@ -75,105 +1607,145 @@ class DatabaseManager:
                 FOREIGN KEY (chat_id) REFERENCES chats (id)
             )
         ''')
-        
-        conn.commit()
-        conn.close()
-        
-        # Выполняем миграции
-        self.run_migrations()
     
-    def run_migrations(self):
-        """Выполнение миграций базы данных"""
+    def run_migrations(self, pool=None):
+        """Выполнение версионированных миграций базы данных (pool - база шарда, по умолчанию основная)"""
+        pool = pool or self.pool
+        report_plans = pool is self.pool
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with pool.writer() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+            
+            pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+            if not pending:
+                return []
             
-            # Проверяем, есть ли поле chat_key в таблице secure_chats
-            cursor.execute("PRAGMA table_info(secure_chats)")
-            columns = [column[1] for column in cursor.fetchall()]
+            plans_before = self.explain_query_plans() if report_plans else {}
             
-            if 'chat_key' not in columns:
-                print("🔄 Выполняется миграция: добавление поля chat_key в secure_chats")
-                cursor.execute('ALTER TABLE secure_chats ADD COLUMN chat_key TEXT UNIQUE')
-                conn.commit()
-                print("✅ Миграция выполнена успешно")
+            # Каждая миграция выполняется в своей транзакции, читатели WAL при этом не блокируются
+            for version, description, migrate in pending:
+                print(f"🔄 Выполняется миграция {version}: {description}")
+                started = time.monotonic()
+                
+                with pool.writer() as conn:
+                    conn.execute("BEGIN")
+                    migrate(conn.cursor())
+                    conn.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+                        (version, description)
+                    )
+                
+                print(f"✅ Миграция {version} выполнена за {time.monotonic() - started:.3f} с")
             
-            conn.close()
+            with pool.writer() as conn:
+                conn.execute("PRAGMA optimize")
+            
+            if not report_plans:
+                return []
+            report = self.query_plan_report(plans_before, self.explain_query_plans())
+            for line in report:
+                print(line)
+            return report
         except Exception as e:
             print(f"❌ Ошибка миграции: {e}")
+            return []
     
-    def hash_password(self, password):
-        """Хеширование пароля"""
-        salt = os.urandom(16)
-        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
-        return salt.hex() + hash_obj.hex()
+    def get_schema_version(self):
+        """Текущая версия схемы базы данных"""
+        try:
+            with self.pool.reader() as conn:
+                result = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+            return result[0] or 0
+        except Exception as e:
+            return 0
     
-    def verify_password(self, password, stored_hash):
-        """Проверка пароля"""
+    def explain_query_plans(self):
+        """Планы выполнения запросов горячих путей"""
+        plans = {}
+        if self.pool.shared:
+            with self.pool.writer() as conn:
+                for name, (sql, params) in QUERY_PLAN_PROBES.items():
+                    plans[name] = self._explain(conn, sql, params)
+            return plans
+        
+        # Отдельное соединение без кэша выражений: закэшированный EXPLAIN не видит новых индексов
+        conn = sqlite3.connect(self.db_path, timeout=self.pool.timeout, cached_statements=0)
         try:
-            salt_hex = stored_hash[:32]
-            hash_hex = stored_hash[32:]
-            salt = bytes.fromhex(salt_hex)
-            stored_hash_bytes = bytes.fromhex(hash_hex)
-            
-            hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
-            return hash_obj == stored_hash_bytes
-        except:
-            return False
+            for name, (sql, params) in QUERY_PLAN_PROBES.items():
+                plans[name] = self._explain(conn, sql, params)
+        finally:
+            conn.close()
+        return plans
+    
+    def _explain(self, conn, sql, params):
+        """План одного запроса; до миграции таблицы запроса может еще не быть"""
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            return [row[-1] for row in rows]
+        except sqlite3.Error as e:
+            return [f"недоступен ({e})"]
+    
+    def query_plan_report(self, plans_before, plans_after):
+        """Отчет о планах запросов до и после миграций"""
+        report = ["📊 Планы запросов после миграций:"]
+        for name, after in plans_after.items():
+            before = plans_before.get(name, [])
+            if before == after:
+                report.append(f"  {name}: без изменений ({'; '.join(after)})")
+            else:
+                report.append(f"  {name}:")
+                report.append(f"    до:    {'; '.join(before)}")
+                report.append(f"    после: {'; '.join(after)}")
+        return report
+    
+    def load_user_directory(self):
+        """Загрузка справочника пользователей для поиска по имени"""
+        with self.pool.reader() as conn:
+            self.user_directory.load(conn.execute("SELECT id, username, display_name FROM users"))
     
     def register_user(self, username, display_name, password):
         """Регистрация нового пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Проверяем, что пользователь не существует
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            if cursor.fetchone():
-                conn.close()
-                return False, "Пользователь с таким именем уже существует"
-            
-            # Генерируем секретную фразу
-            secret_phrase = self.generate_secret_phrase()
-            
-            # Хешируем пароль
+            # Хешируем пароль до захвата писателя, чтобы не держать блокировку на PBKDF2
             password_hash = self.hash_password(password)
             
-            # Добавляем пользователя
-            cursor.execute('''
-                INSERT INTO users (username, display_name, password_hash, secret_phrase)
-                VALUES (?, ?, ?, ?)
-            ''', (username, display_name, password_hash, secret_phrase))
-            
-            conn.commit()
-            conn.close()
-            
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                
+                # Проверяем, что пользователь не существует
+                cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+                if cursor.fetchone():
+                    return False, "Пользователь с таким именем уже существует"
+                
+                # Генерируем секретную фразу
+                secret_phrase = self.generate_secret_phrase()
+                
+                # Добавляем пользователя
+                cursor.execute('''
+                    INSERT INTO users (username, display_name, password_hash, secret_phrase)
+                    VALUES (?, ?, ?, ?)
+                ''', (username, display_name, password_hash, secret_phrase))
+                user_id = cursor.lastrowid
+            
+            self.user_directory.add(user_id, username, display_name)
             return True, secret_phrase
         except Exception as e:
             return False, f"Ошибка регистрации: {str(e)}"
     
-    def generate_secret_phrase(self):
-        """Генерация секретной фразы для восстановления"""
-        words = [
-            "apple", "banana", "cherry", "dragon", "eagle", "forest", "garden", "house",
-            "island", "jungle", "knight", "lemon", "mountain", "ocean", "planet", "queen",
-            "river", "star", "tiger", "umbrella", "village", "water", "xylophone", "yellow"
-        ]
-        phrase = []
-        for _ in range(4):
-            phrase.append(words[os.urandom(1)[0] % len(words)])
-        return "-".join(phrase)
-    
     def authenticate_user(self, username, password):
         """Аутентификация пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id, password_hash, display_name FROM users WHERE username = ?", (username,))
-            user_data = cursor.fetchone()
-            
-            conn.close()
+            with self.pool.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, password_hash, display_name FROM users WHERE username = ?", (username,))
+                user_data = cursor.fetchone()
             
             if not user_data:
                 return False, "Пользователь не найден"
@@ -190,13 +1762,10 @@ class DatabaseManager:
     def find_user_by_display_name(self, display_name):
         """Поиск пользователя по имени аккаунта"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id, username, display_name FROM users WHERE display_name = ?", (display_name,))
-            user_data = cursor.fetchone()
-            
-            conn.close()
+            with self.pool.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, username, display_name FROM users WHERE display_name = ?", (display_name,))
+                user_data = cursor.fetchone()
             
             if user_data:
                 return {"user_id": user_data[0], "username": user_data[1], "display_name": user_data[2]}
@@ -204,59 +1773,83 @@ class DatabaseManager:
         except Exception as e:
             return None
     
+    def search_users(self, prefix, limit=10):
+        """Ранжированный поиск пользователей по началу или похожему имени (без обращения к базе)"""
+        try:
+            limit = max(1, min(int(limit or 10), 100))
+            return self.user_directory.search(prefix, limit)
+        except Exception as e:
+            return []
+    
     def clear_user_chat_history(self, user_id):
         """Очистка истории чатов пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Получаем все чаты пользователя
-            cursor.execute("SELECT chat_id FROM chat_participants WHERE user_id = ?", (user_id,))
-            user_chats = cursor.fetchall()
+            with self.pool.reader() as conn:
+                user_chats = conn.execute("SELECT chat_id FROM chat_participants WHERE user_id = ?", (user_id,)).fetchall()
             
-            # Удаляем сообщения из всех чатов пользователя
+            by_shard = {}
             for (chat_id,) in user_chats:
-                cursor.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
-            
-            conn.commit()
-            conn.close()
+                by_shard.setdefault(self._shard(chat_id).index, []).append(chat_id)
+            
+            for index, chat_ids in by_shard.items():
+                shard = self.shards[index]
+                with shard.pool.writer() as conn:
+                    cursor = conn.cursor()
+                    
+                    # Удаляем сообщения из всех чатов пользователя
+                    for chat_id in chat_ids:
+                        cursor.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                    
+                    with _summary_cursor(self.pool, cursor) as (summary, messages):
+                        if shard.archive:
+                            shard.archive.delete_chats(chat_ids)
+                            summary.executemany("UPDATE chat_summary SET archived_count = 0 WHERE chat_id = ?",
+                                                [(chat_id,) for chat_id in chat_ids])
+                        
+                        _refresh_chat_summaries(summary, chat_ids, participants=False, message_cursor=messages)
+                        summary.executemany("UPDATE chat_reads SET unread_count = 0 WHERE chat_id = ?",
+                                            [(chat_id,) for chat_id in chat_ids])
             
             return True
         except Exception as e:
             return False
     
+    def get_user_chat_ids(self, user_id):
+        """ID чатов пользователя без сводок - для маршрутизации рассылок"""
+        try:
+            with self.pool.reader() as conn:
+                return [row[0] for row in conn.execute(
+                    "SELECT chat_id FROM chat_participants WHERE user_id = ?", (user_id,)
+                )]
+        except Exception as e:
+            return []
+    
     def get_user_chats(self, user_id):
         """Получение чатов пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT DISTINCT c.id, c.chat_type, c.created_at,
-                       (SELECT COUNT(*) FROM messages WHERE chat_id = c.id) as message_count,
-                       (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                       GROUP_CONCAT(u.display_name, ', ') as participants
-                FROM chats c
-                JOIN chat_participants cp ON c.id = cp.chat_id
-                JOIN users u ON cp.user_id = u.id
-                WHERE c.id IN (
-                    SELECT chat_id FROM chat_participants WHERE user_id = ?
-                )
-                GROUP BY c.id
-                ORDER BY c.created_at DESC
-            ''', (user_id,))
-            
-            chats = cursor.fetchall()
-            conn.close()
+            with self.pool.reader() as conn:
+                cursor = conn.cursor()
+                
+                # Счетчики, последнее сообщение и участники берутся из сводки chat_summary
+                cursor.execute('''
+                    SELECT DISTINCT c.id, c.chat_type, c.created_at,
+                           s.message_count + s.archived_count, s.last_message_preview, s.participants,
+                           COALESCE(r.last_read_message_id, 0),
+                           MIN(COALESCE(r.unread_count, 0), s.message_count + s.archived_count)
+                    FROM chat_participants cp
+                    JOIN chats c ON c.id = cp.chat_id
+                    JOIN chat_summary s ON s.chat_id = cp.chat_id
+                    LEFT JOIN chat_reads r ON r.chat_id = cp.chat_id AND r.user_id = cp.user_id
+                    WHERE cp.user_id = ?
+                    ORDER BY c.created_at DESC
+                ''', (user_id,))
+                
+                chats = cursor.fetchall()
             
             result = []
             for chat in chats:
-                chat_id, chat_type, created_at, message_count, last_message, participants = chat
-                
-                # Формируем имя чата из имен участников (исключая текущего пользователя)
-                participant_names = [name.strip() for name in participants.split(',') if name.strip() != '']
-                current_user_name = self.get_user_display_name(user_id)
-                chat_name = ', '.join([name for name in participant_names if name != current_user_name])
+                chat_id, chat_type, created_at, message_count, last_message, participants, last_read, unread = chat
                 
                 result.append({
                     "chat_id": chat_id,
@@ -264,7 +1857,9 @@ class DatabaseManager:
                     "created_at": created_at,
                     "message_count": message_count,
                     "last_message": last_message,
-                    "chat_name": chat_name or f"Чат {chat_id}"
+                    "chat_name": self._chat_name(chat_id, participants, user_id),
+                    "unread_count": unread,
+                    "last_read_message_id": last_read
                 })
             
             return result
@@ -274,123 +1869,353 @@ class DatabaseManager:
     def create_chat(self, chat_type, participants):
         """Создание нового чата"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Создаем чат
-            cursor.execute("INSERT INTO chats (chat_type) VALUES (?)", (chat_type,))
-            chat_id = cursor.lastrowid
-            
-            # Добавляем участников
-            for user_id in participants:
-                cursor.execute("INSERT INTO chat_participants (chat_id, user_id) VALUES (?, ?)", (chat_id, user_id))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.writer() as conn:
+                chat_id = self._insert_chat(conn.cursor(), chat_type, participants)
             
+            self._mirror_chat(chat_id, chat_type)
             return chat_id
         except Exception as e:
             return None
     
+    def mark_read(self, user_id, chat_id, message_id=None):
+        """Отметка чата прочитанным до message_id (None - до последнего сообщения).
+        
+        Возвращает новую отметку и число непрочитанных или None, если пользователь не участник чата.
+        """
+        try:
+            shard = self._shard(chat_id)
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                row = cursor.execute('''
+                    SELECT r.last_read_message_id, r.unread_count, COALESCE(s.last_message_id, 0)
+                    FROM chat_reads r
+                    LEFT JOIN chat_summary s ON s.chat_id = r.chat_id
+                    WHERE r.chat_id = ? AND r.user_id = ?
+                ''', (chat_id, user_id)).fetchone()
+                if not row:
+                    return None
+                
+                last_read, unread, last_message_id = row
+                target = last_message_id if message_id is None else min(int(message_id), last_message_id)
+                
+                # Отметка прочтения не сдвигается назад
+                if target > last_read:
+                    last_read = target
+                    if target >= last_message_id:
+                        unread = 0
+                    else:
+                        # Частичное прочтение: считаются только сообщения после отметки, уже учтенные в сводке
+                        count_sql = '''
+                            SELECT COUNT(*) FROM messages
+                            WHERE chat_id = ? AND id > ? AND id <= ? AND sender_id != ?
+                        '''
+                        params = (chat_id, target, last_message_id, user_id)
+                        if shard.external:
+                            with shard.pool.reader() as messages:
+                                unread = messages.execute(count_sql, params).fetchone()[0]
+                        else:
+                            unread = cursor.execute(count_sql, params).fetchone()[0]
+                        # Отметка может оказаться в архивной части истории
+                        if shard.archive:
+                            unread += shard.archive.count_after(chat_id, target, exclude_sender_id=user_id)
+                    
+                    cursor.execute(
+                        "UPDATE chat_reads SET last_read_message_id = ?, unread_count = ? WHERE chat_id = ? AND user_id = ?",
+                        (last_read, unread, chat_id, user_id)
+                    )
+            
+            return {"chat_id": chat_id, "last_read_message_id": last_read, "unread_count": unread}
+        except Exception as e:
+            return None
+    
+    def _insert_chat(self, cursor, chat_type, participants):
+        """Вставка чата, его участников и сводки в открытой транзакции писателя"""
+        cursor.execute("INSERT INTO chats (chat_type) VALUES (?)", (chat_type,))
+        chat_id = cursor.lastrowid
+        
+        # Добавляем участников
+        cursor.executemany(
+            "INSERT INTO chat_participants (chat_id, user_id) VALUES (?, ?)",
+            [(chat_id, user_id) for user_id in participants]
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO chat_reads (chat_id, user_id) VALUES (?, ?)",
+            [(chat_id, user_id) for user_id in participants]
+        )
+        
+        _refresh_chat_summaries(cursor, [chat_id], messages=False)
+        return chat_id
+    
+    def _find_private_chat(self, cursor, pair):
+        """Поиск приватного чата по канонической паре пользователей"""
+        cursor.execute(
+            "SELECT chat_id FROM private_chat_pairs WHERE min_user_id = ? AND max_user_id = ?", pair
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
     def get_or_create_private_chat(self, user1_id, user2_id):
         """Получение или создание приватного чата между двумя пользователями"""
+        pair = (min(user1_id, user2_id), max(user1_id, user2_id))
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Ищем существующий приватный чат
-            cursor.execute('''
-                SELECT c.id FROM chats c
-                JOIN chat_participants cp1 ON c.id = cp1.chat_id
-                JOIN chat_participants cp2 ON c.id = cp2.chat_id
-                WHERE c.chat_type = 'private' 
-                AND cp1.user_id = ? AND cp2.user_id = ?
-            ''', (user1_id, user2_id))
-            
-            existing_chat = cursor.fetchone()
-            
-            if existing_chat:
-                conn.close()
-                return existing_chat[0]
-            
-            # Создаем новый чат
-            chat_id = self.create_chat("private", [user1_id, user2_id])
-            conn.close()
-            
+            # Быстрый путь: один поиск по первичному ключу без блокировки писателя
+            with self.pool.reader() as conn:
+                chat_id = self._find_private_chat(conn.cursor(), pair)
+            if chat_id is not None:
+                return chat_id
+            
+            # Повторная проверка и создание в одной транзакции писателя
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                chat_id = self._find_private_chat(cursor, pair)
+                if chat_id is None:
+                    chat_id = self._insert_chat(cursor, "private", list(dict.fromkeys((user1_id, user2_id))))
+                    cursor.execute(
+                        "INSERT INTO private_chat_pairs (min_user_id, max_user_id, chat_id) VALUES (?, ?, ?)",
+                        (pair[0], pair[1], chat_id)
+                    )
+            
+            self._mirror_chat(chat_id, "private")
             return chat_id
+        except sqlite3.IntegrityError:
+            # Пару успел создать другой процесс - транзакция откатена, возвращаем его чат
+            try:
+                with self.pool.reader() as conn:
+                    return self._find_private_chat(conn.cursor(), pair)
+            except Exception as e:
+                return None
         except Exception as e:
             return None
     
-    def save_message(self, chat_id, sender_id, content, encrypted_content=None, message_type="normal"):
-        """Сохранение сообщения"""
+    def save_message_async(self, chat_id, sender_id, content, encrypted_content=None, message_type="normal",
+                           callback=None):
+        """Сохранение сообщения через групповой коммит; Future возвращает id сообщения"""
+        return self._submit_message(chat_id, sender_id, content, encrypted_content, message_type, callback)
+    
+    def _submit_message(self, chat_id, sender_id, content, encrypted_content, message_type, callback):
+        """Запись сообщения в групповой коммит его шарда.
+        
+        Сводка чата обновляется в той же транзакции, а для отдельного файла шарда -
+        следом, групповым коммитом основной базы после коммита шарда.
+        """
+        shard = self._shard(chat_id)
+        inserted = {}
+        
+        def insert(cursor):
+            message_id, created_at = shard.insert_message(cursor, chat_id, sender_id, content,
+                                                          encrypted_content, message_type)
+            if shard.external:
+                inserted['created_at'] = created_at
+            else:
+                _apply_message_to_summary(cursor, chat_id, message_id, sender_id, content, created_at)
+            return message_id
+        
+        future = shard.write_batcher.submit(insert, callback)
+        if shard.external:
+            future.add_done_callback(
+                lambda done: self._queue_summary_update(done, chat_id, sender_id, content, inserted)
+            )
+        return future
+    
+    def _queue_summary_update(self, done, chat_id, sender_id, content, inserted):
+        """Учет сообщения, сохраненного в шарде, в сводке основной базы"""
+        if done.cancelled() or done.exception() is not None:
+            return
+        message_id = done.result()
+        self.write_batcher.submit(
+            lambda cursor: _apply_message_to_summary(cursor, chat_id, message_id, sender_id, content,
+                                                     inserted['created_at'])
+        )
+    
+    def get_chat_messages_page(self, chat_id, limit=DEFAULT_PAGE_SIZE, before_id=None, after_id=None, direction=None):
+        """Страница истории чата по курсору (keyset-пагинация по id сообщения).
+        
+        Стоимость любой страницы одинакова: поиск по индексу (chat_id, id) и чтение limit строк.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+            if direction is None:
+                direction = 'forward' if after_id is not None and before_id is None else 'backward'
+            if direction not in ('backward', 'forward'):
+                raise ValueError(f"Неизвестное направление: {direction}")
+            
+            conditions = ["m.chat_id = ?"]
+            params = [chat_id]
+            if before_id is not None:
+                conditions.append("m.id < ?")
+                params.append(int(before_id))
+            if after_id is not None:
+                conditions.append("m.id > ?")
+                params.append(int(after_id))
+            order = "DESC" if direction == 'backward' else "ASC"
+            
+            shard = self._shard(chat_id)
+            with shard.pool.reader() as conn:
+                cursor = conn.cursor()
+                
+                # Читаем на одну строку больше, чтобы узнать, есть ли следующая страница
+                cursor.execute(f'''
+                    SELECT m.id, m.sender_id, m.content, m.encrypted_content, m.message_type, m.created_at
+                    FROM messages m
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY m.id {order}
+                    LIMIT ?
+                ''', params + [limit + 1])
+                
+                messages = cursor.fetchall()
             
-            cursor.execute('''
-                INSERT INTO messages (chat_id, sender_id, content, encrypted_content, message_type)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (chat_id, sender_id, content, encrypted_content, message_type))
+            # За пределами горячего окна страница дочитывается из архива
+            if shard.archive and (len(messages) <= limit or direction == 'forward'):
+                messages = self._merge_archived(shard.archive, chat_id, messages, limit + 1, before_id, after_id,
+                                                direction == 'backward')
             
-            conn.commit()
-            conn.close()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            ids = [msg[0] for msg in messages]
+            # Имена отправителей берутся из справочника пользователей в памяти
+            names = self._display_names(msg[1] for msg in messages)
             
-            return True
+            return {
+                "messages": [{"id": msg[0], "sender_id": msg[1], "content": msg[2],
+                              "encrypted_content": msg[3], "message_type": msg[4],
+                              "created_at": msg[5], "sender_name": names.get(msg[1])} for msg in messages],
+                "direction": direction,
+                "has_more": has_more,
+                # Курсоры для следующих запросов: before_id - дальше в прошлое, after_id - к новым
+                "before_id": min(ids) if ids else before_id,
+                "after_id": max(ids) if ids else after_id
+            }
         except Exception as e:
-            return False
+            return {"messages": [], "direction": direction, "has_more": False,
+                    "before_id": before_id, "after_id": after_id}
+    
+    def _merge_archived(self, archive, chat_id, messages, limit, before_id, after_id, descending):
+        """Дополнение страницы сообщениями из архива"""
+        if descending:
+            # Листаем в прошлое: архив начинается сразу за самым старым горячим сообщением
+            boundary = messages[-1][0] if messages else before_id
+            archived = archive.fetch(chat_id, limit - len(messages), before_id=boundary,
+                                     after_id=after_id, descending=True)
+        else:
+            # Листаем к новым: архивные сообщения идут раньше горячих
+            archived = archive.fetch(chat_id, limit, before_id=before_id, after_id=after_id,
+                                     descending=False)
+        if not archived:
+            return messages
+        
+        merged = messages + archived
+        merged.sort(key=lambda message: message[0], reverse=descending)
+        return merged[:limit]
     
-    def get_chat_messages(self, chat_id, limit=50):
-        """Получение сообщений чата"""
+    def search_messages(self, user_id, query, limit=20, cursor=None):
+        """Полнотекстовый поиск по обычным сообщениям в чатах пользователя.
+        
+        Результаты идут от новых к старым; cursor - id последнего сообщения предыдущей страницы.
+        Защищенные сообщения не индексируются и в поиск не попадают.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            query = (query or '').strip()
+            if not query:
+                return {"messages": [], "next_cursor": None}
             
-            cursor.execute('''
-                SELECT m.id, m.sender_id, m.content, m.encrypted_content, m.message_type, m.created_at,
-                       u.display_name
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.chat_id = ?
-                ORDER BY m.created_at DESC
-                LIMIT ?
-            ''', (chat_id, limit))
+            limit = max(1, min(int(limit or 20), MAX_PAGE_SIZE))
+            before_id = int(cursor) if cursor else None
             
-            messages = cursor.fetchall()
-            conn.close()
+            with self.pool.reader() as conn:
+                chat_ids = [row[0] for row in conn.execute(
+                    "SELECT chat_id FROM chat_participants WHERE user_id = ?", (user_id,)
+                )]
+            
+            # Каждый шард ищет среди своих чатов пользователя, результаты сливаются по id
+            by_shard = {}
+            for chat_id in chat_ids:
+                by_shard.setdefault(self._shard(chat_id).index, []).append(chat_id)
             
-            return [{"id": msg[0], "sender_id": msg[1], "content": msg[2], 
-                    "encrypted_content": msg[3], "message_type": msg[4], 
-                    "created_at": msg[5], "sender_name": msg[6]} for msg in messages]
+            rows = []
+            for index, shard_chat_ids in by_shard.items():
+                rows.extend(self._search_shard(self.shards[index], shard_chat_ids, query, before_id, limit + 1))
+            rows.sort(key=lambda row: row[0], reverse=True)
+            
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            names = self._display_names(row[2] for row in rows)
+            
+            return {
+                "messages": [{"id": row[0], "chat_id": row[1], "sender_id": row[2], "sender_name": names.get(row[2]),
+                              "content": row[3], "created_at": row[4], "snippet": row[5]} for row in rows],
+                "next_cursor": rows[-1][0] if has_more else None
+            }
         except Exception as e:
-            return []
+            return {"messages": [], "next_cursor": None}
+    
+    def _search_shard(self, shard, chat_ids, query, before_id, limit):
+        """Поиск по сообщениям указанных чатов в одном шарде, от новых к старым"""
+        chats = ','.join('?' * len(chat_ids))
+        with shard.pool.reader() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+            if cursor.fetchone():
+                cursor.execute(f'''
+                    SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at,
+                           snippet(messages_fts, 0, '[', ']', '…', 12)
+                    FROM messages_fts
+                    JOIN messages m ON m.id = messages_fts.rowid
+                    WHERE messages_fts MATCH ?
+                    AND m.chat_id IN ({chats})
+                    AND m.message_type IS NOT 'secure'
+                    AND (? IS NULL OR messages_fts.rowid < ?)
+                    ORDER BY messages_fts.rowid DESC
+                    LIMIT ?
+                ''', (_fts_query(query), *chat_ids, before_id, before_id, limit))
+            else:
+                # Запасной вариант без FTS5
+                cursor.execute(f'''
+                    SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at, m.content
+                    FROM messages m
+                    WHERE m.content LIKE ?
+                    AND m.chat_id IN ({chats})
+                    AND m.message_type IS NOT 'secure'
+                    AND (? IS NULL OR m.id < ?)
+                    ORDER BY m.id DESC
+                    LIMIT ?
+                ''', (f"%{query}%", *chat_ids, before_id, before_id, limit))
+            
+            rows = cursor.fetchall()
+        
+        # Перенесенные в архив сообщения ищутся по индексу архива
+        if shard.archive:
+            rows.extend(shard.archive.search(chat_ids, query, before_id, limit, match=_fts_query(query)))
+        return rows
     
     def create_secure_chat_session(self, chat_key, encryption_key=None):
         """Создание защищенной сессии чата"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Генерируем ключ шифрования если не предоставлен
             if not encryption_key:
                 encryption_key = self.crypto_manager.generate_key()
             
-            # Создаем новый чат
-            cursor.execute('''
-                INSERT INTO chats (chat_type) VALUES ('secure')
-            ''')
-            chat_id = cursor.lastrowid
-            
             # Добавляем участников (пока пустой чат)
             session_id = str(uuid.uuid4())
             
-            cursor.execute('''
-                INSERT INTO secure_chats (chat_id, chat_key, encryption_key, session_id)
-                VALUES (?, ?, ?, ?)
-            ''', (chat_id, chat_key, encryption_key, session_id))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                
+                # Создаем новый чат
+                cursor.execute('''
+                    INSERT INTO chats (chat_type) VALUES ('secure')
+                ''')
+                chat_id = cursor.lastrowid
+                
+                cursor.execute('''
+                    INSERT INTO secure_chats (chat_id, chat_key, encryption_key, session_id)
+                    VALUES (?, ?, ?, ?)
+                ''', (chat_id, chat_key, encryption_key, session_id))
+                
+                cursor.execute("INSERT INTO chat_summary (chat_id) VALUES (?)", (chat_id,))
             
+            self._mirror_chat(chat_id, "secure")
+            self.secure_sessions.put(chat_key, chat_id, encryption_key, session_id)
             return {
                 'chat_id': chat_id,
                 'chat_key': chat_key,
@@ -400,122 +2225,114 @@ class DatabaseManager:
         except Exception as e:
             return None
     
+    def _secure_session(self, chat_key):
+        """Сессия защищенного чата из реестра; при промахе читается из secure_chats и кэшируется"""
+        session = self.secure_sessions.get(chat_key)
+        if session is not None:
+            return session
+        
+        with self.pool.reader() as conn:
+            session_data = conn.execute('''
+                SELECT chat_id, encryption_key, session_id FROM secure_chats
+                WHERE chat_key = ? ORDER BY created_at DESC LIMIT 1
+            ''', (chat_key,)).fetchone()
+        
+        if not session_data:
+            return None
+        return self.secure_sessions.put(chat_key, *session_data)
+    
     def get_secure_chat_session(self, chat_key):
         """Получение защищенной сессии чата по ключу"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT chat_id, encryption_key, session_id FROM secure_chats
-                WHERE chat_key = ? ORDER BY created_at DESC LIMIT 1
-            ''', (chat_key,))
-            
-            session_data = cursor.fetchone()
-            conn.close()
-            
-            if session_data:
+            session = self._secure_session(chat_key)
+            if session:
                 return {
-                    "chat_id": session_data[0],
-                    "encryption_key": session_data[1], 
-                    "session_id": session_data[2]
+                    "chat_id": session.chat_id,
+                    "encryption_key": session.encryption_key,
+                    "session_id": session.session_id
                 }
             return None
         except Exception as e:
             return None
     
+    def get_secure_session_stats(self):
+        """Получение метрик реестра защищенных сессий"""
+        return self.secure_sessions.stats()
+    
     def clear_secure_chat(self, chat_id):
         """Очистка защищенного чата"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Удаляем сообщения защищенного чата
-            cursor.execute("DELETE FROM messages WHERE chat_id = ? AND message_type = 'secure'", (chat_id,))
-            
-            # Удаляем сессию
-            cursor.execute("DELETE FROM secure_chats WHERE chat_id = ?", (chat_id,))
-            
-            conn.commit()
-            conn.close()
+            with self._shard(chat_id).pool.writer() as conn:
+                cursor = conn.cursor()
+                
+                # Удаляем сообщения защищенного чата
+                cursor.execute("DELETE FROM messages WHERE chat_id = ? AND message_type = 'secure'", (chat_id,))
+                
+                with _summary_cursor(self.pool, cursor) as (summary, messages):
+                    # Удаляем сессию
+                    summary.execute("DELETE FROM secure_chats WHERE chat_id = ?", (chat_id,))
+                    
+                    _refresh_chat_summaries(summary, [chat_id], participants=False, message_cursor=messages)
             
             return True
         except Exception as e:
             return False
+        finally:
+            self.secure_sessions.invalidate_chat(chat_id)
     
-    def save_secure_message(self, chat_key, sender_id, content):
-        """Сохранение защищенного сообщения"""
+    def save_secure_message_async(self, chat_key, sender_id, content, callback=None):
+        """Сохранение защищенного сообщения через групповой коммит.
+        
+        Future возвращает id сообщения или None, если защищенный чат не найден.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Получаем chat_id и ключ шифрования по ключу чата
-            cursor.execute("SELECT chat_id, encryption_key FROM secure_chats WHERE chat_key = ?", (chat_key,))
-            result = cursor.fetchone()
-            
-            if not result:
-                conn.close()
-                return False
-            
-            chat_id, encryption_key = result
-            
-            # Шифруем сообщение
-            try:
-                encrypted_content = self.crypto_manager.encrypt_message(content, encryption_key)
-            except Exception as e:
-                # Если шифрование не удалось, сохраняем как обычное сообщение
-                encrypted_content = None
-            
-            # Сохраняем сообщение
-            cursor.execute('''
-                INSERT INTO messages (chat_id, sender_id, content, encrypted_content, message_type)
-                VALUES (?, ?, ?, ?, 'secure')
-            ''', (chat_id, sender_id, content, encrypted_content))
-            
-            conn.commit()
-            conn.close()
-            
-            return True
+            # chat_id и шифратор берутся из реестра сессий, к базе - только при промахе
+            session = self._secure_session(chat_key)
         except Exception as e:
-            return False
+            session = None
+        
+        if not session:
+            future = Future()
+            future.set_result(None)
+            if callback:
+                future.add_done_callback(callback)
+            return future
+        
+        # Шифруем сообщение вне транзакции, чтобы не задерживать остальные записи
+        try:
+            encrypted_content = session.encrypt(content)
+        except Exception as e:
+            # Если шифрование не удалось, сохраняем как обычное сообщение
+            encrypted_content = None
+        
+        return self._submit_message(session.chat_id, sender_id, content, encrypted_content, 'secure', callback)
     
     def get_secure_messages(self, chat_key):
         """Получение защищенных сообщений"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Получаем chat_id и ключ шифрования по ключу чата
-            cursor.execute("SELECT chat_id, encryption_key FROM secure_chats WHERE chat_key = ?", (chat_key,))
-            result = cursor.fetchone()
-            
-            if not result:
-                conn.close()
+            session = self._secure_session(chat_key)
+            if not session:
                 return []
             
-            chat_id, encryption_key = result
-            
             # Получаем сообщения
-            cursor.execute('''
-                SELECT m.content, m.encrypted_content, u.display_name, m.created_at
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.chat_id = ? AND m.message_type = 'secure'
-                ORDER BY m.created_at ASC
-            ''', (chat_id,))
-            
-            messages = cursor.fetchall()
-            conn.close()
-            
+            with self._shard(session.chat_id).pool.reader() as conn:
+                messages = conn.execute('''
+                    SELECT m.content, m.encrypted_content, m.sender_id, m.created_at
+                    FROM messages m
+                    WHERE m.chat_id = ? AND m.message_type = 'secure'
+                    ORDER BY m.created_at ASC
+                ''', (session.chat_id,)).fetchall()
+            
+            names = self._display_names(msg[2] for msg in messages)
             result_messages = []
             for msg in messages:
-                content, encrypted_content, sender, created_at = msg
+                content, encrypted_content, sender_id, created_at = msg
+                sender = names.get(sender_id)
                 
                 # Пытаемся расшифровать, если есть зашифрованное содержимое
                 if encrypted_content:
                     try:
-                        decrypted_content = self.crypto_manager.decrypt_message(encrypted_content, encryption_key)
-                        content = decrypted_content
+                        content = session.decrypt(encrypted_content)
                     except Exception as e:
                         # Если расшифровка не удалась, используем обычное содержимое
                         pass
@@ -533,81 +2350,74 @@ class DatabaseManager:
     def close_secure_chat(self, chat_key):
         """Закрытие защищенного чата"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Получаем chat_id по ключу
-            cursor.execute("SELECT chat_id FROM secure_chats WHERE chat_key = ?", (chat_key,))
-            result = cursor.fetchone()
-            
-            if not result:
-                conn.close()
+            session = self._secure_session(chat_key)
+            if not session:
                 return False
             
-            chat_id = result[0]
+            chat_id = session.chat_id
             
-            # Удаляем сообщения защищенного чата
-            cursor.execute("DELETE FROM messages WHERE chat_id = ? AND message_type = 'secure'", (chat_id,))
-            
-            # Удаляем сессию защищенного чата
-            cursor.execute("DELETE FROM secure_chats WHERE chat_key = ?", (chat_key,))
-            
-            conn.commit()
-            conn.close()
+            with self._shard(chat_id).pool.writer() as conn:
+                cursor = conn.cursor()
+                
+                # Удаляем сообщения защищенного чата
+                cursor.execute("DELETE FROM messages WHERE chat_id = ? AND message_type = 'secure'", (chat_id,))
+                
+                with _summary_cursor(self.pool, cursor) as (summary, messages):
+                    # Удаляем сессию защищенного чата
+                    summary.execute("DELETE FROM secure_chats WHERE chat_key = ?", (chat_key,))
+                    
+                    _refresh_chat_summaries(summary, [chat_id], participants=False, message_cursor=messages)
             
             return True
         except Exception as e:
             return False
+        finally:
+            self.secure_sessions.invalidate(chat_key)
     
     def get_chat_info(self, user_id, chat_id):
         """Получение информации о чате"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Получаем информацию о чате и участниках
-            cursor.execute('''
-                SELECT c.id, c.chat_type, c.created_at,
-                       GROUP_CONCAT(u.display_name, ', ') as participants
-                FROM chats c
-                JOIN chat_participants cp ON c.id = cp.chat_id
-                JOIN users u ON cp.user_id = u.id
-                WHERE c.id = ? AND c.id IN (
-                    SELECT chat_id FROM chat_participants WHERE user_id = ?
-                )
-                GROUP BY c.id
-            ''', (chat_id, user_id))
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self.pool.reader() as conn:
+                cursor = conn.cursor()
+                
+                # Получаем информацию о чате и участниках; участие пользователя проверяется тем же запросом
+                cursor.execute('''
+                    SELECT c.id, c.chat_type, c.created_at, s.participants
+                    FROM chat_participants cp
+                    JOIN chats c ON c.id = cp.chat_id
+                    JOIN chat_summary s ON s.chat_id = cp.chat_id
+                    WHERE cp.chat_id = ? AND cp.user_id = ?
+                    LIMIT 1
+                ''', (chat_id, user_id))
+                
+                result = cursor.fetchone()
             
             if result:
                 chat_id, chat_type, created_at, participants = result
-                # Формируем имя чата из имен участников (исключая текущего пользователя)
-                participant_names = [name.strip() for name in participants.split(',') if name.strip() != '']
-                current_user_name = self.get_user_display_name(user_id)
-                chat_name = ', '.join([name for name in participant_names if name != current_user_name])
                 
                 return {
                     "chat_id": chat_id,
                     "chat_type": chat_type,
                     "created_at": created_at,
-                    "chat_name": chat_name or f"Чат {chat_id}"
+                    "chat_name": self._chat_name(chat_id, participants, user_id)
                 }
             return None
         except Exception as e:
             return None
     
+    def _chat_name(self, chat_id, participants, user_id):
+        """Имя чата из имен участников, кроме текущего пользователя (по ID, без запросов к базе)"""
+        names = [name for member_id, name in json.loads(participants) if member_id != user_id]
+        return ', '.join(names) or f"Чат {chat_id}"
+    
     def get_user_display_name(self, user_id):
         """Получение имени пользователя по ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT display_name FROM users WHERE id = ?", (user_id,))
-            result = cursor.fetchone()
-            
-            conn.close()
+            with self.pool.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT display_name FROM users WHERE id = ?", (user_id,))
+                result = cursor.fetchone()
             
             return result[0] if result else None
         except Exception as e:
@@ -616,21 +2426,23 @@ class DatabaseManager:
     def change_display_name(self, user_id, new_display_name):
         """Изменение имени пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Проверяем, что новое имя не занято
-            cursor.execute("SELECT id FROM users WHERE display_name = ? AND id != ?", (new_display_name, user_id))
-            if cursor.fetchone():
-                conn.close()
-                return False
-            
-            # Обновляем имя
-            cursor.execute("UPDATE users SET display_name = ? WHERE id = ?", (new_display_name, user_id))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                
+                # Проверяем, что новое имя не занято
+                cursor.execute("SELECT id FROM users WHERE display_name = ? AND id != ?", (new_display_name, user_id))
+                if cursor.fetchone():
+                    return False
+                
+                # Обновляем имя
+                cursor.execute("UPDATE users SET display_name = ? WHERE id = ?", (new_display_name, user_id))
+                
+                # Обновляем имена участников в сводках чатов пользователя
+                cursor.execute("SELECT chat_id FROM chat_participants WHERE user_id = ?", (user_id,))
+                chat_ids = [row[0] for row in cursor.fetchall()]
+                _refresh_chat_summaries(cursor, chat_ids, messages=False)
             
+            self.user_directory.rename(user_id, new_display_name)
             return True
         except Exception as e:
             return False
@@ -638,21 +2450,20 @@ class DatabaseManager:
     def get_all_chats(self):
         """Получение всех чатов для веб-API"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT c.id, c.chat_type, c.created_at,
-                       GROUP_CONCAT(u.display_name, ', ') as participants
-                FROM chats c
-                LEFT JOIN chat_participants cp ON c.id = cp.chat_id
-                LEFT JOIN users u ON cp.user_id = u.id
-                GROUP BY c.id
-                ORDER BY c.created_at DESC
-            ''')
-            
-            chats = cursor.fetchall()
-            conn.close()
+            with self.pool.reader() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT c.id, c.chat_type, c.created_at,
+                           GROUP_CONCAT(u.display_name, ', ') as participants
+                    FROM chats c
+                    LEFT JOIN chat_participants cp ON c.id = cp.chat_id
+                    LEFT JOIN users u ON cp.user_id = u.id
+                    GROUP BY c.id
+                    ORDER BY c.created_at DESC
+                ''')
+                
+                chats = cursor.fetchall()
             
             result = []
             for chat in chats:
@@ -0,0 +1,102 @@
+import os
+
+# Кадр протокола: 4 байта длины (big-endian) + сообщение в UTF-8
+HEADER_SIZE = 4
+# Больше этого кадр не принимается: поврежденная или враждебная длина не должна выделять гигабайты
+MAX_FRAME_SIZE = int(os.getenv('MESSENGER_MAX_FRAME', 16 * 1024 * 1024))
+# Размер одного чтения из сокета: за один системный вызов читается несколько небольших кадров
+READ_SIZE = 64 * 1024
+
+class FrameTooLarge(ValueError):
+    """Длина кадра больше допустимой"""
+
+def encode_frame(message):
+    """Кадр из строки или байтов"""
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    return len(message).to_bytes(HEADER_SIZE, 'big') + message
+
+def check_frame_size(length, max_frame_size=MAX_FRAME_SIZE):
+    """Проверка длины из заголовка кадра"""
+    if length > max_frame_size:
+        raise FrameTooLarge(f"кадр {length} байт больше допустимых {max_frame_size}")
+    return length
+
+class FrameReader:
+    """Чтение кадров из блокирующего сокета через recv_into в переиспользуемый буфер.
+
+    Заголовок может прийти по частям, несколько кадров - за одно чтение; буфер растет
+    только под кадр больше READ_SIZE и после него возвращается к исходному размеру.
+    """
+
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE, read_size=READ_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self.read_size = read_size
+        self._buffer = bytearray(read_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # начало непрочитанных данных
+        self._end = 0  # конец полученных данных
+
+    def _fill(self, needed):
+        """Чтение из сокета, пока в буфере не будет needed байт от начала кадра; False - соединение закрыто"""
+        if self._start + needed > len(self._buffer):
+            self._reserve(needed)
+        while self._end - self._start < needed:
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                return False
+            self._end += received
+        return True
+
+    def _reserve(self, needed):
+        """Место под кадр: сдвиг непрочитанных данных в начало буфера или его увеличение"""
+        pending = self._end - self._start
+        if needed > len(self._buffer):
+            buffer = bytearray(max(needed, self.read_size))
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        else:
+            self._view[:pending] = self._view[self._start:self._end]
+        self._start, self._end = 0, pending
+
+    def _consume(self, size):
+        """Пропуск прочитанного кадра; пустой буфер сбрасывается, увеличенный - уменьшается"""
+        self._start += size
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(self._buffer) > self.read_size:
+                self._buffer = bytearray(self.read_size)
+                self._view = memoryview(self._buffer)
+
+    def _next_frame(self):
+        """Границы следующего кадра в буфере (None - соединение закрыто)"""
+        if not self._fill(HEADER_SIZE):
+            return None
+        length = check_frame_size(
+            int.from_bytes(self._view[self._start:self._start + HEADER_SIZE], 'big'), self.max_frame_size
+        )
+        if not self._fill(HEADER_SIZE + length):
+            return None
+        return self._start + HEADER_SIZE, self._start + HEADER_SIZE + length
+
+    def read_frame(self):
+        """Содержимое следующего кадра в байтах (None - соединение закрыто)"""
+        bounds = self._next_frame()
+        if bounds is None:
+            return None
+        start, end = bounds
+        payload = bytes(self._view[start:end])
+        self._consume(end - self._start)
+        return payload
+
+    def read_message(self):
+        """Следующий кадр, декодированный из буфера без промежуточной копии (None - соединение закрыто)"""
+        bounds = self._next_frame()
+        if bounds is None:
+            return None
+        start, end = bounds
+        message = str(self._view[start:end], 'utf-8')
+        self._consume(end - self._start)
+        return message
@@ -0,0 +1,450 @@
+import bisect
+import threading
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from crypto_utils import CryptoManager
+from storage import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, StorageBackend
+from user_directory import UserDirectory
+
+# Длина превью последнего сообщения в списке чатов (как в сводке SQLite)
+SUMMARY_PREVIEW_LENGTH = 200
+
+def _now():
+    """Текущее время в формате CURRENT_TIMESTAMP SQLite"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def _done(result, callback=None):
+    """Уже завершенный Future - запись в памяти не ждет группового коммита"""
+    future = Future()
+    if callback:
+        future.add_done_callback(callback)
+    future.set_result(result)
+    return future
+
+class MemoryStorage(StorageBackend):
+    """Хранилище в памяти на словарях и списках: для тестов и нагрузочных замеров без диска.
+
+    Контракт тот же, что у DatabaseManager; данные живут до завершения процесса.
+    """
+
+    def __init__(self):
+        self.crypto_manager = CryptoManager()
+        self.user_directory = UserDirectory()
+        self._lock = threading.RLock()
+
+        self._users = {}  # {user_id: {'username', 'display_name', 'password_hash', 'secret_phrase', 'created_at'}}
+        self._usernames = {}  # {username: user_id}
+        self._chats = {}  # {chat_id: {'chat_type', 'created_at', 'participants': [user_id]}}
+        self._user_chats = {}  # {user_id: [chat_id]}
+        self._private_pairs = {}  # {(min_user_id, max_user_id): chat_id}
+        self._secure_chats = {}  # {chat_key: (chat_id, encryption_key, session_id)}
+        self._reads = {}  # {(chat_id, user_id): [last_read_message_id, unread_count]}
+
+        # Сообщения чата упорядочены по id: курсор страницы ищется двоичным поиском по _message_ids
+        self._messages = {}  # {chat_id: [(id, sender_id, content, encrypted_content, message_type, created_at)]}
+        self._message_ids = {}  # {chat_id: [id]}
+
+        self._next_user_id = 1
+        self._next_chat_id = 1
+        self._next_message_id = 1
+
+    # Пользователи
+
+    def register_user(self, username, display_name, password):
+        """Регистрация нового пользователя"""
+        try:
+            password_hash = self.hash_password(password)
+
+            with self._lock:
+                if username in self._usernames:
+                    return False, "Пользователь с таким именем уже существует"
+
+                secret_phrase = self.generate_secret_phrase()
+                user_id = self._next_user_id
+                self._next_user_id += 1
+                self._users[user_id] = {
+                    'username': username,
+                    'display_name': display_name,
+                    'password_hash': password_hash,
+                    'secret_phrase': secret_phrase,
+                    'created_at': _now()
+                }
+                self._usernames[username] = user_id
+
+            self.user_directory.add(user_id, username, display_name)
+            return True, secret_phrase
+        except Exception as e:
+            return False, f"Ошибка регистрации: {str(e)}"
+
+    def authenticate_user(self, username, password):
+        """Аутентификация пользователя"""
+        try:
+            with self._lock:
+                user_id = self._usernames.get(username)
+                user = dict(self._users[user_id]) if user_id is not None else None
+
+            if not user:
+                return False, "Пользователь не найден"
+
+            if self.verify_password(password, user['password_hash']):
+                return True, {"user_id": user_id, "username": username, "display_name": user['display_name']}
+            else:
+                return False, "Неверный пароль"
+        except Exception as e:
+            return False, f"Ошибка аутентификации: {str(e)}"
+
+    def find_user_by_display_name(self, display_name):
+        """Поиск пользователя по имени аккаунта"""
+        with self._lock:
+            for user_id, user in self._users.items():
+                if user['display_name'] == display_name:
+                    return {"user_id": user_id, "username": user['username'], "display_name": display_name}
+        return None
+
+    def search_users(self, prefix, limit=10):
+        """Ранжированный поиск пользователей по началу или похожему имени"""
+        try:
+            limit = max(1, min(int(limit or 10), 100))
+            return self.user_directory.search(prefix, limit)
+        except Exception as e:
+            return []
+
+    def get_user_display_name(self, user_id):
+        """Получение имени пользователя по ID"""
+        with self._lock:
+            user = self._users.get(user_id)
+            return user['display_name'] if user else None
+
+    def change_display_name(self, user_id, new_display_name):
+        """Изменение имени пользователя"""
+        with self._lock:
+            if user_id not in self._users:
+                return False
+            for other_id, user in self._users.items():
+                if other_id != user_id and user['display_name'] == new_display_name:
+                    return False
+            self._users[user_id]['display_name'] = new_display_name
+
+        self.user_directory.rename(user_id, new_display_name)
+        return True
+
+    # Чаты
+
+    def create_chat(self, chat_type, participants):
+        """Создание нового чата"""
+        with self._lock:
+            return self._insert_chat(chat_type, participants)
+
+    def _insert_chat(self, chat_type, participants):
+        """Добавление чата и его участников под блокировкой хранилища"""
+        chat_id = self._next_chat_id
+        self._next_chat_id += 1
+        self._chats[chat_id] = {'chat_type': chat_type, 'created_at': _now(), 'participants': list(participants)}
+        for user_id in participants:
+            self._user_chats.setdefault(user_id, []).append(chat_id)
+            self._reads.setdefault((chat_id, user_id), [0, 0])
+        return chat_id
+
+    def get_or_create_private_chat(self, user1_id, user2_id):
+        """Получение или создание приватного чата между двумя пользователями"""
+        pair = (min(user1_id, user2_id), max(user1_id, user2_id))
+        with self._lock:
+            chat_id = self._private_pairs.get(pair)
+            if chat_id is None:
+                chat_id = self._insert_chat("private", list(dict.fromkeys((user1_id, user2_id))))
+                self._private_pairs[pair] = chat_id
+            return chat_id
+
+    def _chat_name(self, chat_id, user_id):
+        """Имя чата из имен участников, кроме текущего пользователя"""
+        names = [self._users[member_id]['display_name'] for member_id in self._chats[chat_id]['participants']
+                 if member_id != user_id and member_id in self._users]
+        return ', '.join(names) or f"Чат {chat_id}"
+
+    def get_user_chat_ids(self, user_id):
+        """ID чатов пользователя без сводок - для маршрутизации рассылок"""
+        with self._lock:
+            return list(dict.fromkeys(self._user_chats.get(user_id, ())))
+
+    def get_user_chats(self, user_id):
+        """Получение чатов пользователя"""
+        with self._lock:
+            chat_ids = sorted(set(self._user_chats.get(user_id, ())),
+                              key=lambda chat_id: (self._chats[chat_id]['created_at'], chat_id), reverse=True)
+
+            result = []
+            for chat_id in chat_ids:
+                chat = self._chats[chat_id]
+                messages = self._messages.get(chat_id)
+                last_message = messages[-1][2] if messages else None
+                last_read, unread = self._reads.get((chat_id, user_id), (0, 0))
+
+                result.append({
+                    "chat_id": chat_id,
+                    "chat_type": chat['chat_type'],
+                    "created_at": chat['created_at'],
+                    "message_count": len(messages or ()),
+                    "last_message": last_message[:SUMMARY_PREVIEW_LENGTH] if last_message is not None else None,
+                    "chat_name": self._chat_name(chat_id, user_id),
+                    "unread_count": min(unread, len(messages or ())),
+                    "last_read_message_id": last_read
+                })
+            return result
+
+    def mark_read(self, user_id, chat_id, message_id=None):
+        """Отметка чата прочитанным до message_id (None - до последнего сообщения)"""
+        with self._lock:
+            read = self._reads.get((chat_id, user_id))
+            if read is None:
+                return None
+
+            message_ids = self._message_ids.get(chat_id) or [0]
+            target = message_ids[-1] if message_id is None else min(int(message_id), message_ids[-1])
+            if target > read[0]:
+                # Непрочитанными остаются чужие сообщения после отметки
+                start = bisect.bisect_right(message_ids, target)
+                read[0] = target
+                read[1] = sum(1 for message in self._messages.get(chat_id, ())[start:] if message[1] != user_id)
+            return {"chat_id": chat_id, "last_read_message_id": read[0], "unread_count": read[1]}
+
+    def get_chat_info(self, user_id, chat_id):
+        """Получение информации о чате"""
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if not chat or user_id not in chat['participants']:
+                return None
+
+            return {
+                "chat_id": chat_id,
+                "chat_type": chat['chat_type'],
+                "created_at": chat['created_at'],
+                "chat_name": self._chat_name(chat_id, user_id)
+            }
+
+    def get_all_chats(self):
+        """Получение всех чатов для веб-API"""
+        with self._lock:
+            result = []
+            for chat_id in sorted(self._chats, key=lambda chat_id: (self._chats[chat_id]['created_at'], chat_id),
+                                  reverse=True):
+                chat = self._chats[chat_id]
+                result.append({
+                    'chat_id': chat_id,
+                    'chat_type': chat['chat_type'],
+                    'chat_name': self._chat_name(chat_id, None),
+                    'created_at': chat['created_at'],
+                    'last_message': None
+                })
+            return result
+
+    def clear_user_chat_history(self, user_id):
+        """Очистка истории чатов пользователя"""
+        with self._lock:
+            for chat_id in self._user_chats.get(user_id, ()):
+                self._messages.pop(chat_id, None)
+                self._message_ids.pop(chat_id, None)
+                for member_id in self._chats[chat_id]['participants']:
+                    if (chat_id, member_id) in self._reads:
+                        self._reads[(chat_id, member_id)][1] = 0
+        return True
+
+    # Сообщения
+
+    def save_message_async(self, chat_id, sender_id, content, encrypted_content=None, message_type="normal",
+                           callback=None):
+        """Сохранение сообщения; Future уже завершен и возвращает id сообщения"""
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self._messages.setdefault(chat_id, []).append(
+                (message_id, sender_id, content, encrypted_content, message_type, _now())
+            )
+            self._message_ids.setdefault(chat_id, []).append(message_id)
+
+            chat = self._chats.get(chat_id)
+            for member_id in chat['participants'] if chat else ():
+                read = self._reads.get((chat_id, member_id))
+                if read is None:
+                    continue
+                if member_id == sender_id:
+                    read[0], read[1] = max(read[0], message_id), 0
+                else:
+                    read[1] += 1
+        return _done(message_id, callback)
+
+    def get_chat_messages_page(self, chat_id, limit=DEFAULT_PAGE_SIZE, before_id=None, after_id=None, direction=None):
+        """Страница истории чата по курсору: двоичный поиск границ в списке id чата"""
+        try:
+            limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+            if direction is None:
+                direction = 'forward' if after_id is not None and before_id is None else 'backward'
+            if direction not in ('backward', 'forward'):
+                raise ValueError(f"Неизвестное направление: {direction}")
+
+            with self._lock:
+                ids = self._message_ids.get(chat_id, [])
+                rows = self._messages.get(chat_id, [])
+                start = bisect.bisect_right(ids, int(after_id)) if after_id is not None else 0
+                end = bisect.bisect_left(ids, int(before_id)) if before_id is not None else len(ids)
+
+                # Берем на одно сообщение больше, чтобы узнать, есть ли следующая страница
+                if direction == 'backward':
+                    messages = rows[max(start, end - limit - 1):end][::-1]
+                else:
+                    messages = rows[start:min(end, start + limit + 1)]
+
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            ids = [msg[0] for msg in messages]
+
+            return {
+                "messages": [{"id": msg[0], "sender_id": msg[1], "content": msg[2],
+                              "encrypted_content": msg[3], "message_type": msg[4],
+                              "created_at": msg[5], "sender_name": self.user_directory.display_name(msg[1])}
+                             for msg in messages],
+                "direction": direction,
+                "has_more": has_more,
+                "before_id": min(ids) if ids else before_id,
+                "after_id": max(ids) if ids else after_id
+            }
+        except Exception as e:
+            return {"messages": [], "direction": direction, "has_more": False,
+                    "before_id": before_id, "after_id": after_id}
+
+    def search_messages(self, user_id, query, limit=20, cursor=None):
+        """Поиск подстроки без учета регистра по обычным сообщениям в чатах пользователя, от новых к старым"""
+        try:
+            query = (query or '').strip().casefold()
+            if not query:
+                return {"messages": [], "next_cursor": None}
+
+            limit = max(1, min(int(limit or 20), MAX_PAGE_SIZE))
+            before_id = int(cursor) if cursor else None
+
+            rows = []
+            with self._lock:
+                for chat_id in set(self._user_chats.get(user_id, ())):
+                    ids = self._message_ids.get(chat_id, [])
+                    messages = self._messages.get(chat_id, [])
+                    end = bisect.bisect_left(ids, before_id) if before_id is not None else len(ids)
+
+                    found = 0
+                    for msg in reversed(messages[:end]):
+                        if msg[4] != 'secure' and msg[2] and query in msg[2].casefold():
+                            rows.append((msg[0], chat_id) + msg[1:3] + (msg[5],))
+                            found += 1
+                            if found > limit:
+                                break
+
+            rows.sort(key=lambda row: row[0], reverse=True)
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+
+            return {
+                "messages": [{"id": row[0], "chat_id": row[1], "sender_id": row[2],
+                              "sender_name": self.user_directory.display_name(row[2]),
+                              "content": row[3], "created_at": row[4], "snippet": row[3]} for row in rows],
+                "next_cursor": rows[-1][0] if has_more else None
+            }
+        except Exception as e:
+            return {"messages": [], "next_cursor": None}
+
+    def _delete_secure_messages(self, chat_id):
+        """Удаление защищенных сообщений чата под блокировкой хранилища"""
+        kept = [msg for msg in self._messages.get(chat_id, ()) if msg[4] != 'secure']
+        self._messages[chat_id] = kept
+        self._message_ids[chat_id] = [msg[0] for msg in kept]
+
+    # Защищенные чаты
+
+    def create_secure_chat_session(self, chat_key, encryption_key=None):
+        """Создание защищенной сессии чата"""
+        try:
+            if not encryption_key:
+                encryption_key = self.crypto_manager.generate_key()
+            session_id = str(uuid.uuid4())
+
+            with self._lock:
+                # Ключ чата уникален, как и в таблице secure_chats
+                if chat_key in self._secure_chats:
+                    return None
+                chat_id = self._insert_chat('secure', [])
+                self._secure_chats[chat_key] = (chat_id, encryption_key, session_id)
+
+            return {
+                'chat_id': chat_id,
+                'chat_key': chat_key,
+                'session_id': session_id,
+                'encryption_key': encryption_key
+            }
+        except Exception as e:
+            return None
+
+    def get_secure_chat_session(self, chat_key):
+        """Получение защищенной сессии чата по ключу"""
+        with self._lock:
+            session = self._secure_chats.get(chat_key)
+        if session:
+            return {"chat_id": session[0], "encryption_key": session[1], "session_id": session[2]}
+        return None
+
+    def save_secure_message_async(self, chat_key, sender_id, content, callback=None):
+        """Сохранение защищенного сообщения; Future возвращает id или None, если чат не найден"""
+        with self._lock:
+            session = self._secure_chats.get(chat_key)
+        if not session:
+            return _done(None, callback)
+
+        chat_id, encryption_key = session[:2]
+        try:
+            encrypted_content = self.crypto_manager.encrypt_message(content, encryption_key)
+        except Exception as e:
+            # Если шифрование не удалось, сохраняем как обычное сообщение
+            encrypted_content = None
+
+        return self.save_message_async(chat_id, sender_id, content, encrypted_content, 'secure', callback)
+
+    def get_secure_messages(self, chat_key):
+        """Получение защищенных сообщений"""
+        with self._lock:
+            session = self._secure_chats.get(chat_key)
+            if not session:
+                return []
+            chat_id, encryption_key = session[:2]
+            messages = [msg for msg in self._messages.get(chat_id, ()) if msg[4] == 'secure']
+
+        result_messages = []
+        for msg in messages:
+            content, encrypted_content = msg[2], msg[3]
+
+            # Пытаемся расшифровать, если есть зашифрованное содержимое
+            if encrypted_content:
+                try:
+                    content = self.crypto_manager.decrypt_message(encrypted_content, encryption_key)
+                except Exception as e:
+                    pass
+
+            result_messages.append({
+                "content": content,
+                "sender": self.user_directory.display_name(msg[1]),
+                "created_at": msg[5]
+            })
+        return result_messages
+
+    def clear_secure_chat(self, chat_id):
+        """Очистка защищенного чата"""
+        with self._lock:
+            self._delete_secure_messages(chat_id)
+            for chat_key in [key for key, session in self._secure_chats.items() if session[0] == chat_id]:
+                del self._secure_chats[chat_key]
+        return True
+
+    def close_secure_chat(self, chat_key):
+        """Закрытие защищенного чата"""
+        with self._lock:
+            session = self._secure_chats.pop(chat_key, None)
+            if not session:
+                return False
+            self._delete_secure_messages(session[0])
+        return True
@@ -0,0 +1,286 @@
+import json
+import sqlite3
+import threading
+import zlib
+
+# Уровень сжатия сегментов архива
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+class MessageArchive:
+    """Холодный архив сообщений: отдельная база со сжатыми сегментами, только добавление.
+
+    Сегмент - пачка сообщений одного чата, упорядоченных по id, сжатая zlib целиком.
+    Рядом хранится индекс сообщений (id -> чат, отправитель, сегмент) и полнотекстовый
+    индекс FTS5 без копии текста, поэтому архивные сообщения остаются в поиске.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.fts = False
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        """Создание таблиц сегментов и индексов сообщений"""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS archive_segments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    chat_type TEXT NOT NULL,
+                    first_id INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    last_created_at TIMESTAMP NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    payload BLOB NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_chat_last ON archive_segments (chat_id, last_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_chat_first ON archive_segments (chat_id, first_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_type_created ON archive_segments (chat_type, last_created_at)')
+
+            indexed = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_messages'"
+            ).fetchone()
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS archive_messages (
+                    id INTEGER PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    sender_id INTEGER,
+                    segment_id INTEGER NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_messages_chat ON archive_messages (chat_id, id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_messages_segment ON archive_messages (segment_id)')
+            try:
+                # Текст хранится только в сжатых сегментах, индекс FTS5 - без копии (content='')
+                self.conn.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+                        content,
+                        content='',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )
+                ''')
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                # SQLite собран без FTS5 - архив ищется перебором сегментов
+                print(f"⚠️ FTS5 недоступен, полнотекстовый индекс архива не создан: {e}")
+
+        if not indexed:
+            # Архив создан до появления индексов - строим их по существующим сегментам
+            self.rebuild_index()
+
+    @staticmethod
+    def _pack(messages):
+        """Сжатие списка сообщений сегмента"""
+        return zlib.compress(json.dumps(messages, ensure_ascii=False).encode('utf-8'), ARCHIVE_COMPRESSION_LEVEL)
+
+    @staticmethod
+    def _unpack(payload):
+        """Распаковка сегмента в список сообщений"""
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    def _index_segment(self, segment_id, chat_id, messages):
+        """Добавление сообщений сегмента в индексы; повторный id нарушает PRIMARY KEY и отменяет запись"""
+        self.conn.executemany(
+            "INSERT INTO archive_messages (id, chat_id, sender_id, segment_id) VALUES (?, ?, ?, ?)",
+            [(message[0], chat_id, message[1], segment_id) for message in messages]
+        )
+        if self.fts:
+            self.conn.executemany("INSERT INTO archive_fts (rowid, content) VALUES (?, ?)",
+                                  [(message[0], message[2]) for message in messages])
+
+    def _drop_segments(self, segments):
+        """Удаление сегментов [(id, payload)] вместе с их записями в индексах"""
+        for segment_id, payload in segments:
+            if self.fts:
+                # Из индекса без копии текста строка удаляется по исходному тексту
+                self.conn.executemany(
+                    "INSERT INTO archive_fts (archive_fts, rowid, content) VALUES ('delete', ?, ?)",
+                    [(message[0], message[2]) for message in self._unpack(payload)]
+                )
+            self.conn.execute("DELETE FROM archive_messages WHERE segment_id = ?", (segment_id,))
+            self.conn.execute("DELETE FROM archive_segments WHERE id = ?", (segment_id,))
+
+    def rebuild_index(self):
+        """Полное построение индексов по сегментам (после прямой записи в archive_segments)"""
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM archive_messages")
+            if self.fts:
+                self.conn.execute("INSERT INTO archive_fts (archive_fts) VALUES ('delete-all')")
+            segments = self.conn.execute("SELECT id, chat_id, payload FROM archive_segments ORDER BY id")
+            for segment_id, chat_id, payload in segments:
+                self._index_segment(segment_id, chat_id, self._unpack(payload))
+
+    def append(self, chat_id, chat_type, messages):
+        """Добавление сегмента; messages - строки (id, sender_id, content, encrypted_content,
+        message_type, created_at), упорядоченные по id"""
+        if not messages:
+            return 0
+        messages = [list(message) for message in messages]
+        with self._lock, self.conn:
+            cursor = self.conn.execute('''
+                INSERT INTO archive_segments
+                    (chat_id, chat_type, first_id, last_id, last_created_at, message_count, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (chat_id, chat_type, messages[0][0], messages[-1][0], max(m[5] for m in messages),
+                  len(messages), self._pack(messages)))
+            self._index_segment(cursor.lastrowid, chat_id, messages)
+        return len(messages)
+
+    def max_id(self, chat_id):
+        """Максимальный id сообщения чата в архиве (None - архив чата пуст).
+
+        Не кэшируется: архив может пополнять другой процесс, а запрос идет по индексу (chat_id, last_id).
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT MAX(last_id) FROM archive_segments WHERE chat_id = ?", (chat_id,)
+            ).fetchone()[0]
+
+    def archived_ids(self, chat_id, ids):
+        """Какие из ids уже лежат в архиве (повтор после сбоя между архивом и удалением)"""
+        ids = set(ids)
+        if not ids:
+            return set()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id FROM archive_messages WHERE chat_id = ? AND id BETWEEN ? AND ?",
+                (chat_id, min(ids), max(ids))
+            ).fetchall()
+        return {row[0] for row in rows} & ids
+
+    def count_after(self, chat_id, after_id, exclude_sender_id=None):
+        """Число сообщений чата в архиве с id больше after_id, кроме сообщений exclude_sender_id"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM archive_messages WHERE chat_id = ? AND id > ? AND sender_id IS NOT ?",
+                (chat_id, after_id, exclude_sender_id)
+            ).fetchone()[0]
+
+    def fetch(self, chat_id, limit, before_id=None, after_id=None, descending=True):
+        """Сообщения чата из архива в порядке id; читаются только нужные сегменты"""
+        max_id = self.max_id(chat_id)
+        if max_id is None or (after_id is not None and after_id >= max_id):
+            return []
+
+        conditions = ["chat_id = ?"]
+        params = [chat_id]
+        if before_id is not None:
+            conditions.append("first_id < ?")
+            params.append(before_id)
+        if after_id is not None:
+            conditions.append("last_id > ?")
+            params.append(after_id)
+        order = "last_id DESC" if descending else "first_id ASC"
+
+        result = []
+        with self._lock:
+            segments = self.conn.execute(
+                f"SELECT payload FROM archive_segments WHERE {' AND '.join(conditions)} ORDER BY {order}",
+                params
+            )
+            for (payload,) in segments:
+                for message in self._unpack(payload):
+                    if (before_id is None or message[0] < before_id) and (after_id is None or message[0] > after_id):
+                        result.append(tuple(message))
+                # Сегменты одного чата не пересекаются по id, поэтому хватает первых подходящих
+                if len(result) >= limit:
+                    break
+
+        result.sort(key=lambda message: message[0], reverse=descending)
+        return result[:limit]
+
+    def search(self, chat_ids, query, before_id=None, limit=20, match=None):
+        """Поиск по архиву указанных чатов, от новых к старым.
+
+        match - запрос FTS5; без FTS5 сегменты чатов перебираются с поиском подстроки query.
+        Возвращает строки (id, chat_id, sender_id, content, created_at, snippet) как поиск по messages.
+        """
+        if not chat_ids:
+            return []
+        chats = ','.join('?' * len(chat_ids))
+
+        with self._lock:
+            if self.fts:
+                hits = self.conn.execute(f'''
+                    SELECT a.id, a.segment_id FROM archive_fts
+                    JOIN archive_messages a ON a.id = archive_fts.rowid
+                    WHERE archive_fts MATCH ?
+                    AND a.chat_id IN ({chats})
+                    AND (? IS NULL OR archive_fts.rowid < ?)
+                    ORDER BY archive_fts.rowid DESC
+                    LIMIT ?
+                ''', (match or query, *chat_ids, before_id, before_id, limit)).fetchall()
+                if not hits:
+                    return []
+                segment_ids = sorted({segment_id for _, segment_id in hits})
+                segments = self.conn.execute(
+                    f"SELECT chat_id, payload FROM archive_segments WHERE id IN ({','.join('?' * len(segment_ids))})",
+                    segment_ids
+                ).fetchall()
+                wanted = {message_id for message_id, _ in hits}
+            else:
+                segments = self.conn.execute(f'''
+                    SELECT chat_id, payload FROM archive_segments
+                    WHERE chat_id IN ({chats}) AND (? IS NULL OR first_id < ?)
+                    ORDER BY last_id DESC
+                ''', (*chat_ids, before_id, before_id)).fetchall()
+                wanted = None
+
+        needle = query.casefold()
+        result = []
+        for chat_id, payload in segments:
+            for message in self._unpack(payload):
+                if wanted is not None:
+                    if message[0] not in wanted:
+                        continue
+                elif (before_id is not None and message[0] >= before_id) or needle not in message[2].casefold():
+                    continue
+                # Текста в индексе нет, поэтому фрагментом служит само сообщение
+                result.append((message[0], chat_id, message[1], message[2], message[5], message[2]))
+
+        result.sort(key=lambda row: row[0], reverse=True)
+        return result[:limit]
+
+    def prune(self, chat_type, cutoff, batch_size=100):
+        """Удаление сегментов, все сообщения которых старше cutoff; возвращает {chat_id: число сообщений}"""
+        with self._lock, self.conn:
+            # Блокировка записи до выборки: сегмент удаляет и учитывает только один процесс
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute('''
+                SELECT id, chat_id, message_count, payload FROM archive_segments
+                WHERE chat_type = ? AND last_created_at < ?
+                LIMIT ?
+            ''', (chat_type, cutoff, batch_size)).fetchall()
+            self._drop_segments([(row[0], row[3]) for row in rows])
+
+            removed = {}
+            for _, chat_id, count, _ in rows:
+                removed[chat_id] = removed.get(chat_id, 0) + count
+        return removed
+
+    def delete_chats(self, chat_ids):
+        """Удаление архива указанных чатов"""
+        with self._lock, self.conn:
+            for chat_id in chat_ids:
+                self._drop_segments(self.conn.execute(
+                    "SELECT id, payload FROM archive_segments WHERE chat_id = ?", (chat_id,)
+                ).fetchall())
+
+    def stats(self):
+        """Размер архива"""
+        with self._lock:
+            segments, messages, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(message_count), 0), COALESCE(SUM(length(payload)), 0) FROM archive_segments"
+            ).fetchone()
+        return {'segments': segments, 'messages': messages, 'compressed_bytes': size}
+
+    def close(self):
+        """Закрытие архива"""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from async_server import AsyncSecureMessengerServer, DEFAULT_WORKERS
+from framing import HEADER_SIZE, FrameReader, FrameTooLarge, check_frame_size, encode_frame
+from storage import create_storage
+
+# Пауза перед повторным подключением процесса к шине
+BUS_RETRY_DELAY = 1.0
+# Процесс, упавший быстрее MIN_UPTIME секунд, перезапускается с удвоенной паузой (не больше MAX_RESTART_DELAY)
+MIN_UPTIME = 5.0
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+# Период проверки рабочих процессов супервизором
+MONITOR_INTERVAL = 0.5
+
+def bus_socket_path(port):
+    """Путь к Unix-сокету шины для сервера на порту port"""
+    return os.path.join(tempfile.gettempdir(), f"securemessenger-{port}.sock")
+
+class MessageBus:
+    """Шина супервизора: каждый кадр от рабочего процесса пересылается всем остальным без разбора JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self._sock = None
+        self._lock = threading.Lock()
+        self._peers = {}  # {сокет процесса: блокировка отправки}
+        self._forwarded = 0
+
+    def start(self):
+        """Создание Unix-сокета и поток приема подключений"""
+        if os.path.exists(self.path):
+            # С SO_REUSEPORT второй сервер молча разделил бы порт с первым - запуск отклоняется
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise OSError(f"шина {self.path} уже используется другим сервером")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)  # сокет прошлого запуска
+            finally:
+                probe.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True, name="bus-accept").start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                peer, _ = self._sock.accept()
+            except OSError:
+                return  # шина закрыта
+            with self._lock:
+                self._peers[peer] = threading.Lock()
+            threading.Thread(target=self._peer_loop, args=(peer,), daemon=True, name="bus-peer").start()
+
+    def _peer_loop(self, peer):
+        """Пересылка кадров одного процесса остальным"""
+        frames = FrameReader(peer)
+        try:
+            while True:
+                payload = frames.read_frame()
+                if payload is None:
+                    break
+                self._forward(peer, encode_frame(payload))
+        except (OSError, FrameTooLarge):
+            pass
+        finally:
+            with self._lock:
+                self._peers.pop(peer, None)
+            peer.close()
+
+    def _forward(self, origin, frame):
+        with self._lock:
+            targets = [(peer, lock) for peer, lock in self._peers.items() if peer is not origin]
+        for peer, lock in targets:
+            try:
+                with lock:
+                    peer.sendall(frame)
+            except OSError as e:
+                self.logger.warning(f"Шина: процесс недоступен ({e})")
+        with self._lock:
+            self._forwarded += 1
+
+    def stats(self):
+        """Метрики шины"""
+        with self._lock:
+            return {'workers': len(self._peers), 'forwarded': self._forwarded}
+
+    def close(self):
+        """Закрытие шины и подключений процессов"""
+        if not self._sock:
+            return
+        self._sock.close()
+        with self._lock:
+            peers = list(self._peers)
+        for peer in peers:
+            try:
+                peer.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class WorkerServer(AsyncSecureMessengerServer):
+    """Рабочий процесс: свой сокет на общем порту (SO_REUSEPORT) и подключение к шине.
+
+    Рассылки чатам уходят и своим клиентам, и через шину в остальные процессы; через шину же
+    процессы сообщают друг другу об изменениях, которые кэшируются в памяти хранилища
+    (справочник пользователей, защищенные сессии).
+    """
+
+    def __init__(self, host, port, bus_path, index, workers=DEFAULT_WORKERS):
+        # Очистка, архивация и снимки выполняются один раз в супервизоре, а не в каждом процессе
+        super().__init__(host, port, workers, reuse_port=True, storage=create_storage(maintenance=False))
+        self.bus_path = bus_path
+        self.index = index
+        self.parent_pid = os.getppid()
+        self._bus_writer = None
+
+    async def serve(self):
+        """Прием подключений и работа с шиной до остановки процесса"""
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        bus_task = asyncio.ensure_future(self._bus_loop())
+        try:
+            await super().serve()
+        finally:
+            bus_task.cancel()
+
+    async def _bus_loop(self):
+        """Подключение к шине супервизора с переподключением при обрыве"""
+        while True:
+            if os.getppid() != self.parent_pid:
+                # Супервизор завершился, не остановив процесс - порт освобождается
+                self.logger.warning(f"Процесс {self.index}: супервизор завершился, остановка")
+                self.stop()
+                return
+
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.bus_path)
+            except OSError:
+                await asyncio.sleep(BUS_RETRY_DELAY)
+                continue
+
+            self._bus_writer = writer
+            try:
+                while True:
+                    length_data = await reader.readexactly(HEADER_SIZE)
+                    length = check_frame_size(int.from_bytes(length_data, 'big'))
+                    event = json.loads(await reader.readexactly(length))
+                    try:
+                        self.handle_bus_event(event)
+                    except Exception as e:
+                        self.logger.error(f"Ошибка обработки события шины: {e}")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.logger.warning(f"Процесс {self.index}: соединение с шиной потеряно")
+            except FrameTooLarge as e:
+                # Длина из поврежденного кадра: поток шины рассинхронизирован, подключаемся заново
+                self.logger.warning(f"Процесс {self.index}: соединение с шиной закрыто: {e}")
+            finally:
+                self._bus_writer = None
+                writer.close()
+            await asyncio.sleep(BUS_RETRY_DELAY)
+
+    def publish(self, event):
+        """Отправка события остальным процессам из любого потока"""
+        writer = self._bus_writer
+        if writer is None or self.loop is None:
+            return
+        frame = encode_frame(json.dumps(event, ensure_ascii=False))
+
+        def write():
+            if not writer.is_closing():
+                writer.write(frame)
+
+        try:
+            self.loop.call_soon_threadsafe(write)
+        except RuntimeError:
+            pass  # цикл событий уже остановлен
+
+    def handle_bus_event(self, event):
+        """Применение события другого процесса"""
+        kind = event.get('kind')
+        if kind == 'broadcast':
+            super().broadcast_to_chat(event['chat_id'], event['message'])
+        elif kind == 'chat_route':
+            super().add_chat_route(event['chat_id'], event['user_ids'])
+        elif kind == 'user':
+            self.db.user_directory.add(event['user_id'], event['username'], event['display_name'])
+        elif kind == 'rename':
+            self.db.user_directory.rename(event['user_id'], event['display_name'])
+        elif kind == 'secure_closed':
+            sessions = getattr(self.db, 'secure_sessions', None)
+            if sessions is not None:
+                sessions.invalidate(event['chat_key'])
+
+    def broadcast_to_chat(self, chat_id, message, exclude=None):
+        """Отправка клиентам этого процесса и через шину - клиентам остальных"""
+        super().broadcast_to_chat(chat_id, message, exclude)
+        self.publish({'kind': 'broadcast', 'chat_id': chat_id, 'message': message})
+
+    def add_chat_route(self, chat_id, user_ids):
+        """Маршрут нового чата для сокетов участников в этом и остальных процессах"""
+        super().add_chat_route(chat_id, user_ids)
+        self.publish({'kind': 'chat_route', 'chat_id': chat_id, 'user_ids': list(user_ids)})
+
+    def dispatch_message(self, client_socket, message_data):
+        """Обработка сообщения и рассылка по шине изменений, кэшируемых в каждом процессе"""
+        result = super().dispatch_message(client_socket, message_data)
+        message_type = message_data.get('type')
+
+        if message_type == 'register':
+            user = self.db.find_user_by_display_name(message_data.get('display_name', ''))
+            if user and user['username'] == message_data.get('username'):
+                self.publish({'kind': 'user', **user})
+        elif message_type == 'change_display_name' and client_socket in self.clients:
+            client = self.clients[client_socket]
+            if client['display_name'] == message_data.get('new_display_name'):
+                self.publish({'kind': 'rename', 'user_id': client['user_id'], 'display_name': client['display_name']})
+        elif message_type in ('close_secure_chat', 'auto_close_secure_chat'):
+            self.publish({'kind': 'secure_closed', 'chat_key': message_data.get('chat_key')})
+        return result
+
+def _run_worker(host, port, bus_path, index, workers):
+    """Точка входа рабочего процесса"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # остановкой управляет супервизор
+    server = WorkerServer(host, port, bus_path, index, workers)
+    try:
+        server.start()
+    finally:
+        server.db.close()
+
+class ServerSupervisor:
+    """Супервизор: шина сообщений и N рабочих процессов на одном порту с перезапуском упавших"""
+
+    def __init__(self, host='localhost', port=5000, processes=None, workers=DEFAULT_WORKERS, bus_path=None):
+        self.host = host
+        self.port = port
+        self.processes = processes or os.cpu_count() or 1
+        self.workers = workers
+        self.bus = MessageBus(bus_path or bus_socket_path(port))
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+        self._context = multiprocessing.get_context('spawn')  # без унаследованных блокировок потоков супервизора
+        self._workers = {}  # {номер: [процесс, время запуска, пауза перед перезапуском, время перезапуска]}
+        self._restarts = 0
+        self._stopped = False
+        self.storage = None  # хранилище супервизора: фоновые задачи базы
+
+    def start(self):
+        """Запуск шины и рабочих процессов; наблюдение за ними до остановки"""
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            print("❌ SO_REUSEPORT не поддерживается этой системой, используйте async_server.py")
+            return
+
+        if os.getenv('MESSENGER_STORAGE', 'sqlite') != 'sqlite':
+            print("❌ Процессы не разделяют хранилище в памяти, используйте async_server.py")
+            return
+
+        try:
+            self.bus.start()
+        except OSError as e:
+            print(f"❌ Не удалось запустить шину: {e}")
+            return
+
+        # Миграции выполняются один раз до запуска процессов, а не наперегонки в каждом;
+        # очистка, архивация и снимки работают здесь же, в единственном экземпляре
+        try:
+            self.storage = create_storage()
+        except Exception:
+            self.bus.close()
+            raise
+        self.running = True
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, 'running', False))
+        for index in range(self.processes):
+            self._spawn(index, RESTART_DELAY)
+
+        print(f"🚀 Сервер запущен на {self.host}:{self.port}: процессов {self.processes}, шина {self.bus.path}")
+        try:
+            while self.running:
+                time.sleep(MONITOR_INTERVAL)
+                self._check_workers()
+        finally:
+            self.stop()
+
+    def _spawn(self, index, delay):
+        process = self._context.Process(
+            target=_run_worker, args=(self.host, self.port, self.bus.path, index, self.workers),
+            name=f"messenger-worker-{index}", daemon=True
+        )
+        process.start()
+        self._workers[index] = [process, time.monotonic(), delay, None]
+
+    def _check_workers(self):
+        """Перезапуск завершившихся процессов; часто падающие перезапускаются все реже"""
+        now = time.monotonic()
+        for index, worker in list(self._workers.items()):
+            process, started, delay, restart_at = worker
+            if process.is_alive() or not self.running:
+                continue
+
+            if restart_at is None:
+                if now - started >= MIN_UPTIME:
+                    delay = worker[2] = RESTART_DELAY
+                worker[3] = now + delay
+                self.logger.warning(f"Процесс {index} завершился с кодом {process.exitcode}, перезапуск через {delay} с")
+                print(f"⚠️ Процесс {index} завершился с кодом {process.exitcode}, перезапуск через {delay:.0f} с")
+            elif now >= restart_at:
+                self._restarts += 1
+                self._spawn(index, min(delay * 2, MAX_RESTART_DELAY))
+
+    def stats(self):
+        """Состояние процессов и шины"""
+        return {
+            'processes': {index: worker[0].pid for index, worker in self._workers.items() if worker[0].is_alive()},
+            'restarts': self._restarts,
+            'bus': self.bus.stats()
+        }
+
+    def stop(self):
+        """Остановка рабочих процессов и шины"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self.running = False
+        processes = [worker[0] for worker in self._workers.values()]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()  # SIGTERM: процесс закрывает подключения и хранилище
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+        self.bus.close()
+        if self.storage:
+            self.storage.close()
+        print("Сервер остановлен")
+
+def main():
+    """Точка входа командной строки"""
+    args = sys.argv[1:]
+    if len(args) > 3 or any(not arg.isdigit() for arg in args[1:]):
+        print("Использование: python multiprocess_server.py [хост] [порт] [число процессов]")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    host = args[0] if len(args) > 0 else 'localhost'
+    port = int(args[1]) if len(args) > 1 else 5000
+    processes = int(args[2]) if len(args) > 2 else None
+    supervisor = ServerSupervisor(host, port, processes)
+    try:
+        supervisor.start()
+    except KeyboardInterrupt:
+        print("\nПолучен сигнал остановки...")
+        supervisor.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import socket
+import threading
+from collections import deque
+
+# Политики переполнения исходящей очереди: отбросить самый старый кадр или отключить медленного клиента.
+# Отброшенные сообщения клиент догружает по водяной отметке (get_new_messages).
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+DEFAULT_QUEUE_SIZE = 1024  # кадров на подключение
+DEFAULT_POLICY = DROP_OLDEST
+
+def check_policy(policy):
+    """Проверка названия политики переполнения"""
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError(f"Неизвестная политика переполнения: {policy} (доступны: {', '.join(OVERFLOW_POLICIES)})")
+    return policy
+
+class OutboundQueue:
+    """Ограниченная очередь исходящих кадров подключения: политика переполнения и счетчики.
+
+    Отправку выполняет подкласс: поток-писатель или цикл событий.
+    """
+
+    def __init__(self, max_frames=DEFAULT_QUEUE_SIZE, policy=DEFAULT_POLICY):
+        self.max_frames = max(1, max_frames)
+        self.policy = check_policy(policy)
+        self._frames = deque()
+        self.closed = False
+        self.overflowed = False
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def _offer(self, frame):
+        """Постановка кадра по политике переполнения; False - подключение нужно закрыть"""
+        if len(self._frames) >= self.max_frames:
+            if self.policy == DISCONNECT:
+                self.overflowed = True
+                return False
+            self._frames.popleft()
+            self.dropped += 1
+        self._frames.append(frame)
+        self.max_depth = max(self.max_depth, len(self._frames))
+        return True
+
+    def stats(self):
+        """Метрики очереди"""
+        return {
+            'depth': len(self._frames),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'overflowed': self.overflowed
+        }
+
+class ThreadedOutboundQueue(OutboundQueue):
+    """Очередь с отдельным потоком-писателем: медленный клиент задерживает только свой поток"""
+
+    def __init__(self, sock, max_frames=DEFAULT_QUEUE_SIZE, policy=DEFAULT_POLICY, name=None):
+        super().__init__(max_frames, policy)
+        self.sock = sock
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"writer-{name or id(sock)}")
+        self._thread.start()
+
+    def put(self, frame):
+        """Постановка кадра из любого потока без ожидания сети; False - очередь закрыта или клиент отключен"""
+        with self._cond:
+            if self.closed:
+                return False
+            accepted = self._offer(frame)
+            if not accepted:
+                self.closed = True
+                self._frames.clear()
+            self._cond.notify()
+
+        if not accepted:
+            self._shutdown()
+        return accepted
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._frames and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                frame = self._frames.popleft()
+
+            try:
+                self.sock.sendall(frame)  # полная запись кадра, в отличие от send
+            except OSError:
+                self.close()
+                self._shutdown()
+                return
+            with self._cond:
+                self.sent += 1
+
+    def _shutdown(self):
+        """Разрыв подключения: поток чтения клиента получает EOF и завершает обработку"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stats(self):
+        """Метрики очереди"""
+        with self._cond:
+            return super().stats()
+
+    def close(self):
+        """Остановка писателя; неотправленные кадры отбрасываются"""
+        with self._cond:
+            self.closed = True
+            self._frames.clear()
+            self._cond.notify()
+
+class OutboundMetrics:
+    """Сводные метрики исходящих очередей сервера, включая уже закрытые подключения"""
+
+    def __init__(self, max_frames, policy):
+        self.max_frames = max_frames
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._dropped = 0
+        self._slow_disconnects = 0
+        self._max_depth = 0
+
+    def retire(self, queue):
+        """Учет счетчиков закрытой очереди"""
+        stats = queue.stats()
+        with self._lock:
+            self._sent += stats['sent']
+            self._dropped += stats['dropped']
+            self._slow_disconnects += stats['overflowed']
+            self._max_depth = max(self._max_depth, stats['max_depth'])
+
+    def collect(self, queues):
+        """Метрики по открытым очередям и итоги по закрытым"""
+        live = [queue.stats() for queue in queues]
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'queue_size': self.max_frames,
+                'connections': len(live),
+                'queued_frames': sum(stats['depth'] for stats in live),
+                'deepest_queue': max((stats['depth'] for stats in live), default=0),
+                'max_queue_depth': max([self._max_depth] + [stats['max_depth'] for stats in live]),
+                'sent_frames': self._sent + sum(stats['sent'] for stats in live),
+                'dropped_frames': self._dropped + sum(stats['dropped'] for stats in live),
+                'slow_disconnects': self._slow_disconnects + sum(stats['overflowed'] for stats in live)
+            }
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from cryptography.fernet import Fernet
+
+class SecureSession:
+    """Сессия защищенного чата с готовым шифратором"""
+
+    __slots__ = ('chat_key', 'chat_id', 'encryption_key', 'session_id', 'fernet', 'expires_at')
+
+    def __init__(self, chat_key, chat_id, encryption_key, session_id, expires_at):
+        self.chat_key = chat_key
+        self.chat_id = chat_id
+        self.encryption_key = encryption_key
+        self.session_id = session_id
+        self.fernet = Fernet(encryption_key.encode() if isinstance(encryption_key, str) else encryption_key)
+        self.expires_at = expires_at
+
+    def encrypt(self, message):
+        """Шифрование сообщения ключом сессии"""
+        return self.fernet.encrypt(message.encode()).decode()
+
+    def decrypt(self, encrypted_message):
+        """Расшифровка сообщения ключом сессии"""
+        if isinstance(encrypted_message, str):
+            encrypted_message = encrypted_message.encode()
+        return self.fernet.decrypt(encrypted_message).decode()
+
+class SecureSessionRegistry:
+    """Реестр защищенных сессий в памяти по chat_key: TTL, LRU-вытеснение и явная инвалидация"""
+
+    def __init__(self, ttl=600.0, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # {chat_key: SecureSession}, последние использованные в конце
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_key):
+        """Сессия по ключу чата (None - нет в реестре или истек TTL)"""
+        with self._lock:
+            session = self._sessions.get(chat_key)
+            if session is not None and session.expires_at < time.monotonic():
+                del self._sessions[chat_key]
+                session = None
+            if session is None:
+                self._misses += 1
+                return None
+            self._sessions.move_to_end(chat_key)
+            self._hits += 1
+            return session
+
+    def put(self, chat_key, chat_id, encryption_key, session_id):
+        """Добавление сессии; самые давно использованные вытесняются сверх max_sessions"""
+        session = SecureSession(chat_key, chat_id, encryption_key, session_id, time.monotonic() + self.ttl)
+        with self._lock:
+            self._sessions[chat_key] = session
+            self._sessions.move_to_end(chat_key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._evictions += 1
+        return session
+
+    def invalidate(self, chat_key):
+        """Удаление сессии по ключу чата"""
+        with self._lock:
+            self._sessions.pop(chat_key, None)
+
+    def invalidate_chat(self, chat_id):
+        """Удаление всех сессий чата"""
+        with self._lock:
+            for chat_key in [key for key, session in self._sessions.items() if session.chat_id == chat_id]:
+                del self._sessions[chat_key]
+
+    def stats(self):
+        """Метрики реестра"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'ttl': self.ttl
+            }
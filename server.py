@@ -2,18 +2,38 @@ import socket
 import threading
 import json
 import logging
+import os
 import uuid
 from datetime import datetime
-from database import DatabaseManager
+from framing import FrameReader, FrameTooLarge, encode_frame
+from outbound import DEFAULT_POLICY, DEFAULT_QUEUE_SIZE, OutboundMetrics, ThreadedOutboundQueue, check_policy
+from storage import create_storage
 
 class SecureMessengerServer:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, outbound_queue_size=None, overflow_policy=None, storage=None):
         self.host = host
         self.port = port
-        self.clients = {}  # {client_socket: {'user_id': int, 'username': str, 'address': tuple}}
+        self.clients = {}  # {client_socket: {'user_id': int, 'username': str, 'display_name': str, 'chat_ids': set}}
+        
+        # Маршруты рассылки: какие сокеты подключены у пользователя и у участников каждого чата
+        self.user_sockets = {}  # {user_id: set(client_socket)}
+        self.chat_routes = {}  # {chat_id: set(client_socket)}
+        self.routes_lock = threading.Lock()
+        
+        # Исходящие очереди подключений: рассылка не ждет сеть медленного клиента
+        if outbound_queue_size is None:
+            outbound_queue_size = int(os.getenv('MESSENGER_OUTBOUND_QUEUE', DEFAULT_QUEUE_SIZE))
+        self.outbound_queue_size = outbound_queue_size
+        self.overflow_policy = check_policy(overflow_policy or os.getenv('MESSENGER_OVERFLOW_POLICY', DEFAULT_POLICY))
+        self.outbound = {}  # {client_socket: очередь исходящих кадров}
+        self.outbound_metrics = OutboundMetrics(self.outbound_queue_size, self.overflow_policy)
+        
         self.server_socket = None
         self.running = False
-        self.db = DatabaseManager()
+        self.db = storage or create_storage()
+        
+        # Сессии веб-API: {session_id: данные пользователя, выполнившего api_login}
+        self.api_sessions = {}
         
         # Настройка логирования
         logging.basicConfig(
@@ -64,45 +84,19 @@ class SecureMessengerServer:
     
     def handle_client(self, client_socket, address):
         """Обработка клиентского подключения"""
+        self.outbound[client_socket] = ThreadedOutboundQueue(
+            client_socket, self.outbound_queue_size, self.overflow_policy, name=f"{address[0]}:{address[1]}"
+        )
+        frames = FrameReader(client_socket)
         try:
             while self.running:
                 try:
-                    message = self.receive_message(client_socket)
+                    message = self.receive_message(frames)
                     if not message:
                         break
                         
                     message_data = json.loads(message)
-                    message_type = message_data.get('type', 'unknown')
-                    
-                    if message_type == 'auth':
-                        self.handle_auth(client_socket, message_data)
-                    elif message_type == 'register':
-                        self.handle_register(client_socket, message_data)
-                    elif message_type == 'find_user':
-                        self.handle_find_user(client_socket, message_data)
-                    elif message_type == 'create_chat':
-                        self.handle_create_chat(client_socket, message_data)
-                    elif message_type == 'get_chats':
-                        self.handle_get_chats(client_socket, message_data)
-                    elif message_type == 'get_messages':
-                        self.handle_get_messages(client_socket, message_data)
-                    elif message_type == 'send_message':
-                        self.handle_send_message(client_socket, message_data)
-                    elif message_type == 'create_secure_chat':
-                        self.handle_create_secure_chat(client_socket, message_data)
-                    elif message_type == 'join_secure_chat':
-                        self.handle_join_secure_chat(client_socket, message_data)
-                    elif message_type == 'clear_chat_history':
-                        self.handle_clear_chat_history(client_socket, message_data)
-                    elif message_type == 'close_secure_chat':
-                        self.handle_close_secure_chat(client_socket, message_data)
-                    elif message_type == 'auto_close_secure_chat':
-                        self.handle_auto_close_secure_chat(client_socket, message_data)
-                    elif message_type == 'get_chat_info':
-                        self.handle_get_chat_info(client_socket, message_data)
-                    elif message_type == 'change_display_name':
-                        self.handle_change_display_name(client_socket, message_data)
-                    elif message_type == 'disconnect':
+                    if not self.dispatch_message(client_socket, message_data):
                         break
                         
                 except json.JSONDecodeError:
@@ -115,6 +109,51 @@ class SecureMessengerServer:
             self.logger.error(f"Ошибка обработки клиента {address}: {e}")
         finally:
             self.remove_client(client_socket)
+            self.close_outbound(client_socket)
+    
+    def dispatch_message(self, client_socket, message_data):
+        """Вызов обработчика по типу сообщения; False - клиент попросил отключиться"""
+        message_type = message_data.get('type', 'unknown')
+        
+        if message_type == 'auth':
+            self.handle_auth(client_socket, message_data)
+        elif message_type == 'register':
+            self.handle_register(client_socket, message_data)
+        elif message_type == 'find_user':
+            self.handle_find_user(client_socket, message_data)
+        elif message_type == 'search_users':
+            self.handle_search_users(client_socket, message_data)
+        elif message_type == 'create_chat':
+            self.handle_create_chat(client_socket, message_data)
+        elif message_type == 'get_chats':
+            self.handle_get_chats(client_socket, message_data)
+        elif message_type == 'get_messages':
+            self.handle_get_messages(client_socket, message_data)
+        elif message_type == 'get_new_messages':
+            self.handle_get_new_messages(client_socket, message_data)
+        elif message_type == 'send_message':
+            self.handle_send_message(client_socket, message_data)
+        elif message_type == 'create_secure_chat':
+            self.handle_create_secure_chat(client_socket, message_data)
+        elif message_type == 'join_secure_chat':
+            self.handle_join_secure_chat(client_socket, message_data)
+        elif message_type == 'clear_chat_history':
+            self.handle_clear_chat_history(client_socket, message_data)
+        elif message_type == 'close_secure_chat':
+            self.handle_close_secure_chat(client_socket, message_data)
+        elif message_type == 'auto_close_secure_chat':
+            self.handle_auto_close_secure_chat(client_socket, message_data)
+        elif message_type == 'get_chat_info':
+            self.handle_get_chat_info(client_socket, message_data)
+        elif message_type == 'change_display_name':
+            self.handle_change_display_name(client_socket, message_data)
+        elif message_type == 'search_messages':
+            self.handle_search_messages(client_socket, message_data)
+        elif message_type == 'mark_read':
+            self.handle_mark_read(client_socket, message_data)
+        elif message_type == 'disconnect':
+            return False
+        return True
     
     def handle_auth(self, client_socket, message_data):
         """Обработка аутентификации"""
@@ -125,11 +164,14 @@ class SecureMessengerServer:
         
         if success:
             user_data = result
+            self.remove_client_routes(client_socket)  # повторный вход на том же подключении
             self.clients[client_socket] = {
                 'user_id': user_data['user_id'],
                 'username': user_data['username'],
-                'display_name': user_data['display_name']
+                'display_name': user_data['display_name'],
+                'chat_ids': set()
             }
+            self.add_client_routes(client_socket, user_data['user_id'])
             
             response = {
                 'type': 'auth_response',
@@ -181,6 +223,18 @@ class SecureMessengerServer:
         
         self.send_message(client_socket, json.dumps(response))
     
+    def handle_search_users(self, client_socket, message_data):
+        """Обработка поиска пользователей по началу имени"""
+        users = self.db.search_users(message_data.get('prefix', ''), message_data.get('limit', 10))
+        
+        response = {
+            'type': 'search_users_response',
+            'success': True,
+            'users': users
+        }
+        
+        self.send_message(client_socket, json.dumps(response))
+    
     def handle_clear_chat_history(self, client_socket, message_data):
         """Обработка очистки истории чатов"""
         if client_socket not in self.clients:
@@ -205,6 +259,8 @@ class SecureMessengerServer:
         user2_id = message_data.get('user_id')
         
         chat_id = self.db.get_or_create_private_chat(user1_id, user2_id)
+        if chat_id is not None:
+            self.add_chat_route(chat_id, [user1_id, user2_id])
         
         response = {
             'type': 'create_chat_response',
@@ -230,16 +286,40 @@ class SecureMessengerServer:
         self.send_message(client_socket, json.dumps(response))
     
     def handle_get_messages(self, client_socket, message_data):
-        """Обработка получения сообщений"""
+        """Обработка получения сообщений (страница истории по курсору before_id/after_id)"""
         chat_id = message_data.get('chat_id')
-        limit = message_data.get('limit', 50)
         
-        messages = self.db.get_chat_messages(chat_id, limit)
+        page = self.db.get_chat_messages_page(
+            chat_id,
+            message_data.get('limit', 50),
+            before_id=message_data.get('before_id'),
+            after_id=message_data.get('after_id'),
+            direction=message_data.get('direction')
+        )
         
         response = {
             'type': 'get_messages_response',
             'chat_id': chat_id,
-            'messages': messages
+            'messages': page['messages'],
+            'direction': page['direction'],
+            'has_more': page['has_more'],
+            'before_id': page['before_id'],
+            'after_id': page['after_id']
+        }
+        
+        self.send_message(client_socket, json.dumps(response))
+    
+    def handle_get_new_messages(self, client_socket, message_data):
+        """Обработка получения только новых сообщений после водяной отметки after_id"""
+        chat_id = message_data.get('chat_id')
+        delta = self.db.get_messages_since(chat_id, message_data.get('after_id', 0))
+        
+        response = {
+            'type': 'get_new_messages_response',
+            'chat_id': chat_id,
+            'messages': delta['messages'],
+            'last_message_id': delta['last_message_id'],
+            'has_more': delta['has_more']
         }
         
         self.send_message(client_socket, json.dumps(response))
@@ -259,16 +339,21 @@ class SecureMessengerServer:
         
         if success:
             # Отправляем сообщение всем участникам чата
-            self.broadcast_to_chat(chat_id, {
-                'type': 'new_message',
-                'chat_id': chat_id,
-                'sender_id': sender_id,
-                'sender_name': self.clients[client_socket]['display_name'],
-                'content': content,
-                'encrypted_content': encrypted_content,
-                'message_type': message_type,
-                'timestamp': datetime.now().isoformat()
-            }, exclude=client_socket)
+            self.broadcast_to_chat(chat_id, self.new_message_event(client_socket, message_data), exclude=client_socket)
+    
+    def new_message_event(self, client_socket, message_data):
+        """Уведомление участников чата о сохраненном сообщении клиента"""
+        client = self.clients[client_socket]
+        return {
+            'type': 'new_message',
+            'chat_id': message_data.get('chat_id'),
+            'sender_id': client['user_id'],
+            'sender_name': client['display_name'],
+            'content': message_data.get('content', ''),
+            'encrypted_content': message_data.get('encrypted_content'),
+            'message_type': message_data.get('message_type', 'normal'),
+            'timestamp': datetime.now().isoformat()
+        }
     
     def handle_create_secure_chat(self, client_socket, message_data):
         """Обработка создания защищенного чата"""
@@ -433,8 +518,58 @@ class SecureMessengerServer:
         
         self.send_message(client_socket, json.dumps(response))
     
+    def handle_search_messages(self, client_socket, message_data):
+        """Обработка полнотекстового поиска по сообщениям пользователя"""
+        if client_socket not in self.clients:
+            return
+        
+        user_id = self.clients[client_socket]['user_id']
+        result = self.db.search_messages(
+            user_id,
+            message_data.get('query', ''),
+            message_data.get('limit', 20),
+            message_data.get('cursor')
+        )
+        
+        response = {
+            'type': 'search_messages_response',
+            'success': True,
+            'messages': result['messages'],
+            'next_cursor': result['next_cursor']
+        }
+        
+        self.send_message(client_socket, json.dumps(response))
+    
+    def handle_mark_read(self, client_socket, message_data):
+        """Обработка отметки прочтения чата"""
+        if client_socket not in self.clients:
+            return
+        
+        user_id = self.clients[client_socket]['user_id']
+        chat_id = message_data.get('chat_id')
+        read = self.db.mark_read(user_id, chat_id, message_data.get('message_id'))
+        
+        response = {
+            'type': 'mark_read_response',
+            'success': read is not None,
+            'chat_id': chat_id,
+            'last_read_message_id': read['last_read_message_id'] if read else None,
+            'unread_count': read['unread_count'] if read else None
+        }
+        
+        self.send_message(client_socket, json.dumps(response))
+        
+        if read:
+            # Уведомление о прочтении для остальных участников чата
+            self.broadcast_to_chat(chat_id, {
+                'type': 'read_receipt',
+                'chat_id': chat_id,
+                'user_id': user_id,
+                'last_read_message_id': read['last_read_message_id']
+            }, exclude=client_socket)
+    
     # Веб-API методы для работы с HTTP запросами
-    def handle_login(self, request_data):
+    def api_login(self, request_data):
         """Обработка входа через веб-API"""
         username = request_data.get('username', '')
         password = request_data.get('password', '')
@@ -443,10 +578,12 @@ class SecureMessengerServer:
         
         if success:
             user_data = result
+            session_id = str(uuid.uuid4())  # Генерируем сессию для веб-API
+            self.api_sessions[session_id] = user_data
             response = {
                 'success': True,
                 'user_data': user_data,
-                'session_id': str(uuid.uuid4())  # Генерируем сессию для веб-API
+                'session_id': session_id
             }
         else:
             response = {
@@ -456,7 +593,7 @@ class SecureMessengerServer:
         
         return response
     
-    def handle_register(self, request_data):
+    def api_register(self, request_data):
         """Обработка регистрации через веб-API"""
         username = request_data.get('username', '')
         display_name = request_data.get('display_name', '')
@@ -477,7 +614,7 @@ class SecureMessengerServer:
         
         return response
     
-    def handle_get_chats(self, request_data):
+    def api_get_chats(self, request_data):
         """Обработка получения чатов через веб-API"""
         session_id = request_data.get('session_id')
         if not session_id:
@@ -492,20 +629,46 @@ class SecureMessengerServer:
             'chats': chats
         }
     
-    def handle_get_messages(self, request_data):
+    def api_get_messages(self, request_data):
         """Обработка получения сообщений через веб-API"""
         chat_id = request_data.get('chat_id')
-        limit = request_data.get('limit', 50)
         
-        messages = self.db.get_chat_messages(chat_id, limit)
+        page = self.db.get_chat_messages_page(
+            chat_id,
+            request_data.get('limit', 50),
+            before_id=request_data.get('before_id'),
+            after_id=request_data.get('after_id'),
+            direction=request_data.get('direction')
+        )
         
         return {
             'success': True,
             'chat_id': chat_id,
-            'messages': messages
+            'messages': page['messages'],
+            'direction': page['direction'],
+            'has_more': page['has_more'],
+            'before_id': page['before_id'],
+            'after_id': page['after_id']
         }
     
-    def handle_send_message(self, request_data):
+    def api_get_new_messages(self, request_data):
+        """Обработка получения новых сообщений после водяной отметки через веб-API"""
+        chat_id = request_data.get('chat_id')
+        
+        if not chat_id:
+            return {'success': False, 'error': 'Chat ID required'}
+        
+        delta = self.db.get_messages_since(chat_id, request_data.get('after_id', 0))
+        
+        return {
+            'success': True,
+            'chat_id': chat_id,
+            'messages': delta['messages'],
+            'last_message_id': delta['last_message_id'],
+            'has_more': delta['has_more']
+        }
+    
+    def api_send_message(self, request_data):
         """Обработка отправки сообщения через веб-API"""
         session_id = request_data.get('session_id')
         chat_id = request_data.get('chat_id')
@@ -526,7 +689,7 @@ class SecureMessengerServer:
             'message': 'Message sent' if success else 'Failed to send message'
         }
     
-    def handle_create_chat(self, request_data):
+    def api_create_chat(self, request_data):
         """Обработка создания чата через веб-API"""
         session_id = request_data.get('session_id')
         user_id = request_data.get('user_id')
@@ -543,7 +706,7 @@ class SecureMessengerServer:
             'chat_id': chat_id
         }
     
-    def handle_find_user(self, request_data):
+    def api_find_user(self, request_data):
         """Обработка поиска пользователя через веб-API"""
         display_name = request_data.get('display_name', '')
         user_data = self.db.find_user_by_display_name(display_name)
@@ -553,7 +716,16 @@ class SecureMessengerServer:
             'user_data': user_data
         }
     
-    def handle_create_secure_chat(self, request_data):
+    def api_search_users(self, request_data):
+        """Обработка поиска пользователей по началу имени через веб-API"""
+        users = self.db.search_users(request_data.get('prefix', ''), request_data.get('limit', 10))
+        
+        return {
+            'success': True,
+            'users': users
+        }
+    
+    def api_create_secure_chat(self, request_data):
         """Обработка создания защищенного чата через веб-API"""
         session_id = request_data.get('session_id')
         chat_key = request_data.get('chat_key')
@@ -576,7 +748,7 @@ class SecureMessengerServer:
                 'error': 'Не удалось создать защищенный чат'
             }
     
-    def handle_join_secure_chat(self, request_data):
+    def api_join_secure_chat(self, request_data):
         """Обработка подключения к защищенному чату через веб-API"""
         session_id = request_data.get('session_id')
         chat_key = request_data.get('chat_key')
@@ -609,7 +781,7 @@ class SecureMessengerServer:
                 'error': 'Защищенный чат не найден'
             }
     
-    def handle_send_secure_message(self, request_data):
+    def api_send_secure_message(self, request_data):
         """Обработка отправки защищенного сообщения через веб-API"""
         session_id = request_data.get('session_id')
         chat_key = request_data.get('chat_key')
@@ -628,7 +800,7 @@ class SecureMessengerServer:
             'message': 'Secure message sent' if success else 'Failed to send secure message'
         }
     
-    def handle_get_secure_messages(self, request_data):
+    def api_get_secure_messages(self, request_data):
         """Обработка получения защищенных сообщений через веб-API"""
         chat_key = request_data.get('chat_key')
         
@@ -642,7 +814,7 @@ class SecureMessengerServer:
             'messages': messages
         }
     
-    def handle_clear_chat_history(self, request_data):
+    def api_clear_chat_history(self, request_data):
         """Обработка очистки истории чатов через веб-API"""
         session_id = request_data.get('session_id')
         
@@ -658,7 +830,7 @@ class SecureMessengerServer:
             'message': 'Chat history cleared' if success else 'Failed to clear chat history'
         }
     
-    def handle_close_secure_chat(self, request_data):
+    def api_close_secure_chat(self, request_data):
         """Обработка закрытия защищенного чата через веб-API"""
         session_id = request_data.get('session_id')
         chat_key = request_data.get('chat_key')
@@ -673,7 +845,7 @@ class SecureMessengerServer:
             'message': 'Secure chat closed' if success else 'Failed to close secure chat'
         }
     
-    def handle_auto_close_secure_chat(self, request_data):
+    def api_auto_close_secure_chat(self, request_data):
         """Обработка автоматического закрытия защищенного чата через веб-API"""
         chat_key = request_data.get('chat_key')
         
@@ -687,7 +859,7 @@ class SecureMessengerServer:
             'message': 'Secure chat auto-closed' if success else 'Failed to auto-close secure chat'
         }
     
-    def handle_get_chat_info(self, request_data):
+    def api_get_chat_info(self, request_data):
         """Обработка получения информации о чате через веб-API"""
         session_id = request_data.get('session_id')
         chat_id = request_data.get('chat_id')
@@ -704,7 +876,7 @@ class SecureMessengerServer:
             'chat_info': chat_info
         }
     
-    def handle_change_display_name(self, request_data):
+    def api_change_display_name(self, request_data):
         """Обработка изменения имени пользователя через веб-API"""
         session_id = request_data.get('session_id')
         new_display_name = request_data.get('new_display_name')
@@ -721,38 +893,93 @@ class SecureMessengerServer:
             'message': 'Display name changed' if success else 'Failed to change display name'
         }
     
-    def broadcast_to_chat(self, chat_id, message, exclude=None):
-        """Отправка сообщения всем участникам чата"""
-        # Получаем участников чата из базы данных
-        # Это упрощенная версия - в реальном приложении нужно кэшировать участников
-        for client_socket in self.clients:
-            if client_socket != exclude:
-                try:
-                    self.send_message(client_socket, json.dumps(message))
-                except Exception as e:
-                    self.logger.error(f"Ошибка отправки сообщения клиенту: {e}")
-                    self.remove_client(client_socket)
+    def api_search_messages(self, request_data):
+        """Обработка полнотекстового поиска по сообщениям через веб-API"""
+        session_id = request_data.get('session_id')
+        query = request_data.get('query', '')
+        
+        if not session_id or not query:
+            return {'success': False, 'error': 'Session ID and query required'}
+        
+        # Поиск идет только по чатам пользователя, вошедшего в этой сессии
+        user_data = self.api_sessions.get(session_id)
+        if user_data is None:
+            return {'success': False, 'error': 'Invalid session'}
+        
+        user_id = user_data['user_id']
+        result = self.db.search_messages(user_id, query, request_data.get('limit', 20), request_data.get('cursor'))
+        
+        return {
+            'success': True,
+            'messages': result['messages'],
+            'next_cursor': result['next_cursor']
+        }
     
-    def receive_message(self, client_socket):
-        """Получение сообщения от клиента"""
-        try:
-            # Получаем длину сообщения (4 байта)
-            length_data = client_socket.recv(4)
-            if not length_data:
-                return None
-                
-            message_length = int.from_bytes(length_data, 'big')
+    def add_client_routes(self, client_socket, user_id):
+        """Подключение сокета вошедшего пользователя к рассылкам всех его чатов"""
+        chat_ids = self.db.get_user_chat_ids(user_id)
+        
+        with self.routes_lock:
+            client = self.clients.get(client_socket)
+            if client is None:
+                return
+            self.user_sockets.setdefault(user_id, set()).add(client_socket)
+            for chat_id in chat_ids:
+                self.chat_routes.setdefault(chat_id, set()).add(client_socket)
+            client['chat_ids'].update(chat_ids)
+    
+    def add_chat_route(self, chat_id, user_ids):
+        """Подключение к рассылкам нового чата всех подключенных сокетов его участников"""
+        with self.routes_lock:
+            for user_id in user_ids:
+                for client_socket in self.user_sockets.get(user_id, ()):
+                    self.chat_routes.setdefault(chat_id, set()).add(client_socket)
+                    self.clients[client_socket]['chat_ids'].add(chat_id)
+    
+    def remove_client_routes(self, client_socket):
+        """Удаление сокета из маршрутов рассылки"""
+        with self.routes_lock:
+            client = self.clients.get(client_socket)
+            if client is None:
+                return
             
-            # Получаем само сообщение
-            message_data = b''
-            while len(message_data) < message_length:
-                chunk = client_socket.recv(min(message_length - len(message_data), 1024))
-                if not chunk:
-                    return None
-                message_data += chunk
-                
-            return message_data.decode('utf-8')
+            sockets = self.user_sockets.get(client['user_id'])
+            if sockets is not None:
+                sockets.discard(client_socket)
+                if not sockets:
+                    del self.user_sockets[client['user_id']]
             
+            for chat_id in client['chat_ids']:
+                sockets = self.chat_routes.get(chat_id)
+                if sockets is not None:
+                    sockets.discard(client_socket)
+                    if not sockets:
+                        del self.chat_routes[chat_id]
+            client['chat_ids'].clear()
+    
+    def broadcast_to_chat(self, chat_id, message, exclude=None):
+        """Отправка сообщения подключенным участникам чата; JSON кодируется один раз на рассылку"""
+        with self.routes_lock:
+            targets = [client_socket for client_socket in self.chat_routes.get(chat_id, ())
+                       if client_socket != exclude]
+        if not targets:
+            return
+        
+        frame = encode_frame(json.dumps(message))
+        for client_socket in targets:
+            try:
+                self.send_frame(client_socket, frame)
+            except Exception as e:
+                self.logger.error(f"Ошибка отправки сообщения клиенту: {e}")
+                self.remove_client(client_socket)
+    
+    def receive_message(self, frames):
+        """Получение сообщения от клиента через читатель кадров подключения"""
+        try:
+            return frames.read_message()
+        except FrameTooLarge as e:
+            self.logger.warning(f"Подключение закрыто: {e}")
+            return None
         except Exception as e:
             self.logger.error(f"Ошибка получения сообщения: {e}")
             return None
@@ -760,17 +987,38 @@ class SecureMessengerServer:
     def send_message(self, client_socket, message):
         """Отправка сообщения клиенту"""
         try:
-            message_bytes = message.encode('utf-8')
-            message_length = len(message_bytes).to_bytes(4, 'big')
-            client_socket.send(message_length + message_bytes)
+            self.send_frame(client_socket, encode_frame(message))
         except Exception as e:
             self.logger.error(f"Ошибка отправки сообщения: {e}")
     
+    def send_frame(self, client_socket, frame):
+        """Постановка готового кадра в исходящую очередь клиента"""
+        outbound = self.outbound.get(client_socket)
+        if outbound is None:
+            client_socket.sendall(frame)  # подключение без очереди
+        elif not outbound.put(frame):
+            raise ConnectionError("исходящая очередь клиента закрыта")
+    
+    def close_outbound(self, client_socket):
+        """Остановка исходящей очереди подключения с учетом ее счетчиков в метриках"""
+        outbound = self.outbound.pop(client_socket, None)
+        if outbound is not None:
+            outbound.close()
+            self.outbound_metrics.retire(outbound)
+            if outbound.overflowed:
+                self.logger.warning("Медленный клиент отключен: исходящая очередь переполнена")
+    
+    def get_outbound_stats(self):
+        """Метрики исходящих очередей: глубина, отправленные, отброшенные кадры, отключения медленных клиентов"""
+        return self.outbound_metrics.collect(list(self.outbound.values()))
+    
     def remove_client(self, client_socket):
         """Удаление клиента из списка"""
         if client_socket in self.clients:
             username = self.clients[client_socket]['display_name']
+            self.remove_client_routes(client_socket)
             del self.clients[client_socket]
+            self.close_outbound(client_socket)
             client_socket.close()
             
             self.logger.info(f"Пользователь {username} отключился")
@@ -786,6 +1034,11 @@ class SecureMessengerServer:
             except:
                 pass
         self.clients.clear()
+        for client_socket in list(self.outbound):
+            self.close_outbound(client_socket)
+        with self.routes_lock:
+            self.user_sockets.clear()
+            self.chat_routes.clear()
         
         # Закрываем серверный сокет
         if self.server_socket:
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Перераскладка сообщений SecureMessenger: одна база <-> N шардов, N шардов -> M шардов.
+
+Запускать при остановленном сервере:
+    python shard_tool.py messenger.db 4     # разложить сообщения на 4 шарда
+    python shard_tool.py messenger.db 1     # собрать шарды обратно в одну базу
+
+Сообщения сначала копируются во временную базу <имя>_reshard.db, затем старая раскладка
+очищается и сообщения загружаются в новую. Прерванный запуск продолжается с того же этапа.
+"""
+
+import os
+import sqlite3
+import sys
+
+from database import DatabaseManager, archive_file_path, shard_file_path
+
+BATCH_SIZE = 5000
+
+MESSAGE_COLUMNS = "id, chat_id, sender_id, content, encrypted_content, message_type, created_at"
+SEGMENT_COLUMNS = "chat_id, chat_type, first_id, last_id, last_created_at, message_count, payload"
+
+def staging_path(db_path):
+    """Путь к временной базе перераскладки"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_reshard{ext or '.db'}"
+
+def current_shard_count(db_path):
+    """Текущее число шардов по служебной таблице основной базы"""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM shard_meta WHERE key = 'shard_count'").fetchone()
+        return row[0] if row else 1
+    except sqlite3.OperationalError:
+        return 1
+    finally:
+        conn.close()
+
+def message_files(db_path, shard_count):
+    """Файлы, в которых лежат сообщения при данной раскладке"""
+    if shard_count == 1:
+        return [db_path]
+    return [shard_file_path(db_path, index) for index in range(shard_count)]
+
+def remove_database_file(path):
+    """Удаление файла SQLite вместе с WAL и shared memory"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def get_meta(staging, key, default=None):
+    """Значение из служебной таблицы временной базы"""
+    row = staging.execute("SELECT value FROM reshard_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(staging, key, value):
+    """Запись значения в служебную таблицу временной базы"""
+    staging.execute("INSERT OR REPLACE INTO reshard_meta (key, value) VALUES (?, ?)", (key, value))
+    staging.commit()
+
+def get_phase(staging):
+    """Этап, на котором остановился предыдущий запуск"""
+    return get_meta(staging, 'phase', 'new')
+
+def set_phase(staging, phase):
+    """Фиксация пройденного этапа"""
+    set_meta(staging, 'phase', phase)
+
+def open_staging(db_path):
+    """Временная база с копией сообщений и сегментов архива"""
+    staging = sqlite3.connect(staging_path(db_path))
+    staging.execute("PRAGMA journal_mode = WAL")
+    staging.execute("PRAGMA synchronous = NORMAL")
+    staging.execute("CREATE TABLE IF NOT EXISTS reshard_meta (key TEXT PRIMARY KEY, value)")
+    staging.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY, chat_id INTEGER, sender_id INTEGER, content TEXT,
+            encrypted_content TEXT, message_type TEXT, created_at TIMESTAMP
+        )
+    ''')
+    staging.execute('''
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            chat_id INTEGER, chat_type TEXT, first_id INTEGER, last_id INTEGER,
+            last_created_at TIMESTAMP, message_count INTEGER, payload BLOB,
+            PRIMARY KEY (chat_id, first_id)
+        )
+    ''')
+    staging.commit()
+    return staging
+
+def copy_out(db_path, shard_count, staging):
+    """Этап 1: копирование сообщений и архива текущей раскладки во временную базу"""
+    copied = 0
+    for path in message_files(db_path, shard_count):
+        if not os.path.exists(path):
+            continue
+        source = sqlite3.connect(path)
+        try:
+            rows = source.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages ORDER BY id")
+            while True:
+                batch = rows.fetchmany(BATCH_SIZE)
+                if not batch:
+                    break
+                staging.executemany(f"INSERT OR IGNORE INTO messages ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                staging.commit()
+                copied += len(batch)
+                print(f"📦 Скопировано сообщений: {copied}")
+        finally:
+            source.close()
+
+        archive_path = archive_file_path(path)
+        if os.path.exists(archive_path):
+            archive = sqlite3.connect(archive_path)
+            try:
+                segments = archive.execute(f"SELECT {SEGMENT_COLUMNS} FROM archive_segments")
+                staging.executemany(
+                    f"INSERT OR IGNORE INTO archive_segments ({SEGMENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    segments
+                )
+                staging.commit()
+            finally:
+                archive.close()
+
+    set_phase(staging, 'copied')
+
+def clear_source(db_path, shard_count, target_count, staging):
+    """Этап 2: очистка старой раскладки и запись новой в основную базу"""
+    conn = sqlite3.connect(db_path)
+    try:
+        if shard_count == 1:
+            conn.execute("DELETE FROM messages")
+        conn.execute("CREATE TABLE IF NOT EXISTS shard_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        if target_count == 1:
+            conn.execute("DELETE FROM shard_meta WHERE key = 'shard_count'")
+        else:
+            conn.execute("INSERT OR REPLACE INTO shard_meta (key, value) VALUES ('shard_count', ?)", (target_count,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    if shard_count == 1:
+        remove_database_file(archive_file_path(db_path))
+    else:
+        for path in message_files(db_path, shard_count):
+            remove_database_file(archive_file_path(path))
+            remove_database_file(path)
+
+    print("🧹 Старая раскладка очищена")
+    set_phase(staging, 'cleared')
+
+def load_in(db_path, target_count, staging):
+    """Этап 3: загрузка сообщений и архива в новую раскладку"""
+    db = DatabaseManager(db_path, shards=target_count, retention_interval=None, archive_interval=None)
+    try:
+        # Новые id в шардах должны быть больше всех перенесенных
+        id_floor = staging.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        for shard in db.shards:
+            if shard.external:
+                with shard.pool.writer() as conn:
+                    conn.execute("INSERT OR REPLACE INTO shard_meta (key, value) VALUES ('id_floor', ?)", (id_floor,))
+
+        loaded = 0
+        rows = staging.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages ORDER BY id")
+        while True:
+            batch = rows.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+
+            by_shard = {}
+            for row in batch:
+                by_shard.setdefault(db._shard(row[1]).index, []).append(row)
+            for index, shard_rows in by_shard.items():
+                with db.shards[index].pool.writer() as conn:
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO messages ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", shard_rows
+                    )
+
+            loaded += len(batch)
+            print(f"📥 Загружено сообщений: {loaded}")
+
+        # Архив загружается целиком заново, поэтому повторный запуск не создает дублей
+        for shard in db.shards:
+            if shard.archive:
+                with shard.archive.conn:
+                    shard.archive.conn.execute("DELETE FROM archive_segments")
+        for segment in staging.execute(f"SELECT {SEGMENT_COLUMNS} FROM archive_segments ORDER BY chat_id, first_id"):
+            archive = db._shard(segment[0]).archive
+            if archive:
+                archive.conn.execute(
+                    f"INSERT INTO archive_segments ({SEGMENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", segment
+                )
+        for shard in db.shards:
+            if shard.archive:
+                shard.archive.conn.commit()
+                shard.archive.rebuild_index()
+    finally:
+        db.close()
+
+    set_phase(staging, 'done')
+
+def reshard(db_path, target_count):
+    """Перенос сообщений в раскладку из target_count шардов"""
+    target_count = max(1, int(target_count))
+    resuming = os.path.exists(staging_path(db_path))
+    shard_count = current_shard_count(db_path)
+
+    if shard_count == target_count and not resuming:
+        print(f"✅ Сообщения уже разложены на {target_count} шард(ов)")
+        return True
+
+    staging = open_staging(db_path)
+    try:
+        phase = get_phase(staging)
+        if phase == 'new':
+            set_meta(staging, 'source_count', shard_count)
+            set_meta(staging, 'target_count', target_count)
+        else:
+            # Раскладку берем из прерванного запуска: основная база могла уже переключиться на новую
+            print(f"🔄 Продолжаем прерванную перераскладку с этапа: {phase}")
+            shard_count = get_meta(staging, 'source_count')
+            target_count = get_meta(staging, 'target_count')
+
+        if phase == 'new':
+            print(f"🔄 Перераскладка: {shard_count} -> {target_count} шард(ов)")
+            copy_out(db_path, shard_count, staging)
+            phase = get_phase(staging)
+        if phase == 'copied':
+            clear_source(db_path, shard_count, target_count, staging)
+            phase = get_phase(staging)
+        if phase == 'cleared':
+            load_in(db_path, target_count, staging)
+    finally:
+        staging.close()
+
+    remove_database_file(staging_path(db_path))
+    print(f"✅ Сообщения разложены на {target_count} шард(ов)")
+    return True
+
+def main():
+    """Точка входа командной строки"""
+    if len(sys.argv) != 3 or not sys.argv[2].isdigit():
+        print("Использование: python shard_tool.py <путь к базе> <число шардов>")
+        sys.exit(1)
+    reshard(sys.argv[1], int(sys.argv[2]))
+
+if __name__ == "__main__":
+    main()
@@ -13,11 +13,11 @@ import hashlib
 import os
 import uuid
 from datetime import datetime
-from database import DatabaseManager
+from storage import create_storage
 from crypto_utils import CryptoManager
 
 # Инициализация базы данных
-db = DatabaseManager()
+db = create_storage()
 active_users = {}  # {session_id: {'user_id': int, 'username': str, 'display_name': str}}
 active_secure_chats = {}  # {chat_key: {'participants': [], 'encryption_key': str}}
 
@@ -51,10 +51,14 @@ class SecureMessengerHandler(http.server.SimpleHTTPRequestHandler):
                 response = self.api_login(data)
             elif self.path == '/api/find_user':
                 response = self.api_find_user(data)
+            elif self.path == '/api/search_users':
+                response = self.api_search_users(data)
             elif self.path == '/api/get_chats':
                 response = self.api_get_chats(data)
             elif self.path == '/api/get_messages':
                 response = self.api_get_messages(data)
+            elif self.path == '/api/get_new_messages':
+                response = self.api_get_new_messages(data)
             elif self.path == '/api/create_chat':
                 response = self.api_create_chat(data)
             elif self.path == '/api/send_message':
@@ -65,6 +69,8 @@ class SecureMessengerHandler(http.server.SimpleHTTPRequestHandler):
                 response = self.api_join_secure_chat(data)
             elif self.path == '/api/send_secure_message':
                 response = self.api_send_secure_message(data)
+            elif self.path == '/api/search_messages':
+                response = self.api_search_messages(data)
             else:
                 response = {'success': False, 'error': 'Неизвестный API endpoint'}
             
@@ -144,6 +150,14 @@ class SecureMessengerHandler(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             return {'success': False, 'error': f'Ошибка поиска: {str(e)}'}
     
+    def api_search_users(self, data):
+        """API поиска пользователей по началу имени"""
+        try:
+            users = db.search_users(data.get('prefix', ''), data.get('limit', 10))
+            return {'success': True, 'users': users}
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка поиска: {str(e)}'}
+    
     def api_get_chats(self, data):
         """API получения чатов"""
         try:
@@ -167,15 +181,67 @@ class SecureMessengerHandler(http.server.SimpleHTTPRequestHandler):
                 return {'success': False, 'error': 'Не авторизован'}
             
             chat_id = data.get('chat_id')
-            limit = data.get('limit', 50)
             
-            messages = db.get_chat_messages(chat_id, limit)
+            # Курсор: before_id - более старые сообщения, after_id - более новые
+            page = db.get_chat_messages_page(
+                chat_id,
+                data.get('limit', 50),
+                before_id=data.get('before_id'),
+                after_id=data.get('after_id'),
+                direction=data.get('direction')
+            )
             
-            return {'success': True, 'messages': messages}
+            return {
+                'success': True,
+                'messages': page['messages'],
+                'direction': page['direction'],
+                'has_more': page['has_more'],
+                'before_id': page['before_id'],
+                'after_id': page['after_id']
+            }
             
         except Exception as e:
             return {'success': False, 'error': f'Ошибка загрузки сообщений: {str(e)}'}
     
+    def api_get_new_messages(self, data):
+        """API получения новых сообщений после водяной отметки after_id"""
+        try:
+            session_id = data.get('session_id')
+            if not session_id or session_id not in active_users:
+                return {'success': False, 'error': 'Не авторизован'}
+            
+            chat_id = data.get('chat_id')
+            delta = db.get_messages_since(chat_id, data.get('after_id', 0))
+            
+            return {
+                'success': True,
+                'messages': delta['messages'],
+                'last_message_id': delta['last_message_id'],
+                'has_more': delta['has_more']
+            }
+            
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка загрузки сообщений: {str(e)}'}
+    
+    def api_search_messages(self, data):
+        """API полнотекстового поиска по сообщениям"""
+        try:
+            session_id = data.get('session_id')
+            if not session_id or session_id not in active_users:
+                return {'success': False, 'error': 'Не авторизован'}
+            
+            query = data.get('query', '').strip()
+            if not query:
+                return {'success': False, 'error': 'Введите текст для поиска'}
+            
+            user_id = active_users[session_id]['user_id']
+            result = db.search_messages(user_id, query, data.get('limit', 20), data.get('cursor'))
+            
+            return {'success': True, 'messages': result['messages'], 'next_cursor': result['next_cursor']}
+            
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка поиска: {str(e)}'}
+    
     def api_create_chat(self, data):
         """API создания чата"""
         try:
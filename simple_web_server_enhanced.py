@@ -139,37 +139,43 @@ class EnhancedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             
             # Обрабатываем запрос через сервер мессенджера
             if api_path == 'login':
-                return self.messenger_server.handle_login(request_data)
+                return self.messenger_server.api_login(request_data)
             elif api_path == 'register':
-                return self.messenger_server.handle_register(request_data)
+                return self.messenger_server.api_register(request_data)
             elif api_path == 'get_chats':
-                return self.messenger_server.handle_get_chats(request_data)
+                return self.messenger_server.api_get_chats(request_data)
             elif api_path == 'get_messages':
-                return self.messenger_server.handle_get_messages(request_data)
+                return self.messenger_server.api_get_messages(request_data)
+            elif api_path == 'get_new_messages':
+                return self.messenger_server.api_get_new_messages(request_data)
             elif api_path == 'send_message':
-                return self.messenger_server.handle_send_message(request_data)
+                return self.messenger_server.api_send_message(request_data)
             elif api_path == 'create_chat':
-                return self.messenger_server.handle_create_chat(request_data)
+                return self.messenger_server.api_create_chat(request_data)
             elif api_path == 'find_user':
-                return self.messenger_server.handle_find_user(request_data)
+                return self.messenger_server.api_find_user(request_data)
+            elif api_path == 'search_users':
+                return self.messenger_server.api_search_users(request_data)
             elif api_path == 'create_secure_chat':
-                return self.messenger_server.handle_create_secure_chat(request_data)
+                return self.messenger_server.api_create_secure_chat(request_data)
             elif api_path == 'join_secure_chat':
-                return self.messenger_server.handle_join_secure_chat(request_data)
+                return self.messenger_server.api_join_secure_chat(request_data)
             elif api_path == 'send_secure_message':
-                return self.messenger_server.handle_send_secure_message(request_data)
+                return self.messenger_server.api_send_secure_message(request_data)
             elif api_path == 'get_secure_messages':
-                return self.messenger_server.handle_get_secure_messages(request_data)
+                return self.messenger_server.api_get_secure_messages(request_data)
             elif api_path == 'clear_chat_history':
-                return self.messenger_server.handle_clear_chat_history(request_data)
+                return self.messenger_server.api_clear_chat_history(request_data)
             elif api_path == 'close_secure_chat':
-                return self.messenger_server.handle_close_secure_chat(request_data)
+                return self.messenger_server.api_close_secure_chat(request_data)
             elif api_path == 'auto_close_secure_chat':
-                return self.messenger_server.handle_auto_close_secure_chat(request_data)
+                return self.messenger_server.api_auto_close_secure_chat(request_data)
             elif api_path == 'get_chat_info':
-                return self.messenger_server.handle_get_chat_info(request_data)
+                return self.messenger_server.api_get_chat_info(request_data)
             elif api_path == 'change_display_name':
-                return self.messenger_server.handle_change_display_name(request_data)
+                return self.messenger_server.api_change_display_name(request_data)
+            elif api_path == 'search_messages':
+                return self.messenger_server.api_search_messages(request_data)
             else:
                 return {"success": False, "error": f"Unknown API endpoint: {api_path}"}
                 
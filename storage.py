@@ -0,0 +1,199 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+
+# Размер страницы истории по умолчанию и максимальный
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+class StorageBackend(ABC):
+    """Контракт хранилища мессенджера: пользователи, чаты, сообщения и защищенные сессии.
+
+    Все движки возвращают одинаковые структуры и не выбрасывают исключений из публичных методов:
+    ошибка возвращается как False, None или пустой результат.
+    """
+
+    # Пользователи
+
+    def hash_password(self, password):
+        """Хеширование пароля"""
+        salt = os.urandom(16)
+        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
+        return salt.hex() + hash_obj.hex()
+
+    def verify_password(self, password, stored_hash):
+        """Проверка пароля"""
+        try:
+            salt_hex = stored_hash[:32]
+            hash_hex = stored_hash[32:]
+            salt = bytes.fromhex(salt_hex)
+            stored_hash_bytes = bytes.fromhex(hash_hex)
+
+            hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
+            return hash_obj == stored_hash_bytes
+        except:
+            return False
+
+    def generate_secret_phrase(self):
+        """Генерация секретной фразы для восстановления"""
+        words = [
+            "apple", "banana", "cherry", "dragon", "eagle", "forest", "garden", "house",
+            "island", "jungle", "knight", "lemon", "mountain", "ocean", "planet", "queen",
+            "river", "star", "tiger", "umbrella", "village", "water", "xylophone", "yellow"
+        ]
+        phrase = []
+        for _ in range(4):
+            phrase.append(words[os.urandom(1)[0] % len(words)])
+        return "-".join(phrase)
+
+    @abstractmethod
+    def register_user(self, username, display_name, password):
+        """Регистрация нового пользователя: (True, секретная фраза) или (False, текст ошибки)"""
+
+    @abstractmethod
+    def authenticate_user(self, username, password):
+        """Аутентификация пользователя: (True, данные пользователя) или (False, текст ошибки)"""
+
+    @abstractmethod
+    def find_user_by_display_name(self, display_name):
+        """Поиск пользователя по имени аккаунта"""
+
+    @abstractmethod
+    def search_users(self, prefix, limit=10):
+        """Ранжированный поиск пользователей по началу или похожему имени"""
+
+    @abstractmethod
+    def get_user_display_name(self, user_id):
+        """Получение имени пользователя по ID"""
+
+    @abstractmethod
+    def change_display_name(self, user_id, new_display_name):
+        """Изменение имени пользователя"""
+
+    # Чаты
+
+    @abstractmethod
+    def create_chat(self, chat_type, participants):
+        """Создание нового чата"""
+
+    @abstractmethod
+    def get_or_create_private_chat(self, user1_id, user2_id):
+        """Получение или создание приватного чата между двумя пользователями"""
+
+    @abstractmethod
+    def get_user_chat_ids(self, user_id):
+        """ID чатов пользователя без сводок - для маршрутизации рассылок"""
+
+    @abstractmethod
+    def get_user_chats(self, user_id):
+        """Получение чатов пользователя"""
+
+    @abstractmethod
+    def get_chat_info(self, user_id, chat_id):
+        """Получение информации о чате"""
+
+    @abstractmethod
+    def get_all_chats(self):
+        """Получение всех чатов для веб-API"""
+
+    @abstractmethod
+    def clear_user_chat_history(self, user_id):
+        """Очистка истории чатов пользователя"""
+
+    @abstractmethod
+    def mark_read(self, user_id, chat_id, message_id=None):
+        """Отметка чата прочитанным до message_id; None, если пользователь не участник чата"""
+
+    # Сообщения
+
+    def save_message(self, chat_id, sender_id, content, encrypted_content=None, message_type="normal"):
+        """Сохранение сообщения"""
+        try:
+            self.save_message_async(chat_id, sender_id, content, encrypted_content, message_type).result()
+            return True
+        except Exception as e:
+            return False
+
+    @abstractmethod
+    def save_message_async(self, chat_id, sender_id, content, encrypted_content=None, message_type="normal",
+                           callback=None):
+        """Сохранение сообщения; Future возвращает id сообщения"""
+
+    def get_chat_messages(self, chat_id, limit=DEFAULT_PAGE_SIZE, before_id=None, after_id=None, direction=None):
+        """Получение сообщений чата.
+
+        Без курсора возвращаются последние limit сообщений (новые первыми).
+        before_id - страница более старых сообщений, от новых к старым;
+        after_id - страница более новых сообщений, от старых к новым.
+        """
+        return self.get_chat_messages_page(chat_id, limit, before_id, after_id, direction)['messages']
+
+    @abstractmethod
+    def get_chat_messages_page(self, chat_id, limit=DEFAULT_PAGE_SIZE, before_id=None, after_id=None, direction=None):
+        """Страница истории чата по курсору: messages, direction, has_more, before_id, after_id"""
+
+    def get_messages_since(self, chat_id, after_id=0, limit=MAX_PAGE_SIZE):
+        """Сообщения чата новее водяной отметки after_id (дельта для опроса, от старых к новым)"""
+        after_id = int(after_id or 0)
+        page = self.get_chat_messages_page(chat_id, limit, after_id=after_id, direction='forward')
+
+        return {
+            "messages": page['messages'],
+            "last_message_id": page['after_id'] or after_id,
+            "has_more": page['has_more']
+        }
+
+    @abstractmethod
+    def search_messages(self, user_id, query, limit=20, cursor=None):
+        """Поиск по обычным сообщениям в чатах пользователя: messages, next_cursor"""
+
+    # Защищенные чаты
+
+    @abstractmethod
+    def create_secure_chat_session(self, chat_key, encryption_key=None):
+        """Создание защищенной сессии чата"""
+
+    @abstractmethod
+    def get_secure_chat_session(self, chat_key):
+        """Получение защищенной сессии чата по ключу"""
+
+    def save_secure_message(self, chat_key, sender_id, content):
+        """Сохранение защищенного сообщения"""
+        try:
+            return self.save_secure_message_async(chat_key, sender_id, content).result() is not None
+        except Exception as e:
+            return False
+
+    @abstractmethod
+    def save_secure_message_async(self, chat_key, sender_id, content, callback=None):
+        """Сохранение защищенного сообщения; Future возвращает id или None, если чат не найден"""
+
+    @abstractmethod
+    def get_secure_messages(self, chat_key):
+        """Получение защищенных сообщений"""
+
+    @abstractmethod
+    def clear_secure_chat(self, chat_id):
+        """Очистка защищенного чата"""
+
+    @abstractmethod
+    def close_secure_chat(self, chat_key):
+        """Закрытие защищенного чата"""
+
+    def close(self):
+        """Освобождение ресурсов хранилища"""
+
+def create_storage(engine=None, **kwargs):
+    """Создание хранилища по имени движка: sqlite (по умолчанию) или memory.
+
+    Движок можно задать переменной окружения MESSENGER_STORAGE.
+    """
+    engine = engine or os.getenv('MESSENGER_STORAGE', 'sqlite')
+
+    if engine == 'sqlite':
+        from database import DatabaseManager
+        return DatabaseManager(**kwargs)
+    if engine == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage(**kwargs)
+    raise ValueError(f"Неизвестный движок хранения: {engine}")
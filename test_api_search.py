@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Поиск по сообщениям через веб-API: пользователь видит только свои чаты,
+неизвестная сессия отклоняется
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from server import SecureMessengerServer
+from storage import create_storage
+
+def test_api_search_messages_scoped_to_session():
+    """Вторая пользовательница не находит сообщения чужого чата"""
+    server = SecureMessengerServer(storage=create_storage('memory'))
+    db = server.db
+    try:
+        for username in ("alice", "bob", "carol"):
+            assert server.api_register({'username': username, 'display_name': username.title(),
+                                        'password': 'password'})['success']
+        alice, bob, carol = (db.find_user_by_display_name(name) for name in ("Alice", "Bob", "Carol"))
+        chat_id = db.get_or_create_private_chat(alice['user_id'], bob['user_id'])
+        assert db.save_message(chat_id, alice['user_id'], "секретный план")
+
+        alice_session = server.api_login({'username': 'alice', 'password': 'password'})['session_id']
+        carol_session = server.api_login({'username': 'carol', 'password': 'password'})['session_id']
+
+        found = server.api_search_messages({'session_id': alice_session, 'query': 'секретный'})
+        assert found['success'] and [m['content'] for m in found['messages']] == ["секретный план"]
+
+        found = server.api_search_messages({'session_id': carol_session, 'query': 'секретный'})
+        assert found['success'] and found['messages'] == [], found
+        print("✅ Чужой чат не попадает в поиск")
+
+        found = server.api_search_messages({'session_id': 'forged', 'query': 'секретный'})
+        assert not found['success'] and 'messages' not in found
+        print("✅ Неизвестная сессия отклонена")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    test_api_search_messages_scoped_to_session()
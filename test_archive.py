@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Холодный архив: два менеджера на одном файле переносят каждое сообщение ровно один раз,
+сводка и счетчики непрочитанных сходятся, история и поиск видят архивные сообщения
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager
+
+MESSAGES = 2001
+
+def open_manager(path):
+    return DatabaseManager(path, retention_interval=None, archive_interval=None)
+
+def fill_chat(db):
+    """Приватный чат, все сообщения которого старше срока архивации"""
+    db.register_user("alice", "Alice", "password")
+    db.register_user("bob", "Bob", "password")
+    chat_id = db.get_or_create_private_chat(1, 2)
+    for future in [db.save_message_async(chat_id, 1, f"Яблоко {i}") for i in range(MESSAGES)]:
+        future.result()
+    with db.pool.writer() as conn:
+        conn.execute("UPDATE messages SET created_at = datetime('now', '-60 days')")
+    return chat_id
+
+def test_archive_two_managers():
+    """Параллельная архивация из двух менеджеров не дублирует и не теряет сообщения"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, 'archive.db')
+        first = open_manager(path)
+        second = open_manager(path)
+        try:
+            chat_id = fill_chat(first)
+            moved = {}
+            threads = [threading.Thread(target=lambda name, db: moved.__setitem__(name, db.archive_old_messages()),
+                                        args=(name, db)) for name, db in (('first', first), ('second', second))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # Последнее сообщение чата остается в messages, остальные - ровно один раз в архиве
+            assert sum(moved.values()) == MESSAGES - 1, moved
+            archive = first.shards[0].archive
+            assert archive.stats()['messages'] == MESSAGES - 1
+            with first.pool.reader() as conn:
+                hot = conn.execute("SELECT COUNT(*) FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+                summary = conn.execute("SELECT message_count, archived_count FROM chat_summary WHERE chat_id = ?",
+                                       (chat_id,)).fetchone()
+            assert hot == 1 and summary == (1, MESSAGES - 1), (hot, summary)
+            assert first.archive_old_messages() == 0 and second.archive_old_messages() == 0
+            print(f"✅ Перенесено {sum(moved.values())} сообщений: {moved}")
+
+            # История по курсору проходит через архив без пропусков и повторов
+            ids, before_id = [], None
+            while True:
+                page = second.get_chat_messages_page(chat_id, 100, before_id=before_id)
+                ids.extend(message['id'] for message in page['messages'])
+                if not page['has_more']:
+                    break
+                before_id = page['before_id']
+            assert ids == sorted(set(ids), reverse=True) and len(ids) == MESSAGES
+            print(f"✅ История по курсору: {len(ids)} сообщений")
+
+            # Поиск находит архивные сообщения, частичное прочтение учитывает архив
+            found = second.search_messages(2, "яблоко 1234", limit=5)['messages']
+            assert [message['content'] for message in found] == ["Яблоко 1234"], found
+            read = second.mark_read(2, chat_id, ids[4])
+            assert read['unread_count'] == 4, read
+            print("✅ Поиск и счетчик непрочитанных видят архив")
+        finally:
+            second.close()
+            first.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_archive_two_managers()
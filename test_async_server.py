@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Сервер asyncio поверх AsyncDatabaseManager: чтения, изменения и отправка сообщений
+проходят через свои очереди хранилища, переданное хранилище фасад не закрывает
+"""
+
+import sys
+import os
+import asyncio
+import json
+import socket
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from async_database import AsyncDatabaseManager
+from async_server import AsyncSecureMessengerServer
+from framing import FrameReader, encode_frame
+from storage import create_storage
+
+class Client:
+    """Клиент протокола: кадры из 4 байт длины + JSON"""
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port), timeout=5)
+        self.frames = FrameReader(self.sock)
+
+    def request(self, message, response_type):
+        self.sock.sendall(encode_frame(json.dumps(message)))
+        return self.wait(response_type)
+
+    def wait(self, response_type):
+        while True:
+            response = json.loads(self.frames.read_message())
+            if response['type'] == response_type:
+                return response
+
+    def close(self):
+        self.sock.close()
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+def test_async_database_manager():
+    """Фасад: параллельные записи групповым коммитом и чтения в пуле потоков"""
+    storage = create_storage('memory')
+
+    async def scenario():
+        db = AsyncDatabaseManager(storage, read_workers=2, max_pending=4)
+        assert (await db.register_user("alice", "Alice", "password"))[0]
+        assert (await db.register_user("bob", "Bob", "password"))[0]
+        alice = (await db.authenticate_user("alice", "password"))[1]
+        bob = await db.find_user_by_display_name("Bob")
+        chat_id = await db.get_or_create_private_chat(alice["user_id"], bob["user_id"])
+
+        saved = await asyncio.gather(*[db.save_message(chat_id, alice["user_id"], f"Сообщение {i}")
+                                       for i in range(20)])
+        assert all(saved)
+        page = await db.get_chat_messages_page(chat_id, 50)
+        assert len(page["messages"]) == 20
+
+        stats = db.stats()
+        assert stats["commit"]["completed"] == 20 and stats["commit"]["max_queue_depth"] <= 4
+        assert stats["write"]["completed"] == 3 and stats["read"]["completed"] == 3
+        db.close()
+
+    asyncio.run(scenario())
+    assert storage.find_user_by_display_name("Alice") is not None, "переданное хранилище должно остаться открытым"
+    storage.close()
+    print("✅ Фасад: 20 записей групповым коммитом, хранилище владельца не закрыто")
+
+def test_async_server():
+    """Сервер: обработчики идут через очереди фасада, сообщение доходит до собеседника"""
+    port = free_port()
+    server = AsyncSecureMessengerServer('localhost', port, workers=2, storage=create_storage('memory'))
+    thread = threading.Thread(target=server.start, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not server.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    alice, bob = Client(port), Client(port)
+    try:
+        for client, name in ((alice, "alice"), (bob, "bob")):
+            assert client.request({'type': 'register', 'username': name, 'display_name': name.title(),
+                                   'password': 'password'}, 'register_response')['success']
+            assert client.request({'type': 'auth', 'username': name, 'password': 'password'},
+                                  'auth_response')['success']
+
+        bob_id = alice.request({'type': 'find_user', 'display_name': 'Bob'}, 'find_user_response')['user_data']['user_id']
+        chat_id = alice.request({'type': 'create_chat', 'user_id': bob_id}, 'create_chat_response')['chat_id']
+        alice.sock.sendall(encode_frame(json.dumps({'type': 'send_message', 'chat_id': chat_id, 'content': 'Привет'})))
+        event = bob.wait('new_message')
+        assert event['content'] == 'Привет' and event['sender_name'] == 'Alice'
+
+        messages = bob.request({'type': 'get_messages', 'chat_id': chat_id}, 'get_messages_response')['messages']
+        assert [m['content'] for m in messages] == ['Привет']
+
+        # Ответ уходит из обработчика до того, как очередь учтет вызов завершенным
+        expected = {'read': 4, 'write': 3, 'commit': 1}  # вход, поиск, история; регистрации и чат; сообщение
+        deadline = time.monotonic() + 5
+        while True:
+            stats = server.get_storage_stats()
+            completed = {lane: stats[lane]['completed'] for lane in expected}
+            if completed == expected or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        assert completed == expected, completed
+        print(f"✅ Сервер: очереди чтения/записи/коммита - {stats['read']['completed']}/"
+              f"{stats['write']['completed']}/{stats['commit']['completed']}")
+    finally:
+        alice.close()
+        bob.close()
+        server.stop()
+        thread.join(5)
+        server.db.close()
+
+if __name__ == "__main__":
+    test_async_database_manager()
+    test_async_server()
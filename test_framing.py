@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Проверка чтения кадров: заголовок по частям, несколько кадров за одно чтение,
+кадр больше буфера и ограничение размера
+"""
+
+import sys
+import os
+import socket
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from framing import FrameReader, FrameTooLarge, encode_frame
+
+def test_framing():
+    """Кадры читаются целиком при любом разбиении потока"""
+    messages = ["", "привет", "x" * 200000, "{\"type\": \"auth\"}"] * 3
+    data = b''.join(encode_frame(message) for message in messages)
+    writer, reader = socket.socketpair()
+
+    def send_in_pieces():
+        sizes = [1, 2, 3, 5, 70000]
+        position = 0
+        for i in range(len(data)):
+            if position >= len(data):
+                break
+            size = sizes[i % len(sizes)]
+            writer.sendall(data[position:position + size])
+            position += size
+        writer.close()
+
+    thread = threading.Thread(target=send_in_pieces)
+    thread.start()
+    frames = FrameReader(reader, read_size=1024)
+    received = []
+    while True:
+        message = frames.read_message()
+        if message is None:
+            break
+        received.append(message)
+    thread.join()
+    reader.close()
+
+    assert received == messages
+    print(f"✅ Прочитано кадров: {len(received)}")
+
+    writer, reader = socket.socketpair()
+    writer.sendall((1024).to_bytes(4, 'big'))
+    try:
+        FrameReader(reader, max_frame_size=100).read_frame()
+        assert False, "кадр больше допустимого должен отклоняться"
+    except FrameTooLarge:
+        print("✅ Кадр больше допустимого отклонен")
+    finally:
+        writer.close()
+        reader.close()
+
+if __name__ == "__main__":
+    test_framing()
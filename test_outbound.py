@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Исходящие очереди при медленном клиенте: drop_oldest отбрасывает старые кадры и доставляет
+последние, disconnect разрывает подключение; так себя ведут и поток-писатель, и цикл событий
+"""
+
+import sys
+import os
+import asyncio
+import json
+import socket
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from async_server import _StreamConnection
+from framing import FrameReader, encode_frame
+from outbound import DISCONNECT, DROP_OLDEST, OutboundMetrics, ThreadedOutboundQueue, check_policy
+
+QUEUE_SIZE = 5
+
+def frame(index, size=0):
+    return encode_frame(json.dumps({'index': index, 'body': 'x' * size}))
+
+def read_indexes(sock):
+    """Номера всех кадров, полученных клиентом до закрытия подключения"""
+    frames = FrameReader(sock)
+    indexes = []
+    while True:
+        message = frames.read_message()
+        if message is None:
+            return indexes
+        indexes.append(json.loads(message)['index'])
+
+def test_threaded_queue():
+    """Поток-писатель занят первым большим кадром, клиент пока ничего не читает"""
+    try:
+        check_policy('block')
+        assert False, "неизвестная политика должна отклоняться"
+    except ValueError:
+        pass
+
+    metrics = OutboundMetrics(QUEUE_SIZE, DROP_OLDEST)
+    for policy in (DROP_OLDEST, DISCONNECT):
+        server_side, client_side = socket.socketpair()
+        queue = ThreadedOutboundQueue(server_side, QUEUE_SIZE, policy)
+        # Кадр больше буферов сокета: писатель блокируется в sendall, пока клиент не начнет читать
+        accepted = [queue.put(frame(0, 4 * 1024 * 1024))]
+        while queue.stats()['depth']:
+            threading.Event().wait(0.001)
+        accepted += [queue.put(frame(index)) for index in range(1, 51)]
+
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(read_indexes(client_side)))
+        reader.start()
+        if policy == DROP_OLDEST:
+            assert all(accepted) and queue.dropped == 45, queue.stats()
+            while queue.sent < 51 - queue.dropped:
+                threading.Event().wait(0.01)
+            queue.close()
+            server_side.close()
+            reader.join(5)
+            assert received == [0] + list(range(46, 51)), received
+            print(f"✅ {policy}: отброшено {queue.dropped}, доставлены последние кадры {received[-QUEUE_SIZE:]}")
+        else:
+            assert accepted[:1 + QUEUE_SIZE] == [True] * (1 + QUEUE_SIZE) and not any(accepted[1 + QUEUE_SIZE:])
+            reader.join(5)
+            assert not reader.is_alive() and queue.overflowed and received == list(range(len(received)))
+            server_side.close()
+            print(f"✅ {policy}: клиент отключен после переполнения, получено кадров: {len(received)}")
+        metrics.retire(queue)
+        client_side.close()
+
+    totals = metrics.collect([])
+    assert totals['slow_disconnects'] == 1 and totals['dropped_frames'] == 45, totals
+
+def test_stream_connection():
+    """Кадры, поставленные до первой отправки, проходят через политику в цикле событий"""
+
+    async def scenario(policy):
+        server_side, client_side = socket.socketpair()
+        _, writer = await asyncio.open_connection(sock=server_side)
+        connection = _StreamConnection(asyncio.get_running_loop(), writer, None, QUEUE_SIZE, policy)
+        await asyncio.sleep(0)  # писатель ждет первого кадра
+        accepted = [connection.put(frame(index)) for index in range(50)]
+        while not connection.closed and (connection._frames or connection.sent < QUEUE_SIZE):
+            await asyncio.sleep(0.01)
+        connection.close()
+        await asyncio.sleep(0.05)
+        received = await asyncio.get_running_loop().run_in_executor(None, read_indexes, client_side)
+        client_side.close()
+        return accepted, connection, received
+
+    accepted, connection, received = asyncio.run(scenario(DROP_OLDEST))
+    assert all(accepted) and connection.dropped == 45 and received == list(range(45, 50)), received
+    print(f"✅ asyncio {DROP_OLDEST}: доставлены последние кадры {received}")
+
+    accepted, connection, received = asyncio.run(scenario(DISCONNECT))
+    assert connection.overflowed and connection.sent == 0 and received == []
+    print(f"✅ asyncio {DISCONNECT}: подключение закрыто без отправки")
+
+if __name__ == "__main__":
+    test_threaded_queue()
+    test_stream_connection()
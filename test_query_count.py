@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Регрессионный бенчмарк: число SQL-запросов на get_user_chats и get_chat_info
+не должно расти вместе с количеством чатов пользователя
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager
+
+def count_queries(db, func, *args):
+    """Подсчет SQL-выражений, выполненных при вызове функции"""
+    statements = []
+    db.pool.set_trace_callback(statements.append)
+    try:
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.pool.set_trace_callback(None)
+    return len(statements), elapsed, result
+
+def build_database(db, chat_count):
+    """Пользователь с заданным числом приватных чатов"""
+    db.register_user("owner", "Owner", "password")
+    owner_id = db.find_user_by_display_name("Owner")["user_id"]
+    
+    for i in range(chat_count):
+        db.register_user(f"friend{i}", f"Friend {i}", "password")
+        friend_id = db.find_user_by_display_name(f"Friend {i}")["user_id"]
+        chat_id = db.get_or_create_private_chat(owner_id, friend_id)
+        db.save_message(chat_id, friend_id, f"Привет от Friend {i}")
+    
+    return owner_id
+
+def measure(chat_count):
+    """Число запросов и время get_user_chats/get_chat_info для chat_count чатов"""
+    temp_dir = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(temp_dir, "benchmark.db"))
+    try:
+        owner_id = build_database(db, chat_count)
+        
+        chats_queries, chats_time, chats = count_queries(db, db.get_user_chats, owner_id)
+        assert len(chats) == chat_count
+        
+        info_queries, info_time, info = count_queries(db, db.get_chat_info, owner_id, chats[0]["chat_id"])
+        assert info is not None and info["chat_name"] != "Owner"
+        
+        return chats_queries, chats_time, info_queries, info_time
+    finally:
+        db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_query_count():
+    """Число запросов не зависит от количества чатов"""
+    small = measure(5)
+    large = measure(50)
+    
+    print(f"📊 get_user_chats: {small[0]} запросов на 5 чатов, {large[0]} на 50 чатов ({large[1] * 1000:.2f} мс)")
+    print(f"📊 get_chat_info: {small[2]} запросов на 5 чатов, {large[2]} на 50 чатов ({large[3] * 1000:.2f} мс)")
+    
+    assert small[0] == large[0], "get_user_chats выполняет запросы на каждый чат (N+1)"
+    assert small[2] == large[2], "get_chat_info выполняет запросы на каждого участника (N+1)"
+
+if __name__ == "__main__":
+    test_query_count()
+    print("✅ Число запросов не растет с количеством чатов")
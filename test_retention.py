@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Очистка по срокам хранения: включается только явно, удаляет устаревшие сообщения
+нужного типа чатов и пересчитывает сводку; старый файл переводится на пошаговую очистку
+"""
+
+import sys
+import os
+import shutil
+import sqlite3
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager, _refresh_chat_summaries, parse_retention_policies
+
+def fill_chats(db):
+    """Групповой и приватный чаты: половина сообщений старше суток"""
+    for i in range(3):
+        db.register_user(f"user{i}", f"User {i}", "password")
+    group_id = db.create_chat('group', [1, 2, 3])
+    private_id = db.create_chat('private', [1, 2])
+    with db.pool.writer() as conn:
+        conn.executemany(
+            "INSERT INTO messages (chat_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime('now', ?))",
+            [(chat_id, 1, f"Сообщение {i}", '-2 days' if i % 2 else '-1 minutes')
+             for chat_id in (group_id, private_id) for i in range(1200)]
+        )
+        _refresh_chat_summaries(conn.cursor())
+    return group_id, private_id
+
+def message_counts(db):
+    return {chat['chat_id']: chat['message_count'] for chat in db.get_user_chats(1)}
+
+def test_retention_opt_in():
+    """Без политик ничего не удаляется и фоновый поток не запускается"""
+    assert parse_retention_policies('') == {}
+    assert parse_retention_policies('group=3600, private=86400') == {'group': 3600, 'private': 86400}
+    for text in ('group', 'group=soon', 'group=-1'):
+        try:
+            parse_retention_policies(text)
+            assert False, f"'{text}' должна отклоняться"
+        except ValueError:
+            pass
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db = DatabaseManager(os.path.join(temp_dir, 'keep.db'), archive_interval=None)
+        try:
+            group_id, private_id = fill_chats(db)
+            assert db.shards[0].retention._thread is None
+            assert not any(db.prune_expired_messages().values())
+            assert message_counts(db) == {group_id: 1200, private_id: 1200}
+        finally:
+            db.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    print("✅ Без политик сообщения не удаляются")
+
+def test_retention_prune():
+    """Политика удаляет только устаревшие сообщения своего типа чатов пакетами"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db = DatabaseManager(os.path.join(temp_dir, 'prune.db'), retention_policies={'group': 86400},
+                             retention_interval=None, archive_interval=None)
+        try:
+            group_id, private_id = fill_chats(db)
+            # User 1 не открывал группу, User 2 прочитал первые 1000 сообщений
+            with db.pool.writer() as conn:
+                ids = [row[0] for row in conn.execute("SELECT id FROM messages WHERE chat_id = ? ORDER BY id",
+                                                      (group_id,))]
+                conn.execute("UPDATE chat_reads SET last_read_message_id = 0, unread_count = 1200 "
+                             "WHERE chat_id = ? AND user_id = 2", (group_id,))
+                conn.execute("UPDATE chat_reads SET last_read_message_id = ?, unread_count = 200 "
+                             "WHERE chat_id = ? AND user_id = 3", (ids[999], group_id))
+
+            deleted = db.prune_expired_messages()
+            assert deleted == {'group': 600}, deleted
+            assert message_counts(db) == {group_id: 600, private_id: 1200}
+
+            # Удаленные сообщения уходят и из счетчиков непрочитанных
+            with db.pool.reader() as conn:
+                unread = dict(conn.execute("SELECT user_id, unread_count FROM chat_reads WHERE chat_id = ?",
+                                           (group_id,)).fetchall())
+            assert unread == {1: 0, 2: 600, 3: 100}, unread
+            assert db.prune_expired_messages() == {'group': 0}
+
+            stats = db.get_retention_stats()
+            assert stats['deleted'] == 600 and stats['batches'] >= 2
+            assert all(m['content'].startswith('Сообщение') for m in db.get_chat_messages(group_id, 100))
+        finally:
+            db.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    print("✅ Удалено 600 устаревших сообщений группы, приватный чат не тронут")
+
+def test_incremental_vacuum_conversion():
+    """Файл, созданный без auto_vacuum, переводится один раз"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE legacy (id INTEGER PRIMARY KEY)")
+        conn.close()
+
+        db = DatabaseManager(path, retention_interval=None, archive_interval=None)
+        try:
+            assert db.enable_incremental_vacuum() == {path: True}
+            assert db.enable_incremental_vacuum() == {path: False}
+        finally:
+            db.close()
+
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    print("✅ Старый файл переведен на auto_vacuum = INCREMENTAL")
+
+if __name__ == "__main__":
+    test_retention_opt_in()
+    test_retention_prune()
+    test_incremental_vacuum_conversion()
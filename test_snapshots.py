@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Онлайн-снимки базы: снимок восстанавливается в рабочую базу, ротация оставляет keep
+последних, поврежденная копия не становится снимком
+"""
+
+import sys
+import os
+import shutil
+import sqlite3
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager, SnapshotService
+
+def test_snapshot_restore_and_rotation():
+    """Снимок восстанавливает базу и архив на момент снимка; старые снимки удаляются"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, 'snap.db')
+        db = DatabaseManager(path, retention_interval=None, archive_interval=None, snapshot_keep=2)
+        try:
+            db.register_user("alice", "Alice", "password")
+            db.register_user("bob", "Bob", "password")
+            chat_id = db.get_or_create_private_chat(1, 2)
+            for i in range(200):
+                assert db.save_message(chat_id, 1, f"До снимка {i}")
+            with db.pool.writer() as conn:
+                conn.execute("UPDATE messages SET created_at = datetime('now', '-60 days')")
+            assert db.archive_old_messages() == 199
+
+            snapshot = db.create_snapshot()
+            assert snapshot and sorted(os.listdir(snapshot)) == ['snap.db', 'snap_archive.db']
+            for name in os.listdir(snapshot):
+                conn = sqlite3.connect(os.path.join(snapshot, name))
+                assert conn.execute("PRAGMA integrity_check").fetchone() == ('ok',)
+                conn.close()
+
+            before = db.create_snapshot()
+            assert db.save_message(chat_id, 2, "После снимка")
+            latest = db.create_snapshot()
+
+            # Ротация: из трех снимков остаются два последних
+            assert db.snapshots.list_snapshots() == [before, latest]
+            assert not os.path.exists(snapshot) and db.get_snapshot_stats()['snapshots'] == 2
+            print("✅ Ротация оставила 2 последних снимка")
+
+            os.makedirs(os.path.join(temp_dir, 'restore'))
+            for name in os.listdir(before):
+                shutil.copy(os.path.join(before, name), os.path.join(temp_dir, 'restore', name))
+        finally:
+            db.close()
+
+        restored = DatabaseManager(os.path.join(temp_dir, 'restore', 'snap.db'), retention_interval=None,
+                                   archive_interval=None)
+        try:
+            # База на момент снимка: сообщение после него не попало, архив на месте
+            history = restored.get_chat_messages_page(chat_id, 100)
+            assert history['messages'][0]['content'] == "До снимка 199"
+            assert restored.get_user_chats(1)[0]['message_count'] == 200
+            found = restored.search_messages(1, "снимка 123", limit=5)['messages']
+            assert [message['content'] for message in found] == ["До снимка 123"]
+        finally:
+            restored.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    print("✅ Восстановленная база совпадает со снимком, архив на месте")
+
+def test_snapshot_rejects_corrupted_copy():
+    """Копия, не прошедшая integrity_check, удаляется, а ошибка попадает в метрики"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, 'broken.db')
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE INDEX idx_items_value ON items (value)")
+        conn.executemany("INSERT INTO items (value) VALUES (?)", [(f"item{i:05d}",) for i in range(5000)])
+        conn.commit()
+        conn.close()
+        with open(path, 'r+b') as f:
+            f.seek(os.path.getsize(path) - 4096 * 3 + 200)
+            f.write(b'\xff' * 64)
+
+        service = SnapshotService([(path, None)], os.path.join(temp_dir, 'snapshots'))
+        try:
+            service.run_once()
+            assert False, "поврежденная база не должна давать снимок"
+        except sqlite3.DatabaseError:
+            pass
+        stats = service.stats()
+        assert stats['failed'] == 1 and stats['snapshots'] == 0 and stats['last_error']
+        assert os.listdir(os.path.join(temp_dir, 'snapshots')) == []
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    print("✅ Поврежденная копия отклонена")
+
+if __name__ == "__main__":
+    test_snapshot_restore_and_rotation()
+    test_snapshot_rejects_corrupted_copy()
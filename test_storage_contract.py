@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Один и тот же сценарий на движках хранения sqlite и memory:
+ответы должны совпадать, время показывает цену диска
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage import create_storage
+
+def run_scenario(db):
+    """Сценарий мессенджера; возвращает ответы без полей, зависящих от времени и ключей"""
+    assert db.register_user("alice", "Alice", "password")[0]
+    assert db.register_user("bob", "Bob", "password")[0]
+    assert not db.register_user("alice", "Alice 2", "password")[0]
+
+    ok, alice = db.authenticate_user("alice", "password")
+    assert ok and not db.authenticate_user("alice", "wrong")[0]
+    bob = db.find_user_by_display_name("Bob")
+
+    chat_id = db.get_or_create_private_chat(alice["user_id"], bob["user_id"])
+    assert db.get_or_create_private_chat(bob["user_id"], alice["user_id"]) == chat_id
+    for i in range(30):
+        sender = alice if i % 2 else bob
+        assert db.save_message(chat_id, sender["user_id"], f"Сообщение {i}")
+
+    first = db.get_chat_messages_page(chat_id, 10)
+    older = db.get_chat_messages_page(chat_id, 10, before_id=first["before_id"])
+    since = db.get_messages_since(chat_id, first["messages"][5]["id"])
+    found = db.search_messages(alice["user_id"], "сообщение 2", limit=5)
+
+    session = db.create_secure_chat_session("secret-key")
+    assert db.save_secure_message("secret-key", alice["user_id"], "тайна")
+    secure = db.get_secure_messages("secret-key")
+    assert db.close_secure_chat("secret-key") and db.get_secure_chat_session("secret-key") is None
+
+    # Счетчики непрочитанных: отправитель прочитал чат, частичное прочтение пересчитывается, отметка не идет назад
+    for i in range(3):
+        assert db.save_message(chat_id, alice["user_id"], f"Непрочитанное {i}")
+    unread_before = [c["unread_count"] for c in db.get_user_chats(bob["user_id"])]
+    latest = db.get_chat_messages_page(chat_id, 3)["messages"]
+    partial = db.mark_read(bob["user_id"], chat_id, latest[1]["id"])
+    assert db.mark_read(bob["user_id"], chat_id, latest[2]["id"]) == partial
+    full = db.mark_read(bob["user_id"], chat_id)
+    assert full["last_read_message_id"] == latest[0]["id"]
+    assert db.mark_read(bob["user_id"], 10 ** 6) is None
+
+    assert db.change_display_name(bob["user_id"], "Robert")
+    assert not db.change_display_name(alice["user_id"], "Robert")
+
+    def ids(page):
+        return [(m["sender_name"], m["content"]) for m in page["messages"]]
+
+    return {
+        "first": (ids(first), first["has_more"]),
+        "older": (ids(older), older["has_more"]),
+        "since": (ids(since), since["has_more"]),
+        "found": [m["content"] for m in found["messages"]],
+        "secure": [(m["content"], m["sender"]) for m in secure],
+        "session": session is not None,
+        "unread": (unread_before, partial["unread_count"], full["unread_count"],
+                   [c["unread_count"] for c in db.get_user_chats(alice["user_id"])]),
+        "chats": [(c["chat_type"], c["message_count"], c["last_message"], c["chat_name"], c["unread_count"])
+                  for c in db.get_user_chats(alice["user_id"])],
+        "info": db.get_chat_info(alice["user_id"], chat_id)["chat_name"],
+        "chat_ids": db.get_user_chat_ids(alice["user_id"]) == [chat_id],
+        "users": [u["display_name"] for u in db.search_users("rob")]
+    }
+
+def test_storage_contract():
+    """Движки sqlite и memory отвечают одинаково"""
+    temp_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        engines = (("sqlite", {"db_path": os.path.join(temp_dir, "contract.db"), "shards": 1}), ("memory", {}))
+        for engine, kwargs in engines:
+            db = create_storage(engine, **kwargs)
+            try:
+                started = time.perf_counter()
+                results[engine] = run_scenario(db)
+                print(f"⏱ {engine}: {(time.perf_counter() - started) * 1000:.1f} мс")
+            finally:
+                db.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    for key, expected in results["sqlite"].items():
+        assert results["memory"][key] == expected, f"{key}: {results['memory'][key]} != {expected}"
+    print("✅ Ответы движков совпадают")
+
+if __name__ == "__main__":
+    test_storage_contract()
@@ -8,6 +8,7 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from database import DatabaseManager
+from user_directory import UserDirectory
 
 def test_user_search():
     """Тестирование поиска пользователей"""
@@ -36,11 +37,33 @@ def test_user_search():
                 print(f"    ✅ Поиск по имени '{display_name}' - найден")
             else:
                 print(f"    ❌ Поиск по имени '{display_name}' - НЕ найден")
+            
+            # Тестируем поиск по началу имени через справочник
+            prefix = display_name[:3]
+            found_ids = [item['user_id'] for item in db.search_users(prefix, limit=100)]
+            if user_id in found_ids:
+                print(f"    ✅ Поиск по началу '{prefix}' - найден")
+            else:
+                print(f"    ❌ Поиск по началу '{prefix}' - НЕ найден")
         
         conn.close()
         
     except Exception as e:
         print(f"❌ Ошибка: {e}")
 
+def test_fuzzy_short_names():
+    """Нечеткий поиск коротких имен: опечатка и перестановка букв"""
+    directory = UserDirectory()
+    directory.load([(1, 'bob', 'Bob'), (2, 'alice', 'Alice'), (3, 'bobby', 'Bobby Smith'), (4, 'zed', 'Zed')])
+    
+    for query, user_id in [('Bbo', 1), ('Alcie', 2), ('Smiht', 3), ('Zde', 4)]:
+        found_ids = [item['user_id'] for item in directory.search(query)]
+        assert user_id in found_ids, f"'{query}' не нашел пользователя {user_id}: {found_ids}"
+        print(f"    ✅ Нечеткий поиск '{query}' - найден")
+    
+    assert directory.search('Xyz') == []
+    print("    ✅ Непохожее имя не найдено")
+
 if __name__ == "__main__":
     test_user_search()
+    test_fuzzy_short_names()
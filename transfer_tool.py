@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Потоковый экспорт и импорт пользователей, чатов и сообщений SecureMessenger.
+
+    python transfer_tool.py export messenger.db backup.ndjson            # JSON по строке на запись
+    python transfer_tool.py export messenger.db backup.bin binary        # компактный двоичный формат
+    python transfer_tool.py import messenger.db backup.ndjson            # формат определяется сам
+
+Импорт запускать при остановленном сервере: на время загрузки индексы сообщений отключаются.
+Данные читаются и пишутся пачками по BATCH_SIZE строк, память не зависит от размера базы.
+Прерванный запуск продолжается с последней сохраненной пачки: прогресс экспорта лежит в
+<файл>.progress, импорта - в <база>_import.json. id записей сохраняются, поэтому повтор
+пачки при продолжении ничего не дублирует. Импорт рассчитан на пустую базу или базу того же
+происхождения: пользователи с уже занятым логином пропускаются.
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from database import DatabaseManager, _migration_chat_reads, _migration_private_chat_pairs, _refresh_chat_summaries
+from message_archive import MessageArchive
+from shard_tool import current_shard_count
+
+BATCH_SIZE = 5000
+# Сегментов архива за одно чтение (в сегменте до нескольких сотен сообщений)
+ARCHIVE_SEGMENT_BATCH = 50
+
+# Таблицы в порядке выгрузки: сначала те, на которые ссылаются остальные
+TABLES = [
+    ('users', ('id', 'username', 'display_name', 'password_hash', 'secret_phrase', 'created_at')),
+    ('chats', ('id', 'chat_type', 'created_at')),
+    ('chat_participants', ('id', 'chat_id', 'user_id')),
+    ('secure_chats', ('id', 'chat_id', 'chat_key', 'encryption_key', 'session_id', 'created_at')),
+    ('messages', ('id', 'chat_id', 'sender_id', 'content', 'encrypted_content', 'message_type', 'created_at')),
+]
+COLUMNS = dict(TABLES)
+
+# Двоичный формат: сигнатура, затем пачки (код таблицы, число строк, длина) + zlib(JSON-массив строк)
+BINARY_MAGIC = b'SMEXPRT1'
+CHUNK_HEADER = struct.Struct('>BII')
+TABLE_CODES = {name: code for code, (name, _) in enumerate(TABLES, start=1)}
+END_CODE = 0
+NDJSON_HEADER = {"type": "header", "format": "securemessenger-export", "version": 1}
+
+def open_manager(db_path):
+    """DatabaseManager без фоновых задач, с раскладкой шардов, которая уже есть на диске"""
+    shards = current_shard_count(db_path) if os.path.exists(db_path) else None
+    return DatabaseManager(db_path, shards=shards, retention_interval=None, archive_interval=None)
+
+def load_progress(path):
+    """Сохраненный прогресс прерванного запуска (None - начинаем заново)"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_progress(path, progress):
+    """Атомарная запись прогресса: старая версия заменяется только целиком записанной новой"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+class Reporter:
+    """Вывод прогресса не чаще раза в секунду"""
+
+    def __init__(self, action, counts):
+        self.action = action
+        self.counts = counts
+        self.started = time.time()
+        self._last = 0
+
+    def report(self, force=False):
+        """Печать счетчиков и скорости"""
+        now = time.time()
+        if not force and now - self._last < 1:
+            return
+        self._last = now
+        total = sum(self.counts.values())
+        rate = total / max(now - self.started, 1e-6)
+        details = ', '.join(f"{name} {count}" for name, count in self.counts.items() if count)
+        print(f"{self.action}: {details or 0} ({rate:.0f} строк/с)")
+
+# Экспорт
+
+def export_streams(db):
+    """Источники строк в порядке выгрузки: (таблица, функция чтения пачки после ключа)"""
+    streams = []
+
+    def table_reader(pool, table):
+        def read(last_key):
+            with pool.reader() as conn:
+                rows = conn.execute(
+                    f"SELECT {', '.join(COLUMNS[table])} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_key, BATCH_SIZE)
+                ).fetchall()
+            return (rows[-1][0] if rows else last_key), rows
+        return read
+
+    def archive_reader(archive):
+        def read(last_key):
+            # Сообщения архива выгружаются как обычные; при импорте они попадают в горячую таблицу
+            with archive._lock:
+                segments = archive.conn.execute(
+                    "SELECT id, chat_id, payload FROM archive_segments WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_key, ARCHIVE_SEGMENT_BATCH)
+                ).fetchall()
+            rows = []
+            for _, chat_id, payload in segments:
+                for message in MessageArchive._unpack(payload):
+                    rows.append((message[0], chat_id) + tuple(message[1:]))
+            return (segments[-1][0] if segments else last_key), rows
+        return read
+
+    for table, _ in TABLES[:-1]:
+        streams.append((table, table_reader(db.pool, table)))
+    for shard in db.shards:
+        streams.append(('messages', table_reader(shard.pool, 'messages')))
+        if shard.archive:
+            streams.append(('messages', archive_reader(shard.archive)))
+    return streams
+
+class NdjsonWriter:
+    """Запись по одному JSON-объекту на строку"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def start(self):
+        self.f.write((json.dumps(NDJSON_HEADER) + '\n').encode('utf-8'))
+
+    def write(self, table, rows):
+        columns = COLUMNS[table]
+        lines = []
+        for row in rows:
+            record = {"type": table}
+            record.update(zip(columns, row))
+            lines.append(json.dumps(record, ensure_ascii=False))
+        self.f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def finish(self, counts):
+        self.f.write((json.dumps({"type": "end", "counts": counts}) + '\n').encode('utf-8'))
+
+class BinaryWriter:
+    """Запись сжатых пачек строк без имен колонок"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def start(self):
+        self.f.write(BINARY_MAGIC)
+
+    def write(self, table, rows):
+        payload = zlib.compress(json.dumps([list(row) for row in rows], ensure_ascii=False).encode('utf-8'))
+        self.f.write(CHUNK_HEADER.pack(TABLE_CODES[table], len(rows), len(payload)) + payload)
+
+    def finish(self, counts):
+        payload = zlib.compress(json.dumps(counts).encode('utf-8'))
+        self.f.write(CHUNK_HEADER.pack(END_CODE, 0, len(payload)) + payload)
+
+WRITERS = {'ndjson': NdjsonWriter, 'binary': BinaryWriter}
+
+def export_data(db_path, output_path, fmt='ndjson'):
+    """Выгрузка базы в файл; прерванная выгрузка продолжается с последней записанной пачки"""
+    if fmt not in WRITERS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    progress_path = output_path + '.progress'
+    progress = load_progress(progress_path)
+    if progress and progress.get('format') != fmt:
+        raise ValueError(f"Прерванная выгрузка в {output_path} шла в формате {progress.get('format')}")
+
+    db = open_manager(db_path)
+    try:
+        streams = export_streams(db)
+        if progress:
+            print(f"🔄 Продолжаем выгрузку с источника {progress['stream'] + 1} из {len(streams)}")
+            f = open(output_path, 'r+b')
+            # Все, что записано после последней сохраненной пачки, переписывается заново
+            f.truncate(progress['offset'])
+            f.seek(progress['offset'])
+        else:
+            progress = {'format': fmt, 'stream': 0, 'last_key': 0, 'offset': 0,
+                        'counts': {table: 0 for table, _ in TABLES}}
+            f = open(output_path, 'wb')
+
+        with f:
+            writer = WRITERS[fmt](f)
+            if progress['offset'] == 0:
+                writer.start()
+            reporter = Reporter("📤 Выгружено", progress['counts'])
+
+            while progress['stream'] < len(streams):
+                table, read = streams[progress['stream']]
+                last_key, rows = read(progress['last_key'])
+                if not rows and last_key == progress['last_key']:
+                    progress['stream'] += 1
+                    progress['last_key'] = 0
+                    continue
+
+                if rows:
+                    writer.write(table, rows)
+                    progress['counts'][table] += len(rows)
+                f.flush()
+                os.fsync(f.fileno())
+                progress['last_key'] = last_key
+                progress['offset'] = f.tell()
+                save_progress(progress_path, progress)
+                reporter.report()
+
+            writer.finish(progress['counts'])
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        db.close()
+
+    os.remove(progress_path)
+    reporter.report(force=True)
+    print(f"✅ Выгрузка завершена: {output_path}")
+    return progress['counts']
+
+# Импорт
+
+def read_ndjson(f):
+    """Пачки (таблица, строки, смещение после пачки) из файла NDJSON"""
+    table, rows = None, []
+    while True:
+        offset = f.tell()
+        line = f.readline()
+        record = json.loads(line) if line.strip() else None
+        kind = record['type'] if record else None
+
+        # Пачка заканчивается на смене таблицы, на BATCH_SIZE строк и в конце файла
+        if rows and (kind != table or len(rows) >= BATCH_SIZE):
+            yield table, rows, offset
+            table, rows = None, []
+
+        if not line:
+            return
+        if kind == 'end':
+            yield 'end', record.get('counts'), f.tell()
+            return
+        if kind in COLUMNS:
+            table = kind
+            rows.append(tuple(record.get(column) for column in COLUMNS[kind]))
+
+def read_binary(f):
+    """Пачки (таблица, строки, смещение после пачки) из двоичного файла"""
+    names = {code: name for name, code in TABLE_CODES.items()}
+    while True:
+        header = f.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            return
+        code, _, length = CHUNK_HEADER.unpack(header)
+        payload = json.loads(zlib.decompress(f.read(length)).decode('utf-8'))
+        if code == END_CODE:
+            yield 'end', payload, f.tell()
+            return
+        yield names[code], [tuple(row) for row in payload], f.tell()
+
+def message_pools(db):
+    """Пулы баз, в которых лежат сообщения"""
+    return [shard.pool for shard in db.shards]
+
+def drop_message_indexes(db):
+    """Отключение индексов и триггеров FTS сообщений на время загрузки; возвращает их SQL"""
+    dropped = {}
+    for pool in message_pools(db):
+        with pool.writer() as conn:
+            objects = conn.execute('''
+                SELECT type, name, sql FROM sqlite_master
+                WHERE tbl_name = 'messages' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+            ''').fetchall()
+            dropped[pool.db_path] = [[kind, name, sql] for kind, name, sql in objects]
+    return dropped
+
+def apply_drop(db, dropped):
+    """Удаление сохраненных в прогрессе индексов и триггеров"""
+    for pool in message_pools(db):
+        with pool.writer() as conn:
+            for kind, name, _ in dropped.get(pool.db_path, []):
+                conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+
+def restore_message_indexes(db, dropped):
+    """Построение отложенных индексов и пересборка полнотекстового индекса"""
+    for pool in message_pools(db):
+        with pool.writer() as conn:
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+            for kind, name, sql in dropped.get(pool.db_path, []):
+                if name not in existing:
+                    print(f"🔨 Строим {kind} {name}")
+                    conn.execute(sql)
+
+            if 'messages_fts' in existing:
+                print("🔨 Пересобираем полнотекстовый индекс")
+                conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+                conn.execute('''
+                    INSERT INTO messages_fts (rowid, content)
+                    SELECT id, content FROM messages WHERE message_type IS NOT 'secure'
+                ''')
+
+def load_rows(db, table, rows):
+    """Вставка пачки строк; возвращает число действительно добавленных"""
+    columns = COLUMNS[table]
+    sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    if table != 'messages':
+        with db.pool.writer() as conn:
+            inserted = conn.executemany(sql, rows).rowcount
+        if table == 'chats':
+            # Копия строк chats в шарды, как при create_chat
+            for shard in db.shards:
+                if shard.external:
+                    with shard.pool.writer() as conn:
+                        conn.executemany(sql, [row for row in rows if row[0] % shard.count == shard.index])
+        return inserted
+
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(db._shard(row[1]).index, []).append(row)
+    inserted = 0
+    for index, shard_rows in by_shard.items():
+        with db.shards[index].pool.writer() as conn:
+            inserted += conn.executemany(sql, shard_rows).rowcount
+    return inserted
+
+def rebuild_derived(db):
+    """Пересчет производных данных: пары приватных чатов, сводки чатов, отметки прочтения, границы id шардов"""
+    print("🔨 Пересчитываем пары приватных чатов и сводки чатов")
+    with db.pool.writer() as conn:
+        _migration_private_chat_pairs(conn.cursor())
+
+    for shard in db.shards:
+        last_chat_id = 0
+        while True:
+            with db.pool.reader() as conn:
+                chat_ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM chats WHERE id > ? AND id % ? = ? ORDER BY id LIMIT ?",
+                    (last_chat_id, shard.count, shard.index, BATCH_SIZE)
+                )]
+            if not chat_ids:
+                break
+            last_chat_id = chat_ids[-1]
+
+            if shard.external:
+                with shard.pool.reader() as messages, db.pool.writer() as conn:
+                    _refresh_chat_summaries(conn.cursor(), chat_ids, message_cursor=messages.cursor())
+            else:
+                with db.pool.writer() as conn:
+                    _refresh_chat_summaries(conn.cursor(), chat_ids)
+
+    # Загруженная история считается прочитанной
+    with db.pool.writer() as conn:
+        _migration_chat_reads(conn.cursor())
+
+    # Новые id сообщений в шардах должны быть больше всех загруженных
+    id_floor = 0
+    for shard in db.shards:
+        with shard.pool.reader() as conn:
+            id_floor = max(id_floor, conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0])
+    for shard in db.shards:
+        if shard.external:
+            with shard.pool.writer() as conn:
+                conn.execute('''
+                    INSERT INTO shard_meta (key, value) VALUES ('id_floor', ?)
+                    ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
+                ''', (id_floor,))
+
+    db.load_user_directory()
+
+def import_data(db_path, input_path):
+    """Загрузка файла выгрузки в базу; прерванная загрузка продолжается с последней пачки"""
+    root, _ = os.path.splitext(db_path)
+    progress_path = f"{root}_import.json"
+    progress = load_progress(progress_path)
+    if progress and os.path.abspath(progress['input']) != os.path.abspath(input_path):
+        raise ValueError(f"Не завершен импорт файла {progress['input']}: повторите его или удалите {progress_path}")
+
+    with open(input_path, 'rb') as f:
+        fmt = 'binary' if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC else 'ndjson'
+
+    db = open_manager(db_path)
+    try:
+        if progress:
+            print(f"🔄 Продолжаем импорт с этапа {progress['phase']}")
+        else:
+            progress = {'input': input_path, 'phase': 'load', 'offset': 0, 'dropped': None,
+                        'counts': {table: 0 for table, _ in TABLES}, 'skipped': 0, 'complete': False}
+
+        if progress['phase'] == 'load':
+            if progress['dropped'] is None:
+                # SQL индексов сохраняется до удаления, чтобы их можно было построить после сбоя
+                progress['dropped'] = drop_message_indexes(db)
+                save_progress(progress_path, progress)
+            apply_drop(db, progress['dropped'])
+
+            reporter = Reporter("📥 Загружено", progress['counts'])
+            with open(input_path, 'rb') as f:
+                f.seek(progress['offset'] or (len(BINARY_MAGIC) if fmt == 'binary' else 0))
+                for table, rows, offset in (read_binary(f) if fmt == 'binary' else read_ndjson(f)):
+                    if table == 'end':
+                        progress['complete'] = True
+                    else:
+                        inserted = load_rows(db, table, rows)
+                        progress['counts'][table] += inserted
+                        progress['skipped'] += len(rows) - inserted
+                    progress['offset'] = offset
+                    save_progress(progress_path, progress)
+                    reporter.report()
+            reporter.report(force=True)
+
+            if not progress['complete']:
+                print("⚠️ В файле нет отметки конца выгрузки - возможно, выгрузка была прервана")
+            progress['phase'] = 'indexes'
+            save_progress(progress_path, progress)
+
+        if progress['phase'] == 'indexes':
+            restore_message_indexes(db, progress['dropped'])
+            rebuild_derived(db)
+    finally:
+        db.close()
+
+    os.remove(progress_path)
+    if progress['skipped']:
+        print(f"ℹ️ Пропущено уже существующих записей: {progress['skipped']}")
+    print(f"✅ Импорт завершен: {db_path}")
+    return progress['counts']
+
+def main():
+    """Точка входа командной строки"""
+    if len(sys.argv) not in (4, 5) or sys.argv[1] not in ('export', 'import'):
+        print("Использование:")
+        print("  python transfer_tool.py export <путь к базе> <файл> [ndjson|binary]")
+        print("  python transfer_tool.py import <путь к базе> <файл>")
+        sys.exit(1)
+
+    if sys.argv[1] == 'export':
+        export_data(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) == 5 else 'ndjson')
+    else:
+        import_data(sys.argv[2], sys.argv[3])
+
+if __name__ == "__main__":
+    main()
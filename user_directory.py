@@ -0,0 +1,178 @@
+import bisect
+import threading
+from collections import defaultdict
+
+def normalize_name(name):
+    """Нормализация имени для поиска: регистр, пробелы, ё -> е"""
+    return ' '.join((name or '').casefold().replace('ё', 'е').split())
+
+def trigrams(name):
+    """Триграммы имени с границами слова"""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b):
+    """Расстояние Дамерау-Левенштейна (перестановка соседних букв - одна правка)"""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+class UserDirectory:
+    """Справочник пользователей в памяти: префиксный поиск и нечеткое совпадение по триграммам"""
+
+    # Минимальное сходство (коэффициент Жаккара по триграммам) для нечеткого совпадения
+    FUZZY_THRESHOLD = 0.3
+    # У коротких запросов почти нет общих триграмм с именем, поэтому они сравниваются по числу правок
+    SHORT_QUERY_LENGTH = 8
+    MAX_EDIT_DISTANCE = 1
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}  # {user_id: (username, display_name, normalized_name, число триграмм)}
+        self._sorted = []  # отсортированный список (normalized_name, user_id) для префиксного поиска
+        self._trigrams = defaultdict(set)  # {триграмма: {user_id}}
+
+    def __len__(self):
+        return len(self._users)
+
+    def load(self, rows):
+        """Полная загрузка справочника из строк (user_id, username, display_name)"""
+        with self._lock:
+            self._users.clear()
+            self._trigrams.clear()
+
+            entries = []
+            for user_id, username, display_name in rows:
+                normalized = normalize_name(display_name)
+                grams = trigrams(normalized)
+                self._users[user_id] = (username, display_name, normalized, len(grams))
+                entries.append((normalized, user_id))
+                for gram in grams:
+                    self._trigrams[gram].add(user_id)
+
+            entries.sort()
+            self._sorted = entries
+
+    def add(self, user_id, username, display_name):
+        """Добавление пользователя (или обновление существующего)"""
+        with self._lock:
+            if user_id in self._users:
+                self._remove_index(user_id)
+
+            normalized = normalize_name(display_name)
+            grams = trigrams(normalized)
+            self._users[user_id] = (username, display_name, normalized, len(grams))
+            bisect.insort(self._sorted, (normalized, user_id))
+            for gram in grams:
+                self._trigrams[gram].add(user_id)
+
+    def rename(self, user_id, display_name):
+        """Смена имени пользователя"""
+        with self._lock:
+            if user_id not in self._users:
+                return
+            username = self._users[user_id][0]
+            self.add(user_id, username, display_name)
+
+    def remove(self, user_id):
+        """Удаление пользователя из справочника"""
+        with self._lock:
+            if user_id in self._users:
+                self._remove_index(user_id)
+                del self._users[user_id]
+
+    def display_name(self, user_id):
+        """Имя пользователя по id (None - нет в справочнике)"""
+        entry = self._users.get(user_id)
+        return entry[1] if entry else None
+
+    def _remove_index(self, user_id):
+        """Удаление записей пользователя из индексов"""
+        normalized = self._users[user_id][2]
+
+        index = bisect.bisect_left(self._sorted, (normalized, user_id))
+        if index < len(self._sorted) and self._sorted[index] == (normalized, user_id):
+            del self._sorted[index]
+
+        for gram in trigrams(normalized):
+            members = self._trigrams.get(gram)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._trigrams[gram]
+
+    def search(self, query, limit=10):
+        """Поиск пользователей: сначала точное совпадение, затем префикс, затем похожие имена"""
+        normalized = normalize_name(query)
+        if not normalized or limit <= 0:
+            return []
+
+        with self._lock:
+            results = []
+            seen = set()
+
+            # Префиксный поиск: двоичный поиск по отсортированному списку, O(log n + limit)
+            index = bisect.bisect_left(self._sorted, (normalized,))
+            while index < len(self._sorted) and len(results) < limit:
+                name, user_id = self._sorted[index]
+                if not name.startswith(normalized):
+                    break
+                match = 'exact' if name == normalized else 'prefix'
+                results.append(self._entry(user_id, match, 1.0 if match == 'exact' else 0.9))
+                seen.add(user_id)
+                index += 1
+
+            if len(results) < limit:
+                results.extend(self._fuzzy(normalized, limit - len(results), seen))
+
+            # Точные совпадения раньше префиксных, внутри группы - более короткие имена
+            results.sort(key=lambda item: (-item['score'], len(item['display_name'])))
+            return results
+
+    def _fuzzy(self, normalized, limit, seen):
+        """Нечеткий поиск по общим триграммам"""
+        query_grams = trigrams(normalized)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for user_id in self._trigrams.get(gram, ()):
+                if user_id not in seen:
+                    shared[user_id] += 1
+
+        short = 3 <= len(normalized) < self.SHORT_QUERY_LENGTH
+        scored = []
+        for user_id, common in shared.items():
+            name_grams = self._users[user_id][3]
+            score = common / (len(query_grams) + name_grams - common)
+            if score < self.FUZZY_THRESHOLD and short:
+                score = self._short_score(normalized, self._users[user_id][2])
+            if score >= self.FUZZY_THRESHOLD:
+                scored.append((score, user_id))
+
+        scored.sort(key=lambda item: -item[0])
+        return [self._entry(user_id, 'fuzzy', round(score, 3)) for score, user_id in scored[:limit]]
+
+    def _short_score(self, query, name):
+        """Сходство короткого запроса с началом имени или одним из его слов по числу правок"""
+        candidates = name.split() + [name[:len(query)]]
+        distance = min(edit_distance(query, candidate) for candidate in candidates)
+        if distance > self.MAX_EDIT_DISTANCE:
+            return 0.0
+        return 1 - distance / len(query)
+
+    def _entry(self, user_id, match, score):
+        """Результат поиска в формате find_user_by_display_name"""
+        username, display_name = self._users[user_id][:2]
+        return {
+            "user_id": user_id,
+            "username": username,
+            "display_name": display_name,
+            "match": match,
+            "score": score
+        }
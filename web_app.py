@@ -3,7 +3,7 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 import json
 import uuid
 from datetime import datetime
-from database import DatabaseManager
+from storage import create_storage
 from crypto_utils import CryptoManager
 import threading
 import time
@@ -13,7 +13,7 @@ app.config['SECRET_KEY'] = 'secure_messenger_secret_key_2024'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # Инициализация компонентов
-db = DatabaseManager()
+db = create_storage()
 active_users = {}  # {session_id: {'user_id': int, 'username': str, 'display_name': str}}
 active_secure_chats = {}  # {chat_key: {'participants': [], 'encryption_key': str}}
 
@@ -90,6 +90,17 @@ def api_find_user():
     except Exception as e:
         return jsonify({'success': False, 'error': f'Ошибка сервера: {str(e)}'})
 
+@app.route('/api/search_users', methods=['POST'])
+def api_search_users():
+    """API поиска пользователей по началу имени"""
+    try:
+        data = request.get_json()
+        users = db.search_users(data.get('prefix', ''), data.get('limit', 10))
+        return jsonify({'success': True, 'users': users})
+            
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Ошибка сервера: {str(e)}'})
+
 @app.route('/api/get_chats', methods=['GET'])
 def api_get_chats():
     """API получения чатов"""
@@ -116,11 +127,68 @@ def api_get_messages():
         
         data = request.get_json()
         chat_id = data.get('chat_id')
-        limit = data.get('limit', 50)
         
-        messages = db.get_chat_messages(chat_id, limit)
+        # Курсор: before_id - более старые сообщения, after_id - более новые
+        page = db.get_chat_messages_page(
+            chat_id,
+            data.get('limit', 50),
+            before_id=data.get('before_id'),
+            after_id=data.get('after_id'),
+            direction=data.get('direction')
+        )
+        
+        return jsonify({
+            'success': True,
+            'messages': page['messages'],
+            'direction': page['direction'],
+            'has_more': page['has_more'],
+            'before_id': page['before_id'],
+            'after_id': page['after_id']
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Ошибка сервера: {str(e)}'})
+
+@app.route('/api/get_new_messages', methods=['POST'])
+def api_get_new_messages():
+    """API получения новых сообщений после водяной отметки after_id"""
+    try:
+        session_id = session.get('session_id')
+        if not session_id or session_id not in active_users:
+            return jsonify({'success': False, 'error': 'Не авторизован'})
+        
+        data = request.get_json()
+        chat_id = data.get('chat_id')
+        delta = db.get_messages_since(chat_id, data.get('after_id', 0))
+        
+        return jsonify({
+            'success': True,
+            'messages': delta['messages'],
+            'last_message_id': delta['last_message_id'],
+            'has_more': delta['has_more']
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Ошибка сервера: {str(e)}'})
+
+@app.route('/api/search_messages', methods=['POST'])
+def api_search_messages():
+    """API полнотекстового поиска по сообщениям"""
+    try:
+        session_id = session.get('session_id')
+        if not session_id or session_id not in active_users:
+            return jsonify({'success': False, 'error': 'Не авторизован'})
+        
+        data = request.get_json()
+        query = data.get('query', '').strip()
+        
+        if not query:
+            return jsonify({'success': False, 'error': 'Введите текст для поиска'})
+        
+        user_id = active_users[session_id]['user_id']
+        result = db.search_messages(user_id, query, data.get('limit', 20), data.get('cursor'))
         
-        return jsonify({'success': True, 'messages': messages})
+        return jsonify({'success': True, 'messages': result['messages'], 'next_cursor': result['next_cursor']})
         
     except Exception as e:
         return jsonify({'success': False, 'error': f'Ошибка сервера: {str(e)}'})